@@ -121,6 +121,12 @@ class AlipParams(object):
     PLY = 1.
     PBOUND = 5.
 
+    #MPC over footsteps only, states eliminated with the ALIP dynamics
+    B_CONDENSED = True
+    #footsteps from the offline table of alip_explicit_mpc.py, QP as fallback
+    B_EXPLICIT_MPC = False
+    EXPLICIT_MPC_PATH = 'data/alip_explicit_mpc.pt'
+
     RF_Z_MAX = 1000.0
 
     #COM
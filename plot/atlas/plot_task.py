@@ -2,7 +2,7 @@ import os
 import sys
 cwd = os.getcwd()
 sys.path.append(cwd)
-import pickle
+from util.columnar_history import HistoryReader
 
 import numpy as np
 import matplotlib
@@ -42,10 +42,10 @@ rf_z_max = dict()
 for topic in rf_z:
     rf_z_max[topic] = []
 
-with open('data/pnc.pkl', 'rb') as file:
+with HistoryReader('data/pnc.pkl') as file:
     while True:
         try:
-            d = pickle.load(file)
+            d = file.load()
             time.append(d['time'])
             phase.append(d['phase'])
             for topic in tasks:
@@ -2,7 +2,7 @@ import os
 import sys
 cwd = os.getcwd()
 sys.path.append(cwd)
-import pickle
+from util.columnar_history import HistoryReader
 
 import numpy as np
 import matplotlib
@@ -52,10 +52,10 @@ quat_err_list = dict()
 for topic in quat_err:
     quat_err_list[topic] = []
 
-with open('data/pnc.pkl', 'rb') as file:
+with HistoryReader('data/pnc.pkl') as file:
     while True:
         try:
-            d = pickle.load(file)
+            d = file.load()
             time.append(d['time'])
             phase.append(d['phase'])
             for topic in tasks:
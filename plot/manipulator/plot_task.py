@@ -2,7 +2,7 @@ import os
 import sys
 cwd = os.getcwd()
 sys.path.append(cwd)
-import pickle
+from util.columnar_history import HistoryReader
 
 import numpy as np
 import matplotlib
@@ -19,10 +19,10 @@ ee_vel_des, ee_vel_act = [], []
 jpos_des, jpos_act = [], []
 jvel_des, jvel_act = [], []
 
-with open('data/pnc.pkl', 'rb') as file:
+with HistoryReader('data/pnc.pkl') as file:
     while True:
         try:
-            d = pickle.load(file)
+            d = file.load()
             time.append(d['time'])
             ee_pos_des.append(d['ee_pos_des'])
             ee_pos_act.append(d['ee_pos_act'])
@@ -3,7 +3,7 @@ import shutil
 import sys
 cwd = os.getcwd()
 sys.path.append(cwd)
-import pickle
+from util.columnar_history import HistoryReader
 
 
 import numpy as np
@@ -299,10 +299,10 @@ if __name__ == '__main__':
     
     counter = 0
     counter2 = 0
-    with open('data/pnc.pkl', 'rb') as file:
+    with HistoryReader('data/pnc.pkl') as file:
         while True:
             try:
-                d = pickle.load(file)
+                d = file.load()
                 #print(d)
                 counter += 1
     
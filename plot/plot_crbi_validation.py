@@ -2,7 +2,7 @@ import os
 import sys
 cwd = os.getcwd()
 sys.path.append(cwd)
-import pickle
+from util.columnar_history import HistoryReader
 
 import numpy as np
 import matplotlib.pyplot as plt
@@ -29,10 +29,10 @@ gt_inertia = []
 gt_inertia_normalized = []
 est_inertia = []
 est_inertia_normalized = []
-with open(args.file, 'rb') as file:
+with HistoryReader(args.file) as file:
     while True:
         try:
-            d = pickle.load(file)
+            d = file.load()
             gt_inertia.append(d['gt_inertia'])
             gt_inertia_normalized.append(d['gt_inertia_normalized'])
             est_inertia.append(d['est_inertia'])
@@ -1,7 +1,9 @@
 import os
+import atexit
 
 import numpy as np
-import pickle
+
+from util.columnar_history import ColumnarHistory
 
 
 class MetaSingleton(type):
@@ -18,6 +20,9 @@ class DataSaver(metaclass=MetaSingleton):
     """
     Data Saver:
         add topics --> advance
+    advance copies the topics into columnar buffers, a background thread
+    writes them to file in chunks. Read the file back with
+    util.columnar_history.HistoryReader.
     """
     def __init__(self, filename='pnc.pkl'):
         self._history = dict()
@@ -27,12 +32,20 @@ class DataSaver(metaclass=MetaSingleton):
             if f == filename:
                 os.remove('data/' + f)
         self._file = open('data/' + filename, 'ab')
+        self._columns = ColumnarHistory(self._file)
+        self._b_closed = False
+        # scripts usually end on SIGINT / sys.exit, flush the last chunk then
+        atexit.register(self.close)
 
     def add(self, key, value):
         self._history[key] = value
 
     def advance(self):
-        pickle.dump(self._history, self._file)
+        self._columns.append(self._history)
 
     def close(self):
+        if self._b_closed:
+            return
+        self._b_closed = True
+        self._columns.close()
         self._file.close()
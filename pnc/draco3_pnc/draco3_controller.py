@@ -64,8 +64,9 @@ class Draco3Controller(object):
             self.first_visit()
 
         # Dynamics properties
+        self._robot.compute_all_terms()
         mass_matrix = self._robot.get_mass_matrix()
-        mass_matrix_inv = np.linalg.inv(mass_matrix)
+        mass_matrix_inv = self._robot.get_mass_matrix_inv()
         coriolis = self._robot.get_coriolis()
         gravity = self._robot.get_gravity()
         self._ihwbc.update_setting(mass_matrix, mass_matrix_inv, coriolis,
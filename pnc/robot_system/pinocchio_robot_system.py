@@ -44,6 +44,7 @@ class PinocchioRobotSystem(RobotSystem):
 
         self._data, self._collision_data, self._visual_data = pin.createDatas(
             self._model, self._collision_model, self._visual_model)
+        self._invalidate_cache()
 
         self._n_q = self._model.nq
         self._n_q_dot = self._model.nv
@@ -139,6 +140,7 @@ class PinocchioRobotSystem(RobotSystem):
                       b_cent=False):
 
         assert len(joint_pos.keys()) == self._n_a
+        self._invalidate_cache()
 
         self._q = np.zeros(self._n_q)
         self._q_dot = np.zeros(self._n_q_dot)
@@ -180,7 +182,9 @@ class PinocchioRobotSystem(RobotSystem):
 
     def _update_centroidal_quantities(self):
         pin.ccrba(self._model, self._data, self._q, self._q_dot)
+        self._copy_centroidal_quantities()
 
+    def _copy_centroidal_quantities(self):
         self._hg = np.zeros_like(self._data.hg)
         self._hg[0:3] = np.copy(self._data.hg.angular)
         self._hg[3:6] = np.copy(self._data.hg.linear)
@@ -193,6 +197,56 @@ class PinocchioRobotSystem(RobotSystem):
         self._Ig[0:3, 0:3] = np.copy(self._data.Ig)[3:6, 3:6]
         self._Ig[3:6, 3:6] = np.copy(self._data.Ig)[0:3, 0:3]
 
+    def _invalidate_cache(self):
+        """
+        Drop every kinematics/dynamics quantity computed for the previous
+        (q, q_dot). Only update_system should call this.
+        """
+        self._cache = dict()
+        self._kin_flags = set()
+
+    def _cached(self, key, fn):
+        if key not in self._cache:
+            self._cache[key] = np.copy(fn())
+        return np.copy(self._cache[key])
+
+    def _update_kinematics(self, flag):
+        """
+        Run a whole-tree Pinocchio pass at most once per update_system
+            jacobians: joint jacobians for frame jacobians
+            zero_acc: forward kinematics with zero acceleration for jdot_qdot
+        """
+        if flag in self._kin_flags:
+            return
+        if flag == 'jacobians':
+            pin.computeJointJacobians(self._model, self._data, self._q)
+        elif flag == 'zero_acc':
+            pin.forwardKinematics(self._model, self._data, self._q,
+                                  self._q_dot, 0 * self._q_dot)
+        else:
+            raise ValueError("wrong kinematics pass")
+        self._kin_flags.add(flag)
+
+    def compute_all_terms(self):
+        if 'all_terms' in self._kin_flags:
+            return
+        pin.computeAllTerms(self._model, self._data, self._q, self._q_dot)
+        # Only the upper triangular parts of M and Minv are guaranteed
+        self._cache['mass_matrix'] = np.triu(
+            self._data.M) + np.triu(self._data.M, 1).transpose()
+        self._cache['gravity'] = np.copy(self._data.g)
+        self._cache['coriolis'] = self._data.nle - self._data.g
+        self._cache['com_pos'] = np.copy(self._data.com[0])
+        self._cache['com_lin_vel'] = np.copy(self._data.vcom[0])
+        self._cache['com_lin_jacobian'] = np.copy(self._data.Jcom)
+        self._copy_centroidal_quantities()
+        pin.computeMinverse(self._model, self._data, self._q)
+        self._cache['mass_matrix_inv'] = np.triu(
+            self._data.Minv) + np.triu(self._data.Minv, 1).transpose()
+        # Joint jacobians are up to date, data.a is not the zero acc one
+        self._kin_flags.discard('zero_acc')
+        self._kin_flags.update(['jacobians', 'all_terms'])
+
     def get_q(self):
         return np.copy(self._q)
 
@@ -200,79 +254,121 @@ class PinocchioRobotSystem(RobotSystem):
         return np.copy(self._q_dot)
 
     def get_mass_matrix(self):
-        return np.copy(pin.crba(self._model, self._data, self._q))
+        return self._cached(
+            'mass_matrix', lambda: pin.crba(self._model, self._data, self._q))
+
+    def get_mass_matrix_inv(self):
+
+        def _mass_matrix_inv():
+            minv = pin.computeMinverse(self._model, self._data, self._q)
+            return np.triu(minv) + np.triu(minv, 1).transpose()
+
+        return self._cached('mass_matrix_inv', _mass_matrix_inv)
 
     def get_gravity(self):
-        return np.copy(
-            pin.computeGeneralizedGravity(self._model, self._data, self._q))
+
+        def _gravity():
+            self._kin_flags.discard('zero_acc')
+            return pin.computeGeneralizedGravity(self._model, self._data,
+                                                 self._q)
+
+        return self._cached('gravity', _gravity)
 
     def get_coriolis(self):
-        return np.copy(
-            pin.nonLinearEffects(self._model, self._data, self._q, self._q_dot)
-            - self.get_gravity())
+
+        def _coriolis():
+            self._kin_flags.discard('zero_acc')
+            return pin.nonLinearEffects(self._model, self._data, self._q,
+                                        self._q_dot) - self.get_gravity()
+
+        return self._cached('coriolis', _coriolis)
 
     def get_com_pos(self):
-        pin.centerOfMass(self._model, self._data, self._q, self._q_dot)
-        return np.copy(self._data.com[0])
+
+        def _com_pos():
+            pin.centerOfMass(self._model, self._data, self._q, self._q_dot)
+            return self._data.com[0]
+
+        return self._cached('com_pos', _com_pos)
 
     def get_com_lin_vel(self):
-        pin.centerOfMass(self._model, self._data, self._q, self._q_dot)
-        return np.copy(self._data.vcom[0])
+
+        def _com_lin_vel():
+            pin.centerOfMass(self._model, self._data, self._q, self._q_dot)
+            return self._data.vcom[0]
+
+        return self._cached('com_lin_vel', _com_lin_vel)
 
     def get_com_lin_jacobian(self):
-        return np.copy(
-            pin.jacobianCenterOfMass(self._model, self._data, self._q))
+        return self._cached(
+            'com_lin_jacobian',
+            lambda: pin.jacobianCenterOfMass(self._model, self._data, self._q))
 
     def get_com_lin_jacobian_dot(self):
-        return np.copy((pin.computeCentroidalMapTimeVariation(
-            self._model, self._data, self._q, self._q_dot)[0:3, :]) /
-                       self._total_mass)
+        return self._cached(
+            'com_lin_jacobian_dot',
+            lambda: (pin.computeCentroidalMapTimeVariation(
+                self._model, self._data, self._q, self._q_dot)[0:3, :]) /
+            self._total_mass)
 
     def get_link_iso(self, link_id):
-        ret = np.eye(4)
-        frame_id = self._model.getFrameId(link_id)
-        trans = pin.updateFramePlacement(self._model, self._data, frame_id)
-        ret[0:3, 0:3] = trans.rotation
-        ret[0:3, 3] = trans.translation
-        return np.copy(ret)
+
+        def _link_iso():
+            ret = np.eye(4)
+            frame_id = self._model.getFrameId(link_id)
+            trans = pin.updateFramePlacement(self._model, self._data,
+                                             frame_id)
+            ret[0:3, 0:3] = trans.rotation
+            ret[0:3, 3] = trans.translation
+            return ret
+
+        return self._cached(('link_iso', link_id), _link_iso)
 
     def get_link_vel(self, link_id):
-        ret = np.zeros(6)
-        frame_id = self._model.getFrameId(link_id)
 
-        spatial_vel = pin.getFrameVelocity(
-            self._model, self._data, frame_id,
-            pin.ReferenceFrame.LOCAL_WORLD_ALIGNED)
+        def _link_vel():
+            ret = np.zeros(6)
+            frame_id = self._model.getFrameId(link_id)
 
-        ret[0:3] = spatial_vel.angular
-        ret[3:6] = spatial_vel.linear
+            spatial_vel = pin.getFrameVelocity(
+                self._model, self._data, frame_id,
+                pin.ReferenceFrame.LOCAL_WORLD_ALIGNED)
 
-        return np.copy(ret)
+            ret[0:3] = spatial_vel.angular
+            ret[3:6] = spatial_vel.linear
+            return ret
+
+        return self._cached(('link_vel', link_id), _link_vel)
 
     def get_link_jacobian(self, link_id):
-        frame_id = self._model.getFrameId(link_id)
-        pin.computeJointJacobians(self._model, self._data, self._q)
-        jac = pin.getFrameJacobian(self._model, self._data, frame_id,
-                                   pin.ReferenceFrame.LOCAL_WORLD_ALIGNED)
 
-        # Pinocchio has linear on top of angular
-        ret = np.zeros_like(jac)
-        ret[0:3] = jac[3:6]
-        ret[3:6] = jac[0:3]
+        def _link_jacobian():
+            frame_id = self._model.getFrameId(link_id)
+            self._update_kinematics('jacobians')
+            jac = pin.getFrameJacobian(self._model, self._data, frame_id,
+                                       pin.ReferenceFrame.LOCAL_WORLD_ALIGNED)
+
+            # Pinocchio has linear on top of angular
+            ret = np.zeros_like(jac)
+            ret[0:3] = jac[3:6]
+            ret[3:6] = jac[0:3]
+            return ret
 
-        return np.copy(ret)
+        return self._cached(('link_jacobian', link_id), _link_jacobian)
 
     def get_link_jacobian_dot_times_qdot(self, link_id):
-        frame_id = self._model.getFrameId(link_id)
 
-        pin.forwardKinematics(self._model, self._data, self._q, self._q_dot,
-                              0 * self._q_dot)
-        jdot_qdot = pin.getFrameClassicalAcceleration(
-            self._model, self._data, frame_id,
-            pin.ReferenceFrame.LOCAL_WORLD_ALIGNED)
+        def _link_jacobian_dot_times_qdot():
+            frame_id = self._model.getFrameId(link_id)
+            self._update_kinematics('zero_acc')
+            jdot_qdot = pin.getFrameClassicalAcceleration(
+                self._model, self._data, frame_id,
+                pin.ReferenceFrame.LOCAL_WORLD_ALIGNED)
 
-        ret = np.zeros_like(jdot_qdot)
-        ret[0:3] = jdot_qdot.angular
-        ret[3:6] = jdot_qdot.linear
+            ret = np.zeros(6)
+            ret[0:3] = jdot_qdot.angular
+            ret[3:6] = jdot_qdot.linear
+            return ret
 
-        return np.copy(ret)
+        return self._cached(('link_jacobian_dot_times_qdot', link_id),
+                            _link_jacobian_dot_times_qdot)
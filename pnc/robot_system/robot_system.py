@@ -283,6 +283,23 @@ class RobotSystem(abc.ABC):
         """
         pass
 
+    def get_mass_matrix_inv(self):
+        """
+        Returns
+        -------
+        A_inv (np.array): Inverse of the mass matrix
+        """
+        return np.linalg.inv(self.get_mass_matrix())
+
+    def compute_all_terms(self):
+        """
+        Compute mass matrix, its inverse, coriolis, gravity, jacobians and
+        centroidal quantities of the current state in a single pass, so that
+        the getters afterwards read from that snapshot. Robot systems without
+        a single-pass implementation keep computing them lazily.
+        """
+        pass
+
     @abc.abstractmethod
     def get_gravity(self):
         """
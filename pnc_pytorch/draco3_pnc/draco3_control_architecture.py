@@ -38,7 +38,7 @@ class Draco3ControlArchitecture(ControlArchitecture):
         # Initialize Planner
         # ======================================================================
         self._alip_mpc = ALIPtorch_mpc(robot, PnCConfig.SAVE_DATA)
-        self._alip_mpc_qpsolv = ALIPtorch_mpc_qpsolv(robot, PnCConfig.SAVE_DATA)
+        self._alip_mpc_qpsolv = ALIPtorch_mpc_qpsolv(robot, PnCConfig.SAVE_DATA, self._n_batch)
         # ======================================================================
         # Initialize Task Manager
         # ======================================================================
@@ -105,21 +105,30 @@ class Draco3ControlArchitecture(ControlArchitecture):
         self._state_machine[WalkingState.BALANCE] = DoubleSupportBalance(self._n_batch,
             WalkingState.BALANCE, self._alip_tm, robot)
         
+        self._sp = Draco3StateProvider()
+
+        self.reset()
+
+    def reset(self):
+        """
+        Bring the controller back to its starting state without rebuilding it
+        (robot model, WBC and MPC matrices are kept)
+        """
+        self._tci_container.reset()
+        self._draco3_controller.reset()
+        self._alip_mpc_qpsolv.reset()
+        self._state_machine[WalkingState.ALIP].reset()
+
         # Set Starting State
         #self._state = WalkingState.STAND
         self._state = WalkingState.STAND
         self._prev_state = WalkingState.STAND
         self._b_state_first_visit = True
 
-        self._sp = Draco3StateProvider()
-
         self._new_step_list = torch.ones(self._n_batch) # each get_command substracts 1
                                                         # switch_leg set ids to 3 --> tunable parameter
                                                         # new step is computed for ids == 0
                                                         # one step for ids <= 0
-                                                        
-
-
 
     def get_command(self, rl_action):
         #ASSUMES ALL THE SIMULATIONS START WITH ALIP AT THE SAME TIME
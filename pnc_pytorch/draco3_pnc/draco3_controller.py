@@ -25,17 +25,19 @@ class Draco3Controller(object):
         n_active = torch.count_nonzero(torch.tensor(act_list))
         n_passive = n_q_dot - n_active - 6
 
-        self._sa = torch.zeros((n_active, n_q_dot), dtype=torch.double).expand(self._n_batch, -1, -1)
-        self._sv = torch.zeros((n_passive, n_q_dot), dtype=torch.double).expand(self._n_batch, -1, -1)
+        self._sa = torch.zeros((n_active, n_q_dot), dtype=torch.double)
+        self._sv = torch.zeros((n_passive, n_q_dot), dtype=torch.double)
         j, k = 0, 0
         for i in range(n_q_dot):
             if i >= 6:
                 if act_list[i]:
-                    self._sa[:, j, i] = 1.
+                    self._sa[j, i] = 1.
                     j += 1
                 else:
-                    self._sv[:, k, i] = 1.
+                    self._sv[k, i] = 1.
                     k += 1
+        self._sa = self._sa.expand(self._n_batch, -1, -1)
+        self._sv = self._sv.expand(self._n_batch, -1, -1)
         self._sf = torch.zeros((6, n_q_dot), dtype=torch.double)
         self._sf[0:6, 0:6] = torch.eye(6)
         self._sf = self._sf.expand(self._n_batch, -1, -1)
@@ -54,6 +56,9 @@ class Draco3Controller(object):
         if PnCConfig.SAVE_DATA:
             self._data_saver = DataSaver()
 
+    def reset(self):
+        self._b_first_visit = True
+
     def get_command(self):
         """
         if self._b_first_visit:
@@ -61,8 +66,9 @@ class Draco3Controller(object):
         """
 
         # Dynamics properties
+        self._robot.compute_all_terms()
         mass_matrix = self._robot.get_mass_matrix()
-        mass_matrix_inv = torch.linalg.inv(mass_matrix)
+        mass_matrix_inv = self._robot.get_mass_matrix_inv()
         coriolis = self._robot.get_coriolis()
         gravity = self._robot.get_gravity()
 
@@ -98,8 +104,10 @@ class Draco3Controller(object):
             self._data_saver.add('joint_trq_cmd', joint_trq_cmd)
 
 
-        #TODO: change when robot changed
-        joint_trq_cmd = joint_trq_cmd[0].numpy()
+        if self._n_batch == 1:
+            joint_trq_cmd = joint_trq_cmd[0].numpy()
+        else:
+            joint_trq_cmd = joint_trq_cmd.numpy()
         command = self._robot.create_cmd_ordered_dict(joint_trq_cmd) #TODO: addd integration step
         return command
 
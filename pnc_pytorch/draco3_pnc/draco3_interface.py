@@ -3,7 +3,6 @@ import sys
 cwd = os.getcwd()
 sys.path.append(cwd)
 import time, math
-import copy
 
 import pybullet as p
 
@@ -18,9 +17,9 @@ from pnc_pytorch.data_saver import DataSaver
 
 
 class Draco3Interface(Interface):
-    def __init__(self):
+    def __init__(self, n_batch = None):
         super(Draco3Interface, self).__init__()
-        self._n_batch = AlipParams.N_BATCH
+        self._n_batch = AlipParams.N_BATCH if n_batch is None else n_batch
         if PnCConfig.DYN_LIB == "dart":
             from pnc_pytorch.robot_system.dart_robot_system import DartRobotSystem
             self._robot = DartRobotSystem(
@@ -49,6 +48,16 @@ class Draco3Interface(Interface):
             self._data_saver.add('joint_trq_limit',
                                  self._robot.joint_trq_limit)
 
+    def reset(self):
+        """
+        Reset the controller in place for a new episode, the robot model and
+        the precomputed WBC / MPC matrices are reused
+        """
+        self._count = 0
+        self._running_time = 0.
+        self._sp.reset(self._robot, self._n_batch)
+        self._control_architecture.reset()
+
     def get_command(self, input_command, verbose = False):
         if PnCConfig.SAVE_DATA:
             self._data_saver.add('time', self._running_time)
@@ -85,9 +94,8 @@ class Draco3Interface(Interface):
         self._sp.prev_state = self._control_architecture.prev_state
         self._sp.state = self._control_architecture.state
 
-        res = (command, trigger, rl_obs)
-        #assert False
-        return copy.deepcopy(res)
+        # every entry is freshly computed this tick, no copy needed
+        return command, trigger, rl_obs
 
     @property
     def interrupt_logic(self):
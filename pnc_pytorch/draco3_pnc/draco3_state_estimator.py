@@ -1,5 +1,9 @@
+from collections import OrderedDict
+from collections.abc import Mapping
+
 import numpy as np
 import torch 
+from scipy.spatial.transform import Rotation as R
 from config.draco3_alip_config import PnCConfig
 from util import util
 from pnc_pytorch.draco3_pnc.draco3_state_provider import Draco3StateProvider
@@ -11,25 +15,84 @@ class Draco3StateEstimator(object):
         self._robot = robot
         self._n_batch = n_batch
         self._sp = Draco3StateProvider(self._robot, n_batch)
+        # joint ordering of the sensor dicts -> q / q_dot index, resolved once
+        self._sensor_joint_idx = dict()
 
     def initialize(self, sensor_data):
-        self._sp.nominal_joint_pos = sensor_data["joint_pos"]
+        # read by joint name (UpperBodyTrajectoryManager), arrays are keyed too
+        self._sp.nominal_joint_pos = self._joint_dict(sensor_data["joint_pos"])
 
     def update(self, sensor_data):
 
         # Update Encoders
-        self._robot.update_system(
-            sensor_data["base_com_pos"], sensor_data["base_com_quat"],
-            sensor_data["base_com_lin_vel"], sensor_data["base_com_ang_vel"],
-            sensor_data["base_joint_pos"], sensor_data["base_joint_quat"],
-            sensor_data["base_joint_lin_vel"],
-            sensor_data["base_joint_ang_vel"], sensor_data["joint_pos"],
-            sensor_data["joint_vel"])
+        q, q_dot = self._generalized_state(sensor_data)
+        self._robot.update_system_from_arrays(q, q_dot)
 
         # Update Contact Info
-        # TODO: change when new interface
-        self._sp.b_rf_contact = [sensor_data["b_rf_contact"]] * self._n_batch
-        self._sp.b_lf_contact = [sensor_data["b_lf_contact"]] * self._n_batch
+        self._sp.b_rf_contact = self._contact_to_batch(sensor_data["b_rf_contact"])
+        self._sp.b_lf_contact = self._contact_to_batch(sensor_data["b_lf_contact"])
+
+    def _generalized_state(self, sensor_data):
+        """
+        [n_batch, n_q], [n_batch, n_q_dot] of the sensor data, the base
+        joint twist is expressed in the base joint frame
+        """
+        q = np.zeros((self._n_batch, self._robot.n_q))
+        q_dot = np.zeros((self._n_batch, self._robot.n_q_dot))
+        if self._robot.n_floating > 0:
+            base_joint_quat = np.broadcast_to(sensor_data["base_joint_quat"],
+                                              (self._n_batch, 4))
+            q[:, 0:3] = sensor_data["base_joint_pos"]
+            q[:, 3:7] = base_joint_quat
+            rot_w_basejoint = R.from_quat(base_joint_quat).as_matrix()
+            q_dot[:, 0:3] = np.einsum('...ji,...j->...i', rot_w_basejoint,
+                                      sensor_data["base_joint_lin_vel"])
+            q_dot[:, 3:6] = np.einsum('...ji,...j->...i', rot_w_basejoint,
+                                      sensor_data["base_joint_ang_vel"])
+
+        q_idx, q_dot_idx, joint_pos = self._joint_array(sensor_data["joint_pos"])
+        q[:, q_idx] = joint_pos
+        q_idx, q_dot_idx, joint_vel = self._joint_array(sensor_data["joint_vel"])
+        q_dot[:, q_dot_idx] = joint_vel
+        return q, q_dot
+
+    def _joint_array(self, joint):
+        """
+        q index, q_dot index and [n_batch, n_joint] values of a joint dict
+        (float or [n_batch] values) or of an [n_a] / [n_batch, n_a] array
+        in the robot joint order
+        """
+        if not isinstance(joint, Mapping):
+            n_base_q = self._robot.n_q - self._robot.n_a
+            return (slice(n_base_q, None), slice(self._robot.n_floating, None),
+                    joint)
+        names = tuple(joint.keys())
+        idx = self._sensor_joint_idx.get(names)
+        if idx is None:
+            idx = self._sensor_joint_idx[names] = (
+                np.array(self._robot.get_q_idx(list(names))),
+                np.array(self._robot.get_q_dot_idx(list(names))))
+        return idx[0], idx[1], np.array(list(joint.values()), dtype=np.float64).T
+
+    def _joint_dict(self, joint):
+        """
+        Joint dict of a joint dict, or of an [n_a] / [n_batch, n_a] array in
+        the robot joint order (copied, the values are floats or [n_batch])
+        """
+        if isinstance(joint, Mapping):
+            return joint
+        n_base_q = self._robot.n_q - self._robot.n_a
+        joint = np.array(joint, dtype=np.float64)
+        names = sorted(self._robot.joint_id, key=self._robot.get_q_idx)
+        return OrderedDict(
+            (k, joint[..., self._robot.get_q_idx(k) - n_base_q]) for k in names)
+
+    def _contact_to_batch(self, b_contact):
+        # Single contact flag shared by every environment or one per environment
+        if isinstance(b_contact, (list, tuple, np.ndarray, torch.Tensor)):
+            assert len(b_contact) == self._n_batch
+            return [bool(b) for b in b_contact]
+        return [b_contact] * self._n_batch
 
 
     def inertia_to_com_torso_coor(self):
@@ -56,5 +119,4 @@ class Draco3StateEstimator(object):
         self._sp.com_pos_stance_frame = com_pos_stleg_torso_ori
         self._sp.L_stance_frame = L
         self._sp.stleg_pos = stleg_pos
-        #TODO remove squeeze
-        self._sp.torso_roll_pitch_yaw = torch.cat(orbit_util.euler_xyz_from_quat(torso_quat)).unsqueeze(0)
+        self._sp.torso_roll_pitch_yaw = torch.stack(orbit_util.euler_xyz_from_quat(torso_quat), dim = 1)
@@ -28,7 +28,13 @@ class AlipLocomotion(StateMachine):
         self._alip_mpc = alip_mpc
         self._tci_container = tci_container
         self._sp = Draco3StateProvider()
+        self.reset()
 
+        self._b_data_save = data_save
+        if self._b_data_save:
+            self._data_saver = DataSaver()
+
+    def reset(self):
         #params after will implement in set params
         self._stance_leg = AlipParams.INITIAL_STANCE_LEG * torch.ones(self._n_batch)
         self._Ts        = AlipParams.TS        * torch.ones(self._n_batch, dtype = torch.double)
@@ -39,10 +45,6 @@ class AlipLocomotion(StateMachine):
         self._des_com_yaw = AlipParams.COM_YAW * torch.ones(self._n_batch, dtype = torch.double)
         self._mass = AlipParams.MASS
 
-        self._b_data_save = data_save
-        if self._b_data_save:
-            self._data_saver = DataSaver()
-
     def first_visit(self):
         self._state_machine_start_time = self._sp.curr_time * torch.ones(self._n_batch, dtype = torch.double)
         self._trajectory_manager.initializeOri()
@@ -50,6 +52,7 @@ class AlipLocomotion(StateMachine):
 
 
     def new_step(self, ids, rl_action):
+        rl_action = rl_action[ids] #rl_action holds one row per environment
         #self._Ts = self._sp.Ts
         self._Lx_offset = self._sp.Lx_offset
         self._Ly_des = self._sp.Ly_des
@@ -63,21 +66,20 @@ class AlipLocomotion(StateMachine):
         #self._des_com_yaw = AlipParams.COM_YAW * torch.ones(self._n_batch, dtype = torch.double)
         self._trajectory_manager.des_com_yaw(self._des_com_yaw[ids], ids)
 
-        com_pos = self._robot.get_com_pos()[ids]
-        com_vel = self._robot.get_com_lin_vel()[ids]
-        rfoot_pos = self._robot.get_link_iso("r_foot_contact")[ids, 0:3, 3]
-        lfoot_pos = self._robot.get_link_iso("l_foot_contact")[ids, 0:3, 3]
+        com_pos = self._robot.get_com_pos()
+        com_vel = self._robot.get_com_lin_vel()
+        rfoot_pos = self._robot.get_link_iso("r_foot_contact")[:, 0:3, 3]
+        lfoot_pos = self._robot.get_link_iso("l_foot_contact")[:, 0:3, 3]
 
-        turn_ids = torch.nonzero(self._des_com_yaw != 0).squeeze().tolist()
-        turn_ids = [turn_ids] if isinstance(turn_ids, int) else turn_ids
         self._trajectory_manager.setNewOri(ids, rl_action[:,2]) #TODO: TRAJECTORY FOR ORI
         #self._trajectory_manager.setNewOri(ids, torch.zeros(1, dtype = torch.double))
-        torso_ori = self._trajectory_manager.des_torso_rot[ids]
-
+        torso_ori = self._trajectory_manager.des_torso_rot
 
+        replan_mask = torch.zeros(self._n_batch, dtype = torch.bool)
+        replan_mask[ids] = True
         
-        self._swfoot_end = self._alip_mpc.solve_inertia_coor(self._stance_leg[ids], self._Lx_offset[ids], self._Ly_des[ids], self._Tr[ids], torso_ori,
-                                                             com_pos, com_vel, lfoot_pos, rfoot_pos, turn_ids)
+        self._swfoot_end = self._alip_mpc.solve_inertia_coor_masked(replan_mask, self._stance_leg, self._Lx_offset, self._Ly_des, self._Tr, torso_ori,
+                                                                    com_pos, com_vel, lfoot_pos, rfoot_pos)[ids]
         """ One step ahead
         self._swfoot_end = self.solve_inertia_coor(self._stance_leg[ids], self._Lx_offset[ids], self._Ly_des[ids], self._Tr[ids], torso_ori,
                                                              com_pos, com_vel, lfoot_pos, rfoot_pos, turn_ids)
@@ -90,17 +92,19 @@ class AlipLocomotion(StateMachine):
         #Safety Projection
 
 
-        self._trajectory_manager.generateSwingFtraj(self._state_machine_time[ids], self._Tr[ids], self._swfoot_end[ids], ids)
+        self._trajectory_manager.generateSwingFtraj(self._state_machine_time[ids], self._Tr[ids], self._swfoot_end, ids)
 
 
         #change contact and reaction forces
-        new_rf_z_max_rfoot = torch.zeros(self._n_batch, dtype = torch.double)
-        new_rf_z_max_lfoot = torch.zeros(self._n_batch, dtype = torch.double)
+        #environments not in ids keep their current limits
+        new_rf_z_max_rfoot = self._tci_container.contact_list[0].rf_z_max.clone().to(torch.double)
+        new_rf_z_max_lfoot = self._tci_container.contact_list[1].rf_z_max.clone().to(torch.double)
         b_lf_contact_h = self._sp.b_lf_contact
         b_rf_contact_h = self._sp.b_rf_contact
 
         rst_id = torch.nonzero(self._stance_leg[ids] == 1).squeeze().tolist()
         rst_id = [rst_id] if isinstance(rst_id, int) else rst_id
+        rst_id = [ids[i] for i in rst_id]
 
         new_rf_z_max_rfoot[rst_id] = self._rf_z_MAX[rst_id]
         new_rf_z_max_lfoot[rst_id] = self._rf_z_max[rst_id]
@@ -110,6 +114,7 @@ class AlipLocomotion(StateMachine):
 
         lst_id = torch.nonzero(self._stance_leg[ids] ==-1).squeeze().tolist()
         lst_id = [lst_id] if isinstance(lst_id, int) else lst_id
+        lst_id = [ids[i] for i in lst_id]
 
         new_rf_z_max_lfoot[lst_id] = self._rf_z_MAX[lst_id]
         new_rf_z_max_rfoot[lst_id] = self._rf_z_max[lst_id]
@@ -18,14 +18,12 @@ class Draco3TCIContainer(TCIContainer):
         self._com_task = BasicTask(robot, "COM", 3, 3, self.n_batch, 'com', PnCConfig.SAVE_DATA)
         self._com_task.kp = WBCConfig.KP_COM 
         self._com_task.kd = WBCConfig.KD_COM 
-        self._com_task.w_hierarchy = WBCConfig.W_COM * torch.ones(self.n_batch)
 
         # Torso orientation task
         self._torso_ori_task = BasicTask(robot, "LINK_ORI", 3, 4, self.n_batch,
                                          "torso_com_link", PnCConfig.SAVE_DATA)
         self._torso_ori_task.kp = WBCConfig.KP_TORSO 
         self._torso_ori_task.kd = WBCConfig.KD_TORSO 
-        self._torso_ori_task.w_hierarchy = WBCConfig.W_TORSO * torch.ones(self.n_batch)
 
         # Upperbody joints
         upperbody_joint = [
@@ -39,35 +37,30 @@ class Draco3TCIContainer(TCIContainer):
                                           self.n_batch, upperbody_joint, PnCConfig.SAVE_DATA)
         self._upper_body_task.kp = WBCConfig.KP_UPPER_BODY 
         self._upper_body_task.kd = WBCConfig.KD_UPPER_BODY 
-        self._upper_body_task.w_hierarchy = WBCConfig.W_UPPER_BODY * torch.ones(self.n_batch)
 
         # Rfoot Pos Task
         self._rfoot_pos_task = BasicTask(robot, "LINK_XYZ", 3, 3, self.n_batch,
                                          "r_foot_contact", PnCConfig.SAVE_DATA)
         self._rfoot_pos_task.kp = WBCConfig.KP_FOOT_POS
         self._rfoot_pos_task.kd = WBCConfig.KD_FOOT_POS
-        self._rfoot_pos_task.w_hierarchy = WBCConfig.W_CONTACT_FOOT * torch.ones(self.n_batch)
 
         # Lfoot Pos Task
         self._lfoot_pos_task = BasicTask(robot, "LINK_XYZ", 3, 3, self.n_batch,
                                          "l_foot_contact", PnCConfig.SAVE_DATA)
         self._lfoot_pos_task.kp = WBCConfig.KP_FOOT_POS
         self._lfoot_pos_task.kd = WBCConfig.KD_FOOT_POS
-        self._lfoot_pos_task.w_hierarchy = WBCConfig.W_CONTACT_FOOT * torch.ones(self.n_batch)
 
         # Rfoot Ori Task
         self._rfoot_ori_task = BasicTask(robot, "LINK_ORI", 3, 4, self.n_batch,
                                          "r_foot_contact", PnCConfig.SAVE_DATA)
         self._rfoot_ori_task.kp = WBCConfig.KP_FOOT_ORI
         self._rfoot_ori_task.kd = WBCConfig.KD_FOOT_ORI
-        self._rfoot_ori_task.w_hierarchy = WBCConfig.W_CONTACT_FOOT * torch.ones(self.n_batch)
 
         # Lfoot Ori Task
         self._lfoot_ori_task = BasicTask(robot, "LINK_ORI", 3, 4, self.n_batch,
                                          "l_foot_contact", PnCConfig.SAVE_DATA)
         self._lfoot_ori_task.kp = WBCConfig.KP_FOOT_ORI
         self._lfoot_ori_task.kd = WBCConfig.KD_FOOT_ORI
-        self._lfoot_ori_task.w_hierarchy = WBCConfig.W_CONTACT_FOOT * torch.ones(self.n_batch)
 
         self._task_list = [
             self._com_task, self._torso_ori_task, self._upper_body_task,
@@ -81,11 +74,9 @@ class Draco3TCIContainer(TCIContainer):
         # Rfoot Contact
         self._rfoot_contact = SurfaceContact(robot, "r_foot_contact", 0.115,
                                              0.065, 0.3, self.n_batch, True)
-        self._rfoot_contact.rf_z_max = 1e-3 * torch.ones(self.n_batch) # Initial rf_z_max
         # Lfoot Contact
         self._lfoot_contact = SurfaceContact(robot, "l_foot_contact", 0.115,
                                              0.065, 0.3, self.n_batch, True)
-        self._lfoot_contact.rf_z_max = 1e-3  * torch.ones(self.n_batch) # Initial rf_z_max
 
         #alip_locomotion requires list of size 2
         #0 for rfoot contact
@@ -98,6 +89,21 @@ class Draco3TCIContainer(TCIContainer):
         self._rolling_joint_constraint = Draco3RollingJointConstraint(robot, self.n_batch)
         self._internal_constraint_list = [self._rolling_joint_constraint]
 
+        self.reset()
+
+    def reset(self):
+        # Task weights and contact limits changed by the managers while walking
+        self._com_task.w_hierarchy = WBCConfig.W_COM * torch.ones(self.n_batch)
+        self._torso_ori_task.w_hierarchy = WBCConfig.W_TORSO * torch.ones(self.n_batch)
+        self._upper_body_task.w_hierarchy = WBCConfig.W_UPPER_BODY * torch.ones(self.n_batch)
+        self._rfoot_pos_task.w_hierarchy = WBCConfig.W_CONTACT_FOOT * torch.ones(self.n_batch)
+        self._lfoot_pos_task.w_hierarchy = WBCConfig.W_CONTACT_FOOT * torch.ones(self.n_batch)
+        self._rfoot_ori_task.w_hierarchy = WBCConfig.W_CONTACT_FOOT * torch.ones(self.n_batch)
+        self._lfoot_ori_task.w_hierarchy = WBCConfig.W_CONTACT_FOOT * torch.ones(self.n_batch)
+
+        self._rfoot_contact.rf_z_max = 1e-3 * torch.ones(self.n_batch) # Initial rf_z_max
+        self._lfoot_contact.rf_z_max = 1e-3 * torch.ones(self.n_batch) # Initial rf_z_max
+
     @property
     def com_task(self):
         return self._com_task
@@ -4,26 +4,11 @@ import sys
 import math
 import numpy as np
  
-
-from mpc import mpc
-from mpc.mpc import QuadCost, LinDx, GradMethods
-
 from pnc_pytorch.data_saver import DataSaver
 from config.draco3_alip_config import AlipParams
 from pnc_pytorch.planner.locomotion.alip_mpc_qpsolver import ALIPtorch_mpc as qp_mpc
 
 
-import shutil
-FFMPEG_BIN = shutil.which('ffmpeg')
-
-import shutil
-FFMPEG_BIN = shutil.which('ffmpeg')
-
-import matplotlib
-matplotlib.use('Agg')
-import matplotlib.pyplot as plt
-plt.style.use('bmh')
-
 #TODO: Curent hypothesis: not working because Cost has not full rank
 #                         current solution is consider eps instead of 0
 #TODO: setter function for variables
@@ -99,6 +84,9 @@ class ALIPtorch_mpc():
 
         #self.u_lower = None
         #self.u_upper = None
+        #mpc.pytorch is only needed by this solver, import it here
+        from mpc import mpc
+        from mpc.mpc import QuadCost, LinDx, GradMethods
         nominal_states, nominal_actions, nominal_objs = mpc.MPC(
                 self.n_state, self.n_ctrl, self._Ns,
                 u_init= self.u_init,
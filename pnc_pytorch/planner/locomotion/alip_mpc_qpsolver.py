@@ -2,27 +2,18 @@ import torch
 import os
 import sys
 import math
+import warnings
 import numpy as np
 
 
 from pnc_pytorch.data_saver import DataSaver
-from qpth.qp import QPFunction   #for now like this for testing 
-from qpsolvers import solve_qp
+from pnc_pytorch.wbc.ihwbc.qpth.qp import PrefactoredQP
+from pnc_pytorch.wbc.ihwbc.qpth.solvers.pdipm.batch import KKTSolvers
+from pnc_pytorch.planner.locomotion.alip_explicit_mpc import ALIPExplicitMPC
 
 
 from config.draco3_alip_config import AlipParams
 
-import shutil
-FFMPEG_BIN = shutil.which('ffmpeg')
-
-import shutil
-FFMPEG_BIN = shutil.which('ffmpeg')
-
-import matplotlib
-matplotlib.use('Agg')
-import matplotlib.pyplot as plt
-plt.style.use('bmh')
-
 #TODO: Curent hypothesis: not working because Cost has not full rank
 #                         current solution is consider eps instead of 0
 #TODO: setter function for variables
@@ -33,7 +24,7 @@ plt.style.use('bmh')
 #TODO: check why doesn't match Ly des with actual state
 
 class ALIPtorch_mpc():
-    def __init__(self, robot = None, data_save = False):     
+    def __init__(self, robot = None, data_save = False, n_batch = 1):     
         self.eps = 1e-8
         self.n_state = 4
         self.n_ctrl = 2
@@ -79,40 +70,87 @@ class ALIPtorch_mpc():
         self._ufp_y_min_norm = AlipParams.UFP_Y_MIN
         self._ufp_y_min_turning = AlipParams.UFP_Y_MIN_turn
         self._x_mech_limit = self._ufp_x_max/2
-        #self.static_u_bounds()
+        self.static_u_bounds()
         self.ineq_mat()
 
+        #condensed: states are eliminated and only the footsteps are optimized
+        self._b_condensed = AlipParams.B_CONDENSED
+        if self._b_condensed:
+            self.condensed_mat()
+            self._qp = PrefactoredQP(self._cond_cost_mat, self._cond_ineq_mat,
+                                     torch.Tensor().double(), verbose = -1,
+                                     solver = KKTSolvers.CHOL_NORMAL)
+            #the interior point method can stall short of a feasible point,
+            #those rows are solved again with LU and a longer stall limit
+            self._fallback_qp = PrefactoredQP(self._cond_cost_mat, self._cond_ineq_mat,
+                                              torch.Tensor().double(), verbose = -1,
+                                              notImprovedLim = 20, maxIter = 60)
+        else:
+            # cost, equality and inequality matrices are constant, factor them once
+            self._qp = PrefactoredQP(self._cost_mat, self._ineq_cont_mat,
+                                     self._eq_cont_mat, verbose = -1)
+
+        #offline footstep table (alip_explicit_mpc.py), the QP is the fallback
+        self._explicit_mpc = None
+        if AlipParams.B_EXPLICIT_MPC:
+            assert self._b_condensed
+            self._explicit_mpc = ALIPExplicitMPC.load(AlipParams.EXPLICIT_MPC_PATH, self)
+
+        #largest constraint violation accepted from a solve
+        self._feas_tol = 1e-6
+        #QP right hand sides, sized by the batch and refilled in place
+        self._rhs_batch = None
+
+        self._n_batch = n_batch
+        self.reset()
+
+    def reset(self):
+        #persistent per environment store, only the rows in the replan mask are solved
+        self._replan_mask = torch.zeros(self._n_batch, dtype = torch.bool)
+        self._next_action = torch.zeros(self._n_batch, 3, dtype = torch.double)
+        self._state_sol = torch.zeros(self._Ns*self._Nt, self._n_batch, self.n_state, dtype = torch.double)
+        self._u_sol = torch.zeros(self._Ns, self._n_batch, self.n_ctrl, dtype = torch.double)
+        #rows of the last solve without a feasible plan
+        self.solve_failed = torch.zeros(self._n_batch, dtype = torch.bool)
+
 
       
 
-    def solve_mpc_coor(self, stance_leg, x, Lx_offset, Ly_des, Tr): #x = [x, y, Lx, Ly]
+    def solve_mpc_coor(self, stance_leg, x, Lx_offset, Ly_des, Tr, mask = None): #x = [x, y, Lx, Ly]
+        """
+        mask ([batch] bool): optional, only these rows are solved, the
+        solution of the other rows is meaningless
+        """
         #computes x_0 as   A(Ts)_x
         self._batch = x.shape[0]
         self.Tr = Tr.clone()
-        self.static_u_bounds()
         #DYNAMICS
 
-        #STANCE LEG IDX
-        mask = torch.eq(stance_leg, 1)
-        idx_plus = torch.nonzero(mask).squeeze().tolist()
-        idx_minus = torch.nonzero(~mask).squeeze().tolist()
-        idx_plus = [idx_plus] if not isinstance(idx_plus, list) else idx_plus
-        idx_minus = [idx_minus] if not isinstance(idx_minus, list) else idx_minus
+        #STANCE LEG: True for stance leg + (first step swings the left leg)
+        stance_plus = torch.eq(stance_leg, 1)
 
         #COST AND BOUNDS
         self.Lx_offset = Lx_offset.clone()
         self.Ly_des = Ly_des.clone()
 
+        self._stance_plus = stance_plus
         self.equality_contraint_vec(x, self.Tr)
-        self.cost_vec(idx_plus, idx_minus)
-        self.ineq_vec(idx_plus, idx_minus)
+        self.cost_vec(stance_plus)
+        self.ineq_vec(stance_plus)
 
         #self.u_lower = None
         #self.u_upper = None
         
-        sol = QPFunction(verbose = -1)(self._cost_mat, self._cost_vec, 
-                                       self._ineq_cont_mat, self._ineq_cont_vec, 
-                                       self._eq_cont_mat, self._eq_cont_vec)
+        if self._b_condensed:
+            sol = self.solve_condensed(mask)
+        else:
+            sol = self._qp(self._cost_vec, self._ineq_cont_vec, self._eq_cont_vec, mask = mask)
+            self.solve_failed = self.infeasible(sol, self._ineq_cont_mat, self._ineq_cont_vec, mask)
+
+        #the failed rows are also flagged in self.solve_failed
+        if self.solve_failed.any():
+            warnings.warn("ALIP MPC: no feasible footstep plan for batch rows {}".format(
+                torch.nonzero(self.solve_failed).squeeze(1).tolist()), RuntimeWarning)
 
         state_sol = sol[:, 0:self._Ns*self._Nt*self.n_state]
         state_sol = state_sol.reshape(self._batch, state_sol.size(1)//self.n_state, self.n_state)
@@ -153,6 +191,53 @@ class ALIPtorch_mpc():
                            pos, vel, lfoot_pos, rfoot_pos, turn_ids):
         self._batch = pos.shape[0]
 
+        x, stleg_pos = self.alip_state(stance_leg, torso_ori, pos, vel, lfoot_pos, rfoot_pos)
+
+        """
+        if self._b_data_save:
+            swfoot_pos = torch.where(stance_leg.unsqueeze(1) == 1, lfoot_pos, rfoot_pos)
+            swfoot_pos_ori = torch.matmul(torso_ori.transpose(1,2), swfoot_pos.unsqueeze(2)).squeeze()
+            swf_pos = swfoot_pos_ori[:, 0:2] - stleg_pos_torso_ori[:, 0:2]
+            self._data_saver.add('mpc_sw_foot_pos', swf_pos)
+        """
+
+        states, actions = self.solve_mpc_coor(stance_leg, x, Lx_offset, Ly_des, Tr)
+
+        return self.next_action(actions, torso_ori, stleg_pos).squeeze()
+
+    def solve_inertia_coor_masked(self, mask, stance_leg, Lx_offset, Ly_des, Tr, torso_ori,
+                                  pos, vel, lfoot_pos, rfoot_pos):
+        """
+        Replans the environments flagged in mask ([n_batch] bool) together with
+        any replan still pending, in one QP solve. Every other argument holds
+        all the n_batch environments. The new footsteps, states and actions are
+        written into the persistent store, next footsteps are returned [n_batch, 3].
+        Environments without a feasible plan keep their previous one and stay
+        pending.
+        """
+        self._replan_mask |= mask
+        if not self._replan_mask.any():
+            return self._next_action
+
+        self._batch = self._n_batch
+        x, stleg_pos = self.alip_state(stance_leg, torso_ori, pos, vel, lfoot_pos, rfoot_pos)
+
+        states, actions = self.solve_mpc_coor(stance_leg, x, Lx_offset, Ly_des, Tr, self._replan_mask)
+
+        #failed rows keep their last feasible plan and stay pending
+        solved = self._replan_mask & ~self.solve_failed
+        next_action = self.next_action(actions, torso_ori, stleg_pos)
+        torch.where(solved.view(1, -1, 1), states, self._state_sol, out = self._state_sol)
+        torch.where(solved.view(1, -1, 1), actions, self._u_sol, out = self._u_sol)
+        torch.where(solved.view(-1, 1), next_action, self._next_action, out = self._next_action)
+        self._replan_mask &= self.solve_failed
+
+        return self._next_action
+
+    def alip_state(self, stance_leg, torso_ori, pos, vel, lfoot_pos, rfoot_pos): #batched
+        """
+        ALIP state [x, y, Lx, Ly] about the stance foot, in the torso frame
+        """
         stleg_pos = torch.where(stance_leg.unsqueeze(1) == 1, rfoot_pos, lfoot_pos)
 
         #stleg_pos = stleg_pos.to(torso_ori.dtype)
@@ -163,14 +248,6 @@ class ALIPtorch_mpc():
         
         x = pos_torso_ori[:, 0:2] - stleg_pos_torso_ori[:, 0:2]
 
-        """
-        if self._b_data_save:
-            swfoot_pos = torch.where(stance_leg.unsqueeze(1) == 1, lfoot_pos, rfoot_pos)
-            swfoot_pos_ori = torch.matmul(torso_ori.transpose(1,2), swfoot_pos.unsqueeze(2)).squeeze()
-            swf_pos = swfoot_pos_ori[:, 0:2] - stleg_pos_torso_ori[:, 0:2]
-            self._data_saver.add('mpc_sw_foot_pos', swf_pos)
-        """
-
         _x = torch.cat((x, self._zH*torch.ones(self._batch).unsqueeze(1)), dim = 1) 
                 
         vel_torso_ori[:,2] = torch.zeros(self._batch, dtype = torch.double)
@@ -178,15 +255,13 @@ class ALIPtorch_mpc():
         L = self._mass*torch.linalg.cross(_x, vel_torso_ori)
 
         x = torch.cat((x, L[:, 0].unsqueeze(1), L[:, 1].unsqueeze(1)), dim = 1)
+        return x, stleg_pos
 
-
-        states, actions = self.solve_mpc_coor(stance_leg, x, Lx_offset, Ly_des, Tr)
+    def next_action(self, actions, torso_ori, stleg_pos): #batched
         #For now assume height is constant
         next_action_torso_frame = torch.cat((actions[0, :, :], torch.zeros(self._batch, 1, dtype = torch.double)), dim = 1)
         next_action_torso_frame = next_action_torso_frame.to(torso_ori.dtype)
-        next_action = torch.matmul(torso_ori, next_action_torso_frame.unsqueeze(2)).squeeze() + stleg_pos
-
-        return next_action
+        return torch.matmul(torso_ori, next_action_torso_frame.unsqueeze(2)).squeeze(2) + stleg_pos
 
     def static_u_bounds(self): #-1 for left stance first --> starts with right swing
         assert self._Ns%2 == 0 #Ns need to be even in order to work with the current implementation of the u_bounds
@@ -221,17 +296,10 @@ class ALIPtorch_mpc():
                 self.u_lower_minus = torch.cat((self.u_lower_minus, u_lower_right_swing), dim = 0)
 
 
-    def get_u_bounds(self, idp, idm):
-        self.u_upper = torch.zeros(self._Ns, self._batch, self.n_ctrl, dtype = torch.double)
-        self.u_lower = torch.zeros(self._Ns, self._batch, self.n_ctrl, dtype = torch.double)
-
-        if idp:
-            self.u_upper[:, idp] = self.u_upper_plus.unsqueeze(1).repeat(1, len(idp), 1)
-            self.u_lower[:, idp] = self.u_lower_plus.unsqueeze(1).repeat(1, len(idp), 1)
-
-        if idm:
-            self.u_upper[:, idm] = self.u_upper_minus.unsqueeze(1).repeat(1, len(idm), 1)
-            self.u_lower[:, idm] = self.u_lower_minus.unsqueeze(1).repeat(1, len(idm), 1)
+    def get_u_bounds(self, stance_plus):
+        plus = stance_plus.view(1, -1, 1)
+        self.u_upper = torch.where(plus, self.u_upper_plus.unsqueeze(1), self.u_upper_minus.unsqueeze(1))
+        self.u_lower = torch.where(plus, self.u_lower_plus.unsqueeze(1), self.u_lower_minus.unsqueeze(1))
 
     def up_u_init(self, u):
         """
@@ -243,65 +311,29 @@ class ALIPtorch_mpc():
         self.u_init = torch.cat((u[1:self._Ns, :, :], torch.zeros(1, self._batch, 2, dtype = torch.double)), dim = 0) 
 
 
-    def getCostvec(self, idp, idm): #cost is checked 
+    def getCostvec(self, stance_plus): #cost is checked 
         #desired state
         self.l = math.sqrt(self._g/self._zH)
 
         q1 = self._px*(-2/self._mass/self._zH/self.l * math.tanh(self.l*self._Ts/2) * self.Ly_des)
-        #leg dependent desired state
-        q2_plus = self._py * self._w * torch.ones(self._batch, dtype = torch.double)
-        q2_minus = self._py * (-self._w) * torch.ones(self._batch, dtype = torch.double)
-        q3_plus = self._pLx * (-self._mass*self._zH*self.l*self._w*math.sqrt(self.l*self._Ts*0.5) - 2*self.Lx_offset)
-        q3_minus = self._pLx * (self._mass*self._zH*self.l*self._w*math.sqrt(self.l*self._Ts*0.5) - 2*self.Lx_offset)
         q4 = self._pLy * (-2*self.Ly_des)
 
-        self.q = torch.zeros(self._Ns, self._batch, self.n_state+self.n_ctrl, dtype = torch.double)  #initial right stance /left swing
-
-        self.q[:,:,0] = q1.repeat(self._Ns, 1)
-        self.q[:,:,3] = q4.repeat(self._Ns, 1)
-
-        #idp st_leg + -- > q_plus
-        #idm st_leg - -- > q_minus
-        a = 1
-        if (len(idp) == 0):
-            for n in range(self._Ns):
-                if (n == self._Ns-1):
-                    a = 100
-                if n%2 == 0:
-                    self.q[n, :, 1] = a*q2_minus
-                    self.q[n, :, 2] = a*q3_minus
-                else:
-                    self.q[n, :,1] = a*q2_plus
-                    self.q[n, :,2] = a*q3_plus
-        elif (len(idm) == 0):
-            for n in range(self._Ns):
-                if (n == self._Ns-1):
-                    a = 100
-                if n%2 == 0:
-                    self.q[n, :, 1] = a*q2_plus
-                    self.q[n, :, 2] = a*q3_plus
-                else:
-                    self.q[n, :, 1] = a*q2_minus
-                    self.q[n, :, 2] = a*q3_minus
-        else:
-            for n in range(self._Ns):
-                if (n == self._Ns-1):
-                    a = 100
-                if n%2 == 0:
-                    self.q[n, idp, 1] = a*q2_plus[idp]
-                    self.q[n, idm, 1] = a*q2_minus[idm]
-                    self.q[n, idp, 2] = a*q3_plus[idp]
-                    self.q[n, idm, 2] = a*q3_minus[idm]
-                else:
-                    self.q[n, idp, 1] = a*q2_minus[idp]
-                    self.q[n, idm,1] = a*q2_plus[idm]
-                    self.q[n, idp, 2] = a*q3_minus[idp]
-                    self.q[n, idm,2] = a*q3_plus[idm]
+        #leg dependent desired state, +1 on the steps that swing the left leg
+        #stance leg + starts swinging the left leg, stance leg - the right one
+        alt = torch.tensor([(-1.)**n for n in range(self._Ns)], dtype = torch.double).unsqueeze(1)
+        swing_left = alt * torch.where(stance_plus, 1., -1.).to(torch.double).unsqueeze(0)
+        Lx_des = self._mass*self._zH*self.l*self._w*math.sqrt(self.l*self._Ts*0.5)
 
-        self.q[self._Ns-1,:,0] = 100*q1
-        self.q[self._Ns-1,:,3] = 100*q4
+        self._alloc_rhs()
+        self.q = self._rhs['q']  #initial right stance /left swing
 
+        self.q[:,:,0] = q1
+        self.q[:,:,1] = self._py * self._w * swing_left
+        self.q[:,:,2] = self._pLx * (-Lx_des*swing_left - 2*self.Lx_offset)
+        self.q[:,:,3] = q4
 
+        #terminal step
+        self.q[self._Ns-1] *= 100
 
 
 
@@ -322,6 +354,25 @@ class ALIPtorch_mpc():
         self._exp_At_B = torch.matmul(self._exp_At, self._B)
 
 
+    def exp_A(self, t): #batched
+        """
+        Closed form of matrix_exp(A*t): A couples (x, Ly) and (y, Lx) in two
+        hyperbolic 2x2 blocks, with l = sqrt(g/zH)
+        """
+        l = math.sqrt(self._g/self._zH)
+        ch, sh = torch.cosh(l*t), torch.sinh(l*t)
+        mzl = self._mass*self._zH*l
+        exp_At = torch.zeros(t.shape[0], 4, 4, dtype = torch.double)
+        exp_At[:, 0, 0] = ch
+        exp_At[:, 0, 3] = sh/mzl
+        exp_At[:, 1, 1] = ch
+        exp_At[:, 1, 2] = -sh/mzl
+        exp_At[:, 2, 1] = -mzl*sh
+        exp_At[:, 2, 2] = ch
+        exp_At[:, 3, 0] = mzl*sh
+        exp_At[:, 3, 3] = ch
+        return exp_At
+
     def equality_constraint_mat(self): #not batched
         #size of mat: 
         # vertical: (Ns*Nt)*4 -->>n_eq
@@ -349,9 +400,9 @@ class ALIPtorch_mpc():
         #np.savetxt('eq_mat.txt', self._eq_cont_mat.numpy(), fmt="%.3f")
 
     def equality_contraint_vec(self, x_0, Tr): #already batched
-        self._eq_cont_vec = torch.zeros(self._batch, 4*self._Ns*self._Nt, dtype = torch.double)
-        exp_ATr = torch.linalg.matrix_exp(self._A.unsqueeze(0).repeat(self._batch, 1, 1)*(Tr).unsqueeze(1).unsqueeze(1))
-        self._eq_cont_vec[:, 0:4] = torch.matmul(exp_ATr, x_0.unsqueeze(2)).squeeze()
+        self._alloc_rhs()
+        self._eq_cont_vec = self._rhs['eq']
+        self._eq_cont_vec[:, 0:4] = torch.matmul(self.exp_A(Tr), x_0.unsqueeze(2)).squeeze(2)
         #np.savetxt('eq_vec.txt', self._eq_cont_vec.numpy(), fmt="%.3f")
 
     def cost_mat(self): #not batched
@@ -370,11 +421,11 @@ class ALIPtorch_mpc():
                        (self._Ns*self._Nt - 1)*self.n_state:self._Ns*self._Nt*self.n_state] = Qterminal
         #np.savetxt('cost_mat.txt', self._cost_mat.numpy(), fmt="%.3f")
    
-    def cost_vec(self, idx_plus, idx_minus): #batched
+    def cost_vec(self, stance_plus): #batched
         # vector of size (Ns*Nt)*4 + Ns*2
-        self.getCostvec(idx_plus, idx_minus)
+        self.getCostvec(stance_plus)
 
-        self._cost_vec = torch.zeros(self._batch, self._Ns*self._Nt*self.n_state + self._Ns*self.n_ctrl, dtype = torch.double)
+        self._cost_vec = self._rhs['cost']
         for i in range(self._Ns):
             self._cost_vec[:, ((i+1)*self._Nt - 1)*self.n_state:(i+1)*self._Nt*self.n_state,] = self.q[i, :, 0:4]
 
@@ -395,9 +446,11 @@ class ALIPtorch_mpc():
         #np.savetxt('ineq_mat.txt', self._ineq_cont_mat.numpy(), fmt="%.3f")
 
     
-    def ineq_vec(self, idx_plus, idx_minus):
-        self.get_u_bounds(idx_plus, idx_minus)
-        self._ineq_cont_vec = torch.zeros(self._batch, 2*(self._Ns*self._Nt*2 + self._Ns*self.n_ctrl), dtype = torch.double)
+    def ineq_vec(self, stance_plus):
+        self.get_u_bounds(stance_plus)
+        n_slip, n_u = self._Ns*self._Nt*2, self._Ns*self.n_ctrl
+        self._alloc_rhs()
+        self._ineq_cont_vec = self._rhs['ineq']
 
         if (self._x_mech_limit > self._xc_slip_limit):
             self._x_bound = self._xc_slip_limit
@@ -405,39 +458,102 @@ class ALIPtorch_mpc():
             self._x_bound = self._x_mech_limit
         
         #U BOUNDS
-        for i in range(self._Ns):
-            self._ineq_cont_vec[:, self._Ns*self._Nt*2+2*i:
-                                   self._Ns*self._Nt*2+2*(i+1)] = self.u_upper[i, :]
-            self._ineq_cont_vec[:, 2*self._Ns*self._Nt*2 + self._Ns*self.n_ctrl+2*i:
-                                   2*self._Ns*self._Nt*2 + self._Ns*self.n_ctrl+2*(i+1)] = -self.u_lower[i,:]
-
-        for i in range(self._Ns*self._Nt):
-            self._ineq_cont_vec[:, 2*i] = self._x_bound
-            self._ineq_cont_vec[:, 2*i + 1] = self._yc_slip_limit
-            self._ineq_cont_vec[:, self._Ns*self._Nt*2 + self._Ns*self.n_ctrl + 2*i] = self._x_bound
-            self._ineq_cont_vec[:, self._Ns*self._Nt*2 + self._Ns*self.n_ctrl + 2*i + 1] = self._yc_slip_limit
-
-        tensor_ = torch.arange(0,self._Ns*self._Nt*self.n_state + self._Ns*self.n_ctrl).to(dtype = torch.double)
-        a = torch.matmul(self._ineq_cont_mat, tensor_)
-        #np.savetxt("a.txt", a, fmt = "%.1f")
-        #np.savetxt("ineq_vec.txt", self._ineq_cont_vec.t(), fmt = "%.3f")
-
-        
-        
-
-
-
-
-
-
-    
-
-    
-
-    
-
+        self._ineq_cont_vec[:, n_slip:n_slip + n_u] = self.u_upper.transpose(0, 1).reshape(self._batch, n_u)
+        self._ineq_cont_vec[:, 2*n_slip + n_u:] = -self.u_lower.transpose(0, 1).reshape(self._batch, n_u)
 
+        #SLIP LIMITS
+        for offset in (0, n_slip + n_u):
+            self._ineq_cont_vec[:, offset:offset + n_slip:2] = self._x_bound
+            self._ineq_cont_vec[:, offset + 1:offset + n_slip:2] = self._yc_slip_limit
 
 
+    def condensed_mat(self): #not batched
+        """
+        Eliminates the states with the dynamics, eq_mat*[X, U] = [x_0, 0, ..., 0]
+        gives X = Phi*x_0 + Gam*U, and rewrites cost and inequalities over U
+        """
+        n_x = self._Ns*self._Nt*self.n_state
+        eq_x, eq_u = self._eq_cont_mat[:, :n_x], self._eq_cont_mat[:, n_x:]
+        #eq_x is block lower triangular with identity diagonal
+        self._Phi = torch.linalg.solve_triangular(eq_x, torch.eye(n_x, self.n_state, dtype = torch.double),
+                                                  upper = False, unitriangular = True)
+        self._Gam = -torch.linalg.solve_triangular(eq_x, eq_u, upper = False, unitriangular = True)
+
+        Qx, Qu = self._cost_mat[:n_x, :n_x], self._cost_mat[n_x:, n_x:]
+        Gx, Gu = self._ineq_cont_mat[:, :n_x], self._ineq_cont_mat[:, n_x:]
+        self._cond_cost_mat = self._Gam.t() @ Qx @ self._Gam + Qu
+        self._cond_cost_mat = 0.5*(self._cond_cost_mat + self._cond_cost_mat.t())
+        self._cond_cost_x0 = self._Gam.t() @ Qx @ self._Phi
+        self._cond_ineq_mat = Gx @ self._Gam + Gu
+        self._cond_ineq_x0 = Gx @ self._Phi
+
+    def condensed_vec(self, x_0): #batched
+        """
+        Condensed cost and inequality vectors, returned in buffers that the
+        next solve overwrites
+        """
+        n_x = self._Ns*self._Nt*self.n_state
+        self._alloc_rhs()
+        rhs = self._rhs
+        cost_vec = torch.matmul(self._cost_vec[:, :n_x], self._Gam, out = rhs['cond_cost'])
+        cost_vec += self._cost_vec[:, n_x:]
+        cost_vec += torch.matmul(x_0, self._cond_cost_x0.t(), out = rhs['cond_cost_x0'])
+        ineq_vec = torch.sub(self._ineq_cont_vec,
+                             torch.matmul(x_0, self._cond_ineq_x0.t(), out = rhs['cond_ineq_x0']),
+                             out = rhs['cond_ineq'])
+        return cost_vec, ineq_vec
+
+    def solve_condensed(self, mask = None): #batched
+        """
+        Solves the footstep only QP and recovers the full [X, U] solution
+        """
+        x_0 = self._eq_cont_vec[:, 0:self.n_state]
+        cost_vec, ineq_vec = self.condensed_vec(x_0)
 
+        if self._explicit_mpc is None:
+            u = self._qp(cost_vec, ineq_vec, torch.Tensor().double(), mask = mask)
+        else:
+            theta = torch.cat((x_0, self.Lx_offset.view(-1, 1), self.Ly_des.view(-1, 1)), dim = 1)
+            u, solved = self._explicit_mpc.evaluate(theta, self._stance_plus, ineq_vec)
+            unsolved = ~solved if mask is None else mask & ~solved
+            if unsolved.any():
+                u_qp = self._qp(cost_vec, ineq_vec, torch.Tensor().double(), mask = unsolved)
+                u = torch.where(unsolved.unsqueeze(1), u_qp, u)
+
+        self.solve_failed = self.infeasible(u, self._cond_ineq_mat, ineq_vec, mask)
+        if self.solve_failed.any():
+            u_qp = self._fallback_qp(cost_vec, ineq_vec, torch.Tensor().double(), mask = self.solve_failed)
+            u = torch.where(self.solve_failed.unsqueeze(1), u_qp, u)
+            self.solve_failed = self.infeasible(u, self._cond_ineq_mat, ineq_vec, mask)
+        states = x_0 @ self._Phi.t() + u @ self._Gam.t()
+        return torch.cat((states, u), dim = 1)
+
+    def infeasible(self, sol, ineq_mat, ineq_vec, mask = None): #batched
+        """
+        [batch] bool, rows of sol (within mask) violating
+        ineq_mat*sol <= ineq_vec by more than the feasibility tolerance
+        """
+        viol = (sol @ ineq_mat.t() - ineq_vec).amax(1)
+        failed = ~(viol <= self._feas_tol)
+        return failed if mask is None else failed & mask
 
+    def _alloc_rhs(self):
+        """
+        QP right hand side buffers of the current batch size. Entries that are
+        never written stay zero, every other one is refilled by each solve.
+        """
+        if self._rhs_batch == self._batch:
+            return
+        n_x, n_u = self._Ns*self._Nt*self.n_state, self._Ns*self.n_ctrl
+        n_ineq = self._ineq_cont_mat.shape[0]
+        zeros = lambda *shape: torch.zeros(*shape, dtype = torch.double)
+        self._rhs = dict(q = zeros(self._Ns, self._batch, self.n_state + self.n_ctrl),
+                         eq = zeros(self._batch, n_x),
+                         cost = zeros(self._batch, n_x + n_u),
+                         ineq = zeros(self._batch, n_ineq))
+        if self._b_condensed:
+            self._rhs.update(cond_cost = zeros(self._batch, n_u),
+                             cond_cost_x0 = zeros(self._batch, n_u),
+                             cond_ineq = zeros(self._batch, n_ineq),
+                             cond_ineq_x0 = zeros(self._batch, n_ineq))
+        self._rhs_batch = self._batch
@@ -0,0 +1,52 @@
+from collections.abc import Mapping
+
+
+class JointArrayView(Mapping):
+    """
+    Read only joint name -> value adapter over the last axis of a joint
+    array. Values are looked up lazily, nothing is copied.
+    """
+    def __init__(self, joint_id, array):
+        self._joint_id = joint_id
+        self._array = array
+
+    def __getitem__(self, joint_name):
+        return self._array[..., self._joint_id[joint_name]]
+
+    def __iter__(self):
+        return iter(self._joint_id)
+
+    def __len__(self):
+        return len(self._joint_id)
+
+
+class JointCommand(Mapping):
+    """
+    Joint command as a named view over a contiguous torque buffer
+        joint_names (tuple): joint ordering of the last axis
+        joint_trq (np.array): [n_a] or [n_batch, n_a]
+    The buffer is wrapped, not copied. command['joint_trq'] returns a lazy
+    JointArrayView so the command can still be read like the per joint
+    OrderedDict returned by create_cmd_ordered_dict.
+    """
+    def __init__(self, joint_id, joint_trq):
+        """
+        joint_id (OrderedDict): joint name -> index in the last axis
+        """
+        self._joint_id = joint_id
+        self.joint_trq = joint_trq
+
+    @property
+    def joint_names(self):
+        return tuple(self._joint_id.keys())
+
+    def __getitem__(self, key):
+        if key != 'joint_trq':
+            raise KeyError(key)
+        return JointArrayView(self._joint_id, self.joint_trq)
+
+    def __iter__(self):
+        return iter(('joint_trq',))
+
+    def __len__(self):
+        return 1
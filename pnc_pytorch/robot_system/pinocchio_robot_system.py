@@ -5,16 +5,34 @@ import torch
 cwd = os.getcwd()
 sys.path.append(cwd)
 import time, math
+import hashlib
+import pickle
+import warnings
 from collections import OrderedDict
 
 import numpy as np
 import pinocchio as pin
 
 from pnc_pytorch.robot_system.robot_system import RobotSystem
+from pnc_pytorch.robot_system.joint_command import JointCommand
 from util import util
 from util import liegroup
 
 
+# default on-disk model cache, outside of the source tree
+MODEL_CACHE_DIR = os.path.join(
+    os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache')), 'pnc',
+    'robot_model_cache')
+
+# attributes derived from the pinocchio model, stored with it in the cache.
+# Only the kinematic model is cached, the collision and visual geometries
+# (with their meshes) are parsed from the URDF when they are first asked for
+_CACHED_CONFIG = ('_n_q', '_n_q_dot', '_n_a', '_joint_id', '_link_id',
+                  '_joint_names', '_joint_q_idx', '_joint_q_dot_idx',
+                  '_joint_idx', '_q_idx_of_joint_idx', '_total_mass',
+                  '_joint_pos_limit', '_joint_vel_limit', '_joint_trq_limit')
+
+
 class PinocchioRobotSystem(RobotSystem):
     """
     Pinnochio considers floating base with 7 positions and 6 velocities with the
@@ -27,25 +45,132 @@ class PinocchioRobotSystem(RobotSystem):
                  urdf_file,
                  package_dir,
                  b_fixed_base,
-                 b_print_info=False):
+                 b_print_info=False,
+                 model_cache_dir=MODEL_CACHE_DIR):
+        # None disables the on-disk model cache
+        self._model_cache_dir = model_cache_dir
+        self._urdf_file = urdf_file
+        self._package_dir = package_dir
+        self._collision_model = None
+        self._visual_model = None
         super(PinocchioRobotSystem, self).__init__(batch, urdf_file, package_dir,
                                                    b_fixed_base, b_print_info)
 
-    def _config_robot(self, urdf_file, package_dir):
+    def _build_model(self, urdf_file):
         if self._b_fixed_base:
             # Fixed based robot
-            self._model, self._collision_model, self._visual_model = pin.buildModelsFromUrdf(
-                urdf_file, package_dir)
-            self._n_floating = 0
+            return pin.buildModelFromUrdf(urdf_file)
         else:
             # Floating based robot
-            self._model, self._collision_model, self._visual_model = pin.buildModelsFromUrdf(
-                urdf_file, package_dir, pin.JointModelFreeFlyer())
-            self._n_floating = 6
-
-        self._data, self._collision_data, self._visual_data = pin.createDatas(
-            self._model, self._collision_model, self._visual_model)
+            return pin.buildModelFromUrdf(urdf_file, pin.JointModelFreeFlyer())
+
+    @property
+    def collision_model(self):
+        if self._collision_model is None:
+            self._collision_model = pin.buildGeomFromUrdf(
+                self._model, self._urdf_file, pin.GeometryType.COLLISION,
+                package_dirs=self._package_dir)
+        return self._collision_model
+
+    @property
+    def visual_model(self):
+        if self._visual_model is None:
+            self._visual_model = pin.buildGeomFromUrdf(
+                self._model, self._urdf_file, pin.GeometryType.VISUAL,
+                package_dirs=self._package_dir)
+        return self._visual_model
+
+    def _cache_file(self, urdf_file, package_dir):
+        """
+        Cache entry of the same URDF content, package directory, base type
+        and pinocchio version, stored as <key>.bin (the model in pinocchio's
+        binary archive, much faster to load than its pickle) and <key>.pkl
+        (the _CACHED_CONFIG attributes). Returns the path without extension.
+        """
+        key = hashlib.sha256()
+        with open(urdf_file, 'rb') as urdf:
+            key.update(urdf.read())
+        key.update("{}|{}|{}".format(os.path.abspath(package_dir),
+                                     self._b_fixed_base,
+                                     pin.__version__).encode())
+        return os.path.join(self._model_cache_dir, key.hexdigest())
+
+    def _read_cache(self, cache_file):
+        """
+        Cached dict of the model and the _CACHED_CONFIG attributes, None
+        when there is no usable entry
+        """
+        if not (os.path.exists(cache_file + ".pkl")
+                and os.path.exists(cache_file + ".bin")):
+            return None
+        try:
+            with open(cache_file + ".pkl", 'rb') as cache:
+                entry = pickle.load(cache)
+            if not all(attr in entry for attr in _CACHED_CONFIG):
+                warnings.warn("Outdated robot model cache {}, rebuilding".format(
+                    cache_file))
+                return None
+            entry['model'] = pin.Model()
+            entry['model'].loadFromBinary(cache_file + ".bin")
+            return entry
+        except (OSError, EOFError, pickle.UnpicklingError, AttributeError,
+                ImportError, IndexError, TypeError, ValueError,
+                RuntimeError) as e:
+            warnings.warn("Unreadable robot model cache {} ({!r}), "
+                          "rebuilding".format(cache_file, e))
+        return None
+
+    def _write_cache(self, cache_file):
+        entry = {attr: getattr(self, attr) for attr in _CACHED_CONFIG}
+        # write then rename, so concurrent workers never read a partial file.
+        # The config goes last, readers only look at entries that have it.
+        tmp_files = ["{}.{}.{}.tmp".format(cache_file, os.getpid(), ext)
+                     for ext in ("bin", "pkl")]
+        try:
+            os.makedirs(self._model_cache_dir, exist_ok=True)
+            self._model.saveToBinary(tmp_files[0])
+            os.replace(tmp_files[0], cache_file + ".bin")
+            with open(tmp_files[1], 'wb') as cache:
+                pickle.dump(entry, cache, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_files[1], cache_file + ".pkl")
+        except (OSError, pickle.PicklingError, TypeError, RuntimeError) as e:
+            warnings.warn("Robot model not cached ({!r})".format(e))
+            for tmp_file in tmp_files:
+                if os.path.exists(tmp_file):
+                    os.remove(tmp_file)
 
+    def _config_robot(self, urdf_file, package_dir):
+        cache_file, entry = None, None
+        if self._model_cache_dir is not None:
+            cache_file = self._cache_file(urdf_file, package_dir)
+            entry = self._read_cache(cache_file)
+        if entry is None:
+            self._model = self._build_model(urdf_file)
+        else:
+            self._model = entry['model']
+        self._n_floating = 0 if self._b_fixed_base else 6
+
+        self._data = self._model.createData()
+        # One pin.Data per environment so that every batch entry carries its
+        # own kinematic and dynamic state
+        self._datas = [self._data] + [
+            self._model.createData() for _ in range(self._n_batch - 1)
+        ]
+        self._invalidate_cache()
+
+        if entry is not None:
+            for attr in _CACHED_CONFIG:
+                setattr(self, attr, entry[attr])
+            return
+
+        self._config_from_model()
+        if cache_file is not None:
+            self._write_cache(cache_file)
+
+    def _config_from_model(self):
+        """
+        Id maps, index maps, mass and limits of the pinocchio model
+        """
         self._n_q = self._model.nq
         self._n_q_dot = self._model.nv
         self._n_a = self._n_q_dot - self._n_floating
@@ -71,6 +196,17 @@ class PinocchioRobotSystem(RobotSystem):
 
         assert len(self._joint_id) == self._n_a
 
+        # Index maps of the actuated joints in joint_id order, resolved once
+        # so that update_system does not look joints up by name every tick
+        self._joint_names = tuple(self._joint_id.keys())
+        self._joint_q_idx = np.array(self.get_q_idx(list(self._joint_names)))
+        self._joint_q_dot_idx = np.array(
+            self.get_q_dot_idx(list(self._joint_names)))
+        self._joint_idx = np.array(self.get_joint_idx(list(self._joint_names)))
+        # q index of each entry of joint_positions
+        self._q_idx_of_joint_idx = np.zeros(self._n_a, dtype=int)
+        self._q_idx_of_joint_idx[self._joint_idx] = self._joint_q_idx
+
         self._total_mass = sum(
             [inertia.mass for inertia in self._model.inertias])
 
@@ -113,13 +249,9 @@ class PinocchioRobotSystem(RobotSystem):
                 joint_id)].idx_v - self._n_floating
 
     def create_cmd_ordered_dict(self, joint_trq_cmd):
-        command = OrderedDict()
-        command["joint_trq"] = OrderedDict()
-
-        for k, v in self._joint_id.items():
-            command["joint_trq"][k] = joint_trq_cmd[v]
-
-        return command
+        # joint_trq_cmd is either [n_a] or [n_batch, n_a], wrapped without
+        # copies, command["joint_trq"][k] still reads like the joint dict
+        return JointCommand(self._joint_id, joint_trq_cmd)
 
     def update_system(self,
                       base_com_pos,
@@ -133,142 +265,327 @@ class PinocchioRobotSystem(RobotSystem):
                       joint_pos,
                       joint_vel,
                       b_cent=False):
+        """
+        Every argument is either a single-environment quantity, which is
+        broadcast to all n_batch environments, or a batched quantity with a
+        leading [n_batch] dimension. Joint dict values may be floats or
+        arrays of size n_batch.
+        """
 
         assert len(joint_pos.keys()) == self._n_a
-        self._q = np.zeros(self._n_q)
-        self._q_dot = np.zeros(self._n_q_dot)
-        self._joint_positions = np.zeros(self._n_a)
-        self._joint_velocities = np.zeros(self._n_a)
+        self._invalidate_cache()
+        self._q = np.zeros((self._n_batch, self._n_q))
+        self._q_dot = np.zeros((self._n_batch, self._n_q_dot))
+        self._joint_positions = np.zeros((self._n_batch, self._n_a))
+        self._joint_velocities = np.zeros((self._n_batch, self._n_a))
         if not self._b_fixed_base:
             # Floating Based Robot
-            self._q[0:3] = np.copy(base_joint_pos)
-            self._q[3:7] = np.copy(base_joint_quat)
-
-            rot_w_basejoint = util.quat_to_rot(base_joint_quat)
-            twist_basejoint_in_world = np.zeros(6)
-            twist_basejoint_in_world[0:3] = base_joint_ang_vel
-            twist_basejoint_in_world[3:6] = base_joint_lin_vel
-            augrot_joint_world = np.zeros((6, 6))
-            augrot_joint_world[0:3, 0:3] = rot_w_basejoint.transpose()
-            augrot_joint_world[3:6, 3:6] = rot_w_basejoint.transpose()
-            twist_basejoint_in_joint = np.dot(augrot_joint_world,
-                                              twist_basejoint_in_world)
-            self._q_dot[0:3] = twist_basejoint_in_joint[3:6]
-            self._q_dot[3:6] = twist_basejoint_in_joint[0:3]
+            base_joint_quat = self._to_batch(base_joint_quat)
+            base_joint_lin_vel = self._to_batch(base_joint_lin_vel)
+            base_joint_ang_vel = self._to_batch(base_joint_ang_vel)
+            self._q[:, 0:3] = self._to_batch(base_joint_pos)
+            self._q[:, 3:7] = base_joint_quat
+
+            for i in range(self._n_batch):
+                rot_w_basejoint = util.quat_to_rot(base_joint_quat[i])
+                self._q_dot[i, 0:3] = np.dot(rot_w_basejoint.transpose(),
+                                             base_joint_lin_vel[i])
+                self._q_dot[i, 3:6] = np.dot(rot_w_basejoint.transpose(),
+                                             base_joint_ang_vel[i])
         else:
             # Fixed Based Robot
             pass
 
-        self._q[self.get_q_idx(list(joint_pos.keys()))] = np.copy(
-            list(joint_pos.values()))
-        self._q_dot[self.get_q_dot_idx(list(joint_vel.keys()))] = np.copy(
-            list(joint_vel.values()))
-        self._joint_positions[self.get_joint_idx(list(
-            joint_pos.keys()))] = np.copy(list(joint_pos.values()))
-        self._joint_velocities[self.get_joint_idx(list(
-            joint_vel.keys()))] = np.copy(list(joint_vel.values()))
+        joint_pos_val = self._joint_dict_to_batch(joint_pos)
+        joint_vel_val = self._joint_dict_to_batch(joint_vel)
+        q_idx, _, joint_idx = self._joint_index_maps(joint_pos)
+        self._q[:, q_idx] = joint_pos_val
+        self._joint_positions[:, joint_idx] = joint_pos_val
+        _, q_dot_idx, joint_idx = self._joint_index_maps(joint_vel)
+        self._q_dot[:, q_dot_idx] = joint_vel_val
+        self._joint_velocities[:, joint_idx] = joint_vel_val
+
+        self._update_kinematics_from_q(b_cent)
+
+    def update_system_from_arrays(self, q, q_dot, b_cent=False):
+        """
+        Fast path of update_system without any dict handling
+
+        Parameters
+        ----------
+        q (np.array or torch.tensor):
+            Positions in generalized coordinate. Size of (n_q) or (n_batch, n_q)
+        q_dot (np.array or torch.tensor):
+            Velocities in generalized coordinate. Size of (n_q_dot) or
+            (n_batch, n_q_dot)
+        b_cent (Bool): Whether updating centroidal frame or not
+        """
+        self._invalidate_cache()
+        self._q = np.array(self._to_batch(q))
+        self._q_dot = np.array(self._to_batch(q_dot))
+        self._joint_positions = self._q[:, self._q_idx_of_joint_idx]
+        self._joint_velocities = np.copy(
+            self._q_dot[:, self._n_floating:self._n_floating + self._n_a])
+
+        self._update_kinematics_from_q(b_cent)
+
+    def _update_kinematics_from_q(self, b_cent):
+        for data, q, q_dot in zip(self._datas, self._q, self._q_dot):
+            pin.forwardKinematics(self._model, data, q, q_dot)
 
-        pin.forwardKinematics(self._model, self._data, self._q, self._q_dot)
-
-        #assert False
         if b_cent:
             self._update_centroidal_quantities()
 
-    def _update_centroidal_quantities(self):
-        pin.ccrba(self._model, self._data, self._q, self._q_dot)
-
-        self._hg = np.zeros_like(self._data.hg)
-        self._hg[0:3] = np.copy(self._data.hg.angular)
-        self._hg[3:6] = np.copy(self._data.hg.linear)
-
-        self._Ag = np.zeros_like(self._data.Ag)
-        self._Ag[0:3] = np.copy(self._data.Ag[3:6, :])
-        self._Ag[3:6] = np.copy(self._data.Ag[0:3, :])
+    def _joint_index_maps(self, joint_dict):
+        if tuple(joint_dict.keys()) == self._joint_names:
+            return self._joint_q_idx, self._joint_q_dot_idx, self._joint_idx
+        joint_names = list(joint_dict.keys())
+        return self.get_q_idx(joint_names), self.get_q_dot_idx(
+            joint_names), self.get_joint_idx(joint_names)
+
+    def _to_batch(self, val):
+        val = np.asarray(val, dtype=np.float64)
+        if val.ndim == 1:
+            return np.broadcast_to(val, (self._n_batch, val.shape[0]))
+        assert val.shape[0] == self._n_batch
+        return val
+
+    def _joint_dict_to_batch(self, joint_dict):
+        # [n_a] (shared) or [n_a, n_batch] (per environment) -> [n_batch, n_a]
+        val = np.array([np.asarray(v, dtype=np.float64).reshape(-1)
+                        for v in joint_dict.values()])
+        if val.shape[1] == 1:
+            return np.broadcast_to(val[:, 0], (self._n_batch, val.shape[0]))
+        assert val.shape[1] == self._n_batch
+        return val.transpose()
+
+    def _stack_envs(self, fn):
+        """
+        Evaluate fn(data, q, q_dot) for every environment and stack the
+        results into a [n_batch, ...] double tensor
+        """
+        return torch.from_numpy(
+            np.stack([
+                np.asarray(fn(data, q, q_dot), dtype=np.float64)
+                for data, q, q_dot in zip(self._datas, self._q, self._q_dot)
+            ]))
+
+    def _invalidate_cache(self):
+        """
+        Drop every kinematics/dynamics quantity computed for the previous
+        (q, q_dot). Only update_system should call this.
+        """
+        self._cache = dict()
+        self._kin_flags = set()
+
+    def _cached(self, key, fn):
+        if key not in self._cache:
+            self._cache[key] = fn()
+        return self._cache[key].clone()
+
+    def _update_kinematics(self, flag):
+        """
+        Run a whole-tree Pinocchio pass at most once per update_system
+            jacobians: joint jacobians for frame jacobians
+            zero_acc: forward kinematics with zero acceleration for jdot_qdot
+        """
+        if flag in self._kin_flags:
+            return
+        for data, q, q_dot in zip(self._datas, self._q, self._q_dot):
+            if flag == 'jacobians':
+                pin.computeJointJacobians(self._model, data, q)
+            elif flag == 'zero_acc':
+                pin.forwardKinematics(self._model, data, q, q_dot, 0 * q_dot)
+            else:
+                raise ValueError("wrong kinematics pass")
+        self._kin_flags.add(flag)
 
-        self._Ig = np.zeros_like(self._data.Ig)
-        self._Ig[0:3, 0:3] = np.copy(self._data.Ig)[3:6, 3:6]
-        self._Ig[3:6, 3:6] = np.copy(self._data.Ig)[0:3, 0:3]
+    def _update_centroidal_quantities(self):
+        self._hg = np.zeros((self._n_batch, 6))
+        self._Ag = np.zeros((self._n_batch, 6, self._n_q_dot))
+        self._Ig = np.zeros((self._n_batch, 6, 6))
+        for i, (data, q, q_dot) in enumerate(
+                zip(self._datas, self._q, self._q_dot)):
+            pin.ccrba(self._model, data, q, q_dot)
+            self._copy_centroidal_quantities(i, data)
+
+    def _copy_centroidal_quantities(self, i, data):
+        self._hg[i, 0:3] = data.hg.angular
+        self._hg[i, 3:6] = data.hg.linear
+
+        self._Ag[i, 0:3] = data.Ag[3:6, :]
+        self._Ag[i, 3:6] = data.Ag[0:3, :]
+
+        self._Ig[i, 0:3, 0:3] = data.Ig.matrix()[3:6, 3:6]
+        self._Ig[i, 3:6, 3:6] = data.Ig.matrix()[0:3, 0:3]
+
+    def compute_all_terms(self):
+        if 'all_terms' in self._kin_flags:
+            return
+        mass_matrix = np.zeros((self._n_batch, self._n_q_dot, self._n_q_dot))
+        mass_matrix_inv = np.zeros_like(mass_matrix)
+        nle = np.zeros((self._n_batch, self._n_q_dot))
+        gravity = np.zeros_like(nle)
+        com_pos = np.zeros((self._n_batch, 3))
+        com_lin_vel = np.zeros_like(com_pos)
+        com_lin_jacobian = np.zeros((self._n_batch, 3, self._n_q_dot))
+        self._hg = np.zeros((self._n_batch, 6))
+        self._Ag = np.zeros((self._n_batch, 6, self._n_q_dot))
+        self._Ig = np.zeros((self._n_batch, 6, 6))
+        for i, (data, q, q_dot) in enumerate(
+                zip(self._datas, self._q, self._q_dot)):
+            pin.computeAllTerms(self._model, data, q, q_dot)
+            # Only the upper triangular parts of M and Minv are guaranteed
+            mass_matrix[i] = np.triu(data.M) + np.triu(data.M, 1).transpose()
+            nle[i] = data.nle
+            gravity[i] = data.g
+            com_pos[i] = data.com[0]
+            com_lin_vel[i] = data.vcom[0]
+            com_lin_jacobian[i] = data.Jcom
+            self._copy_centroidal_quantities(i, data)
+            pin.computeMinverse(self._model, data, q)
+            mass_matrix_inv[i] = np.triu(
+                data.Minv) + np.triu(data.Minv, 1).transpose()
+
+        self._cache['mass_matrix'] = torch.from_numpy(mass_matrix)
+        self._cache['mass_matrix_inv'] = torch.from_numpy(mass_matrix_inv)
+        self._cache['gravity'] = torch.from_numpy(gravity)
+        self._cache['coriolis'] = torch.from_numpy(nle - gravity)
+        self._cache['com_pos'] = torch.from_numpy(com_pos)
+        self._cache['com_lin_vel'] = torch.from_numpy(com_lin_vel)
+        self._cache['com_lin_jacobian'] = torch.from_numpy(com_lin_jacobian)
+        # Joint jacobians are up to date, data.a is not the zero acc one
+        self._kin_flags.discard('zero_acc')
+        self._kin_flags.update(['jacobians', 'all_terms'])
 
     def get_q(self):
-        return torch.from_numpy(np.copy(self._q)).expand(self._n_batch, -1).double().clone()
+        return torch.from_numpy(np.copy(self._q)).double()
 
     def get_q_dot(self):
-        return torch.from_numpy(np.copy(self._q_dot)).expand(self._n_batch, -1).double().clone()
+        return torch.from_numpy(np.copy(self._q_dot)).double()
 
     def get_mass_matrix(self):
-        return torch.from_numpy(np.copy(pin.crba(self._model, self._data, self._q))).expand(self._n_batch, -1, -1).double().clone()
+        return self._cached(
+            'mass_matrix', lambda: self._stack_envs(
+                lambda data, q, q_dot: pin.crba(self._model, data, q)))
+
+    def get_mass_matrix_inv(self):
+
+        def _mass_matrix_inv(data, q, q_dot):
+            minv = pin.computeMinverse(self._model, data, q)
+            return np.triu(minv) + np.triu(minv, 1).transpose()
+
+        return self._cached('mass_matrix_inv',
+                            lambda: self._stack_envs(_mass_matrix_inv))
 
     def get_gravity(self):
-        return torch.from_numpy(np.copy(
-            pin.computeGeneralizedGravity(self._model, self._data, self._q))).expand(self._n_batch, -1).double().clone()
 
-    def get_coriolis(self): #TODO: change when BATHCED sim
-        return torch.from_numpy(np.copy(
-            pin.nonLinearEffects(self._model, self._data, self._q, self._q_dot)
-            - self.get_gravity()[0, :].numpy())).expand(self._n_batch, -1).double().clone()
+        def _gravity():
+            self._kin_flags.discard('zero_acc')
+            return self._stack_envs(lambda data, q, q_dot: pin.
+                                    computeGeneralizedGravity(
+                                        self._model, data, q))
+
+        return self._cached('gravity', _gravity)
+
+    def get_coriolis(self):
+
+        def _coriolis():
+            self._kin_flags.discard('zero_acc')
+            return self._stack_envs(lambda data, q, q_dot: pin.
+                                    nonLinearEffects(self._model, data, q,
+                                                     q_dot)) - self.get_gravity()
+
+        return self._cached('coriolis', _coriolis)
 
     def get_com_pos(self):
-        pin.centerOfMass(self._model, self._data, self._q, self._q_dot)
-        return torch.from_numpy(np.copy(self._data.com[0])).expand(self._n_batch, -1).double().clone()
+        return self._cached(
+            'com_pos', lambda: self._stack_envs(
+                lambda data, q, q_dot: pin.centerOfMass(
+                    self._model, data, q, q_dot)))
 
     def get_com_lin_vel(self):
-        pin.centerOfMass(self._model, self._data, self._q, self._q_dot)
-        return torch.from_numpy(np.copy(self._data.vcom[0])).expand(self._n_batch, -1).double().clone()
+
+        def _com_lin_vel(data, q, q_dot):
+            pin.centerOfMass(self._model, data, q, q_dot)
+            return data.vcom[0]
+
+        return self._cached('com_lin_vel',
+                            lambda: self._stack_envs(_com_lin_vel))
 
     def get_com_lin_jacobian(self):
-        return torch.from_numpy(np.copy(
-            pin.jacobianCenterOfMass(self._model, self._data, self._q))).expand(self._n_batch, -1, -1).double().clone()
+        return self._cached(
+            'com_lin_jacobian', lambda: self._stack_envs(
+                lambda data, q, q_dot: pin.jacobianCenterOfMass(
+                    self._model, data, q)))
 
     def get_com_lin_jacobian_dot(self):
-        return torch.from_numpy(np.copy((pin.computeCentroidalMapTimeVariation(
-            self._model, self._data, self._q, self._q_dot)[0:3, :]) /
-                       self._total_mass)).expand(self._n_batch, -1, -1).double().clone()
+        return self._cached(
+            'com_lin_jacobian_dot', lambda: self._stack_envs(
+                lambda data, q, q_dot: pin.computeCentroidalMapTimeVariation(
+                    self._model, data, q, q_dot)[0:3, :] / self._total_mass))
 
     def get_link_iso(self, link_id):
-        ret = np.eye(4)
         frame_id = self._model.getFrameId(link_id)
-        trans = pin.updateFramePlacement(self._model, self._data, frame_id)
-        ret[0:3, 0:3] = trans.rotation
-        ret[0:3, 3] = trans.translation
-        return torch.from_numpy(np.copy(ret)).expand(self._n_batch, -1, -1).double().clone()
+
+        def _link_iso(data, q, q_dot):
+            ret = np.eye(4)
+            trans = pin.updateFramePlacement(self._model, data, frame_id)
+            ret[0:3, 0:3] = trans.rotation
+            ret[0:3, 3] = trans.translation
+            return ret
+
+        return self._cached(('link_iso', link_id),
+                            lambda: self._stack_envs(_link_iso))
 
     def get_link_vel(self, link_id):
-        ret = np.zeros(6)
         frame_id = self._model.getFrameId(link_id)
 
-        spatial_vel = pin.getFrameVelocity(
-            self._model, self._data, frame_id,
-            pin.ReferenceFrame.LOCAL_WORLD_ALIGNED)
-
-        ret[0:3] = spatial_vel.angular
-        ret[3:6] = spatial_vel.linear
+        def _link_vel(data, q, q_dot):
+            ret = np.zeros(6)
+            spatial_vel = pin.getFrameVelocity(
+                self._model, data, frame_id,
+                pin.ReferenceFrame.LOCAL_WORLD_ALIGNED)
+            ret[0:3] = spatial_vel.angular
+            ret[3:6] = spatial_vel.linear
+            return ret
 
-        return torch.from_numpy(np.copy(ret)).expand(self._n_batch, -1).double().clone()
+        return self._cached(('link_vel', link_id),
+                            lambda: self._stack_envs(_link_vel))
 
     def get_link_jacobian(self, link_id):
         frame_id = self._model.getFrameId(link_id)
-        pin.computeJointJacobians(self._model, self._data, self._q)
-        jac = pin.getFrameJacobian(self._model, self._data, frame_id,
-                                   pin.ReferenceFrame.LOCAL_WORLD_ALIGNED)
 
-        # Pinocchio has linear on top of angular
-        ret = np.zeros_like(jac)
-        ret[0:3] = jac[3:6]
-        ret[3:6] = jac[0:3]
+        def _link_jacobian(data, q, q_dot):
+            jac = pin.getFrameJacobian(self._model, data, frame_id,
+                                       pin.ReferenceFrame.LOCAL_WORLD_ALIGNED)
+            # Pinocchio has linear on top of angular
+            ret = np.zeros_like(jac)
+            ret[0:3] = jac[3:6]
+            ret[3:6] = jac[0:3]
+            return ret
 
-        return torch.from_numpy(np.copy(ret)).expand(self._n_batch, -1, -1).double().clone()
+        def _link_jacobians():
+            self._update_kinematics('jacobians')
+            return self._stack_envs(_link_jacobian)
+
+        return self._cached(('link_jacobian', link_id), _link_jacobians)
 
     def get_link_jacobian_dot_times_qdot(self, link_id):
         frame_id = self._model.getFrameId(link_id)
 
-        pin.forwardKinematics(self._model, self._data, self._q, self._q_dot,
-                              0 * self._q_dot)
-        jdot_qdot = pin.getFrameClassicalAcceleration(
-            self._model, self._data, frame_id,
-            pin.ReferenceFrame.LOCAL_WORLD_ALIGNED)
-
-        ret = np.zeros_like(jdot_qdot)
-        ret[0:3] = jdot_qdot.angular
-        ret[3:6] = jdot_qdot.linear
-
-        return torch.from_numpy(np.copy(ret)).expand(self._n_batch, -1).double().clone()
+        def _link_jacobian_dot_times_qdot(data, q, q_dot):
+            jdot_qdot = pin.getFrameClassicalAcceleration(
+                self._model, data, frame_id,
+                pin.ReferenceFrame.LOCAL_WORLD_ALIGNED)
+            ret = np.zeros(6)
+            ret[0:3] = jdot_qdot.angular
+            ret[3:6] = jdot_qdot.linear
+            return ret
+
+        def _link_jacobians_dot_times_qdot():
+            self._update_kinematics('zero_acc')
+            return self._stack_envs(_link_jacobian_dot_times_qdot)
+
+        return self._cached(('link_jacobian_dot_times_qdot', link_id),
+                            _link_jacobians_dot_times_qdot)
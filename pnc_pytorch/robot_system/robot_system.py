@@ -255,6 +255,9 @@ class RobotSystem(abc.ABC):
         joint_pos (OrderedDict): Actuator pos
         joint_vel (OrderedDict): Actuator vel
         b_cent (Bool): Whether updating centroidal frame or not
+
+        Base quantities are either shared by every environment or batched as
+        [n_batch, ...]. Joint values are floats or arrays of size n_batch.
         """
         pass
 
@@ -285,6 +288,23 @@ class RobotSystem(abc.ABC):
         """
         pass
 
+    def get_mass_matrix_inv(self):
+        """
+        Returns
+        -------
+        A_inv (torch.tensor): Inverse of the mass matrix
+        """
+        return torch.linalg.inv(self.get_mass_matrix())
+
+    def compute_all_terms(self):
+        """
+        Compute mass matrix, its inverse, coriolis, gravity, jacobians and
+        centroidal quantities of the current state in a single pass, so that
+        the getters afterwards read from that snapshot. Robot systems without
+        a single-pass implementation keep computing them lazily.
+        """
+        pass
+
     @abc.abstractmethod
     def get_gravity(self):
         """
@@ -3,10 +3,8 @@ import numpy as np
 import torch
 
 np.set_printoptions(precision=2, threshold=sys.maxsize)
-from scipy.linalg import block_diag
 from util import util
 from pnc_pytorch.data_saver import DataSaver
-from qpsolvers import solve_qp
 
 from pnc_pytorch.wbc.ihwbc.qpth.qp import QPFunction   #for now like this for testing 
                                                        #afterwards should put in conda 
@@ -28,9 +26,51 @@ def is_psd2(mat):
             
     return is_symmetric and eigenvalues_non_negative
 
-def ensure_psd_add_Id(matrix, epsilon):
-    m = torch.eye(matrix.shape[1], matrix.shape[2]).repeat(matrix.shape[0], 1, 1)
-    return matrix + epsilon*m
+def add_Id_(matrix, epsilon):
+    # In place: adds epsilon on the diagonal of every batch entry
+    torch.diagonal(matrix, dim1=1, dim2=2).add_(epsilon)
+    return matrix
+
+
+class IHWBCWorkspace(object):
+    """
+    Preallocated QP buffers of IHWBC
+    ------------------
+    Sized once from the contact / internal constraint / torque limit layout
+    and refilled in place by IHWBC.solve. Blocks that are structurally zero
+    are written only here.
+    """
+    def __init__(self, n_batch, n_q_dot, n_active, cone_shapes, dim_internal,
+                 b_trq_limit):
+        self.layout = (cone_shapes, dim_internal, b_trq_limit)
+
+        b_contact = cone_shapes is not None
+        dim_cone_constraint = sum(
+            [shape[0] for shape in cone_shapes]) if b_contact else 0
+        dim_contacts = sum([shape[1] for shape in cone_shapes]) if b_contact else 0
+        dim_x = n_q_dot + dim_contacts
+        dim_ineq = dim_cone_constraint + (2 * n_active if b_trq_limit else 0)
+        kw = dict(dtype=torch.double)
+
+        self.dim_cone_constraint = dim_cone_constraint
+        self.dim_contacts = dim_contacts
+
+        self.eye = torch.eye(n_q_dot, **kw).expand(n_batch, -1, -1)
+        self.eye_active = torch.eye(n_active, **kw).expand(n_batch, -1, -1)
+        self.zero_q_dot = torch.zeros(n_batch, n_q_dot, **kw)
+        self.ni = torch.zeros(n_batch, n_q_dot, n_q_dot, **kw)
+
+        self.cost_mat = torch.zeros(n_batch, dim_x, dim_x, **kw)
+        self.cost_vec = torch.zeros(n_batch, dim_x, **kw)
+        self.uf_mat = torch.zeros(n_batch, dim_cone_constraint, dim_contacts,
+                                  **kw) if b_contact else None
+        self.eq_mat = torch.zeros(n_batch, 6 + dim_internal, dim_x, **kw)
+        self.eq_vec = torch.zeros(n_batch, 6 + dim_internal, **kw)
+        if dim_ineq > 0:
+            self.ineq_mat = torch.zeros(n_batch, dim_ineq, dim_x, **kw)
+            self.ineq_vec = torch.zeros(n_batch, dim_ineq, **kw)
+        else:
+            self.ineq_mat = self.ineq_vec = None
 
 
 class IHWBC(object):
@@ -61,6 +101,9 @@ class IHWBC(object):
         self._w_rf = 0.         #must be dim 1
         self._w_hierarchy = 0.  #must be [n_batch , #tasks]
 
+        self._workspace = None
+        self.qp_n_iters = torch.zeros(self.n_batch, dtype=torch.long)
+
         self._b_data_save = data_save
         if self._b_data_save:
             self._data_saver = DataSaver()    #check data saver
@@ -118,6 +161,22 @@ class IHWBC(object):
         self._coriolis = torch.clone(coriolis).detach() #dim: nbatch x vector
         self._gravity = torch.clone(gravity).detach() #dim: nbatch x vector
 
+    def _get_workspace(self, contact_list, internal_constraint_list):
+        if contact_list is not None:
+            cone_shapes = tuple(
+                tuple(contact.cone_constraint_mat.shape[-2:])
+                for contact in contact_list)
+        else:
+            cone_shapes = None
+        dim_internal = sum(
+            [ic.jacobian.shape[1] for ic in internal_constraint_list])
+        layout = (cone_shapes, dim_internal, self._trq_limit is not None)
+
+        if self._workspace is None or self._workspace.layout != layout:
+            self._workspace = IHWBCWorkspace(self.n_batch, self._n_q_dot,
+                                             self._n_active, *layout)
+        return self._workspace
+
     def solve(self,
               task_list,
               contact_list,
@@ -161,6 +220,8 @@ class IHWBC(object):
         #self._mass_matrix_inv
         #self._sa
 
+        ws = self._get_workspace(contact_list, internal_constraint_list)
+
         if len(internal_constraint_list) > 0:  
             ji = torch.cat(
                 [ic.jacobian for ic in internal_constraint_list], axis=1)     #ic.jacobian: [n_batch, etc]
@@ -172,10 +233,10 @@ class IHWBC(object):
                 torch.bmm(torch.bmm(ji, self._mass_matrix_inv), ji.transpose(1,2)))
 
             ji_bar = torch.bmm(torch.bmm(self._mass_matrix_inv, ji.transpose(1,2)), lmd)
-            ni = torch.eye(self._n_q_dot).unsqueeze(0).repeat(self.n_batch, 1, 1) - torch.bmm(ji_bar, ji)
+            ni = torch.sub(ws.eye, torch.bmm(ji_bar, ji), out=ws.ni)
 
-            jit_lmd_jidot_qdot = torch.squeeze(
-                torch.matmul(torch.bmm(ji.transpose(1,2), lmd), jidot_qdot.unsqueeze(2)))
+            jit_lmd_jidot_qdot = torch.matmul(
+                torch.bmm(ji.transpose(1,2), lmd), jidot_qdot.unsqueeze(2)).squeeze(2)
             sa_ni_trc = torch.bmm(self._sa, ni)[:, :, 6:]
 
             #TODO: check util funciton
@@ -184,9 +245,9 @@ class IHWBC(object):
             sa_ni_trc_bar_tr = sa_ni_trc_bar.transpose(1, 2)
             b_internal_constraint = True
         else:
-            ni = torch.eye(self._n_q_dot).unsqueeze(0).repeat(self.n_batch, 1, 1)
-            jit_lmd_jidot_qdot = torch.zeros(self._n_q_dot).unsqueeze(0).repeat(self.n_batch, 1)
-            sa_ni_trc_bar = torch.eye(self._n_active).unsqueeze(0).repeat(self._n_active, 1, 1)
+            ni = ws.eye
+            jit_lmd_jidot_qdot = ws.zero_q_dot
+            sa_ni_trc_bar = ws.eye_active
             sa_ni_trc_bar_tr = sa_ni_trc_bar.transpose(1,2)
             b_internal_constraint = False
 
@@ -200,8 +261,11 @@ class IHWBC(object):
         # ======================================================================
         # Cost
         # ======================================================================
-        cost_t_mat = torch.zeros(self.n_batch, self._n_q_dot, self._n_q_dot).to(torch.float64)
-        cost_t_vec = torch.zeros(self.n_batch, self._n_q_dot).to(torch.float64)
+        cost_t_mat = ws.cost_mat[:, :self._n_q_dot, :self._n_q_dot]
+        cost_t_vec = ws.cost_vec[:, :self._n_q_dot]
+        cost_t_mat.zero_()
+        cost_t_vec.zero_()
+        w_hierarchy = self._w_hierarchy.to(torch.float64)
 
         #the following must be batched torch tensors:
         #task.jacobian
@@ -210,83 +274,53 @@ class IHWBC(object):
         #self._w_hierarchy
         #task.op_cmd
         for i, task in enumerate(task_list):
-            j = task.jacobian
+            j = task.jacobian.to(torch.float64)
             j_dot_q_dot = task.jacobian_dot_q_dot
             x_ddot = task.op_cmd
             if verbose:
                 print("====================")
                 print(task.target_id, " task")
                 task.debug()
-            """
-            print("IHWBC")
-            print("jacobian rank", torch.linalg.matrix_rank(j), j.shape)
-            printvar("w", self._w_hierarchy)
-            printvar("jdotqdot", j_dot_q_dot)
-            printvar("xddot", x_ddot)
-            printvar("jacobian", j)
-            """
-            jTj_psd = ensure_psd_add_Id(torch.bmm(j.transpose(1,2).to(torch.float64), j.to(torch.float64)), 1e-9)
+            jTj_psd = add_Id_(torch.bmm(j.transpose(1,2), j), 1e-9)
 
-            cost_t_mat += self._w_hierarchy[:,i].unsqueeze(1).unsqueeze(1).to(torch.float64) * jTj_psd.to(torch.float64)
+            cost_t_mat += w_hierarchy[:,i].unsqueeze(1).unsqueeze(1) * jTj_psd
 
-            cost_t_vec += self._w_hierarchy[:,i].unsqueeze(1).to(torch.float64) * torch.matmul(
-                (j_dot_q_dot.to(torch.float64) - x_ddot.to(torch.float64)).unsqueeze(1), j.to(torch.float64)).squeeze().to(torch.float64)
+            cost_t_vec += w_hierarchy[:,i].unsqueeze(1) * torch.matmul(
+                (j_dot_q_dot - x_ddot).to(torch.float64).unsqueeze(1), j).squeeze(1)
 
         # cost_t_mat += self._lambda_q_ddot * np.eye(self._n_q_dot)
         #TODO: check why uses mass matrix
-        #printvar("cost_t_mat", cost_t_mat[0])
-        cost_t_mat += self._lambda_q_ddot * self._mass_matrix.to(torch.float64)
-
-        #printvar("cost_t_mat 2 ", cost_t_mat[0])
-        #printvar("cost t vec ", cost_t_vec[0])
+        cost_t_mat += self._lambda_q_ddot * self._mass_matrix
 
         #contact.cone_contraint_vec: torch.tensor([n_batch, 6])
         #contact.constraint_mat: torch.tensor([n_batch, 6, dim_contact)
         #contact.jacobian: torch.tensor([n_batch, dim_contact, robot.n_q])
+        dim_cone_constraint = ws.dim_cone_constraint
+        dim_contacts = ws.dim_contacts
         if contact_list is not None:   
 
-            """
-            CARLOS: For now use this to make batched block diagram
-            """
-            uf_mat_list = []
-            for i in range(self.n_batch):
-                uf_mat_list.append(torch.block_diag(*[contact.cone_constraint_mat[i]
-                    for contact in contact_list]))
-            uf_mat = torch.stack([*uf_mat_list], axis = 0)
-            """end batched """
+            uf_mat = util.block_diag_pytorch(
+                [contact.cone_constraint_mat for contact in contact_list],
+                out=ws.uf_mat)
 
             uf_vec = torch.cat(
                 [contact.cone_constraint_vec for contact in contact_list], axis = 1)
             contact_jacobian = torch.cat(
                 [contact.jacobian for contact in contact_list], axis=1)
-            assert uf_mat.shape[1] == uf_vec.shape[1]
             assert uf_mat.shape[2] == contact_jacobian.shape[1]
 
-            dim_cone_constraint = uf_mat.shape[1]
-            dim_contacts = uf_mat.shape[2]
-
-            cost_rf_mat = (self._lambda_rf + self._w_rf) * torch.eye(dim_contacts)
             #doesn't need to be batched, since params don't change between sims
+            torch.diagonal(ws.cost_mat[:, self._n_q_dot:, self._n_q_dot:],
+                           dim1=1, dim2=2).fill_(self._lambda_rf + self._w_rf)
 
             #TODO: make sure that i fwe don't have desired reaction forces, just put 0 instead
             if rf_des is None: #TODO: Make sure 
-                rf_des = torch.zeros(self.n_batch, dim_contacts)
-            
-            cost_rf_vec = -self._w_rf * torch.clone(rf_des).detach()#rf_des torch.tensor([n_batch, ...])
-
-            cost_mat_list = []
-            for i in range(self.n_batch):
-                cost_mat_list.append(torch.block_diag(cost_t_mat[i], cost_rf_mat)) # (nqdot+nc, nqdot+nc)
-            cost_mat = torch.stack([*cost_mat_list], axis = 0)
-            
-
-
-            cost_vec = torch.cat([cost_t_vec, cost_rf_vec], axis=1)  # (nqdot+nc,)
+                ws.cost_vec[:, self._n_q_dot:].zero_()
+            else:
+                ws.cost_vec[:, self._n_q_dot:] = -self._w_rf * rf_des #rf_des torch.tensor([n_batch, ...])
 
-        else:
-            dim_contacts = dim_cone_constraint = 0
-            cost_mat = torch.clone(cost_t_mat).detach()
-            cost_vec = torch.clone(cost_t_vec).detach()
+        cost_mat = ws.cost_mat # (nqdot+nc, nqdot+nc)
+        cost_vec = ws.cost_vec # (nqdot+nc,)
 
         #printvar("cost_t_mat 3", cost_t_mat[0])
 
@@ -320,107 +354,43 @@ class IHWBC(object):
         #TODO: check if b_internal_constraint depends on batch, right now assume same for all
         #TODO: check why ni
         #print("rank ni", torch.linalg.matrix_rank(ni), ni.shape)
+        eq_mat, eq_vec = ws.eq_mat, ws.eq_vec
+        eq_mat[:, :6, :self._n_q_dot] = torch.bmm(self._sf, self._mass_matrix)
         if contact_list is not None:
-            eq_floating_mat = torch.cat(
-                (torch.bmm(self._sf, self._mass_matrix),
-                 -torch.bmm(self._sf,torch.bmm(contact_jacobian, ni).transpose(1,2))),
-                dim=2)  # (6, nqdot+nc)
-            if b_internal_constraint:
-                eq_int_mat = torch.cat(
-                    (ji, torch.zeros(self.n_batch, ji.shape[1], dim_contacts)), dim=2)  # (2, nqdot+nc)
-                eq_int_vec = torch.zeros(self.n_batch, ji.shape[1])
-        else:
-            eq_floating_mat = torch.bmm(self._sf, self._mass_matrix)
-            if b_internal_constraint:
-                eq_int_mat = torch.clone(ji).detach()
-                eq_int_vec = torch.zeros(self.n_batch, ji.shape[1])
-        #printvar("ni^T", ni.transpose(1,2))
-        #printvar("coriolis", self._coriolis)
-        #printvar("grav", self._gravity)
-        #printvar("unsqueeze", (self._coriolis + self._gravity).unsqueeze(2))
-        #print(torch.matmul(ni.transpose(1,2), (self._coriolis + self._gravity).unsqueeze(2)))
-        eq_floating_vec = -torch.matmul(
-            self._sf, torch.matmul(ni.transpose(1,2), (self._coriolis + self._gravity).unsqueeze(2))).squeeze(2)
-
-        #printvar("eq_floating_mat", eq_floating_mat)
-        #printvar("eq_int_mat", eq_int_mat)
-        #printvar("eq_floaating_vec", eq_floating_vec)
-        #printvar("eq_int_vec", eq_int_vec)
+            jc_ni_tr = torch.bmm(contact_jacobian, ni).transpose(1,2)
+            eq_mat[:, :6, self._n_q_dot:] = -torch.bmm(self._sf, jc_ni_tr)  # (6, nqdot+nc)
         if b_internal_constraint:
-            eq_mat = torch.cat((eq_floating_mat, eq_int_mat), dim=1)
-            eq_vec = torch.cat((eq_floating_vec, eq_int_vec), dim=1)
-        else:
-            eq_mat = torch.clone(eq_floating_mat).detach()
-            eq_vec = torch.clone(eq_floating_vec).detach()
+            eq_mat[:, 6:, :self._n_q_dot] = ji  # (2, nqdot+nc), eq_int_vec stays 0
+        ni_tr_cori_grav = torch.matmul(ni.transpose(1,2),
+                                       (self._coriolis + self._gravity).unsqueeze(2))
+        eq_vec[:, :6] = -torch.matmul(self._sf, ni_tr_cori_grav).squeeze(2)
 
         # ======================================================================
         # Inequality Constraint
         # ======================================================================
 
-        if self._trq_limit is None:
-            if contact_list is not None:
-                ineq_mat = torch.cat((torch.zeros(self.n_batch, dim_cone_constraint, self._n_q_dot), 
-                                        -uf_mat), dim=2)
-                ineq_vec = -uf_vec
-            else:
-                ineq_mat = None
-                ineq_vec = None
+        ineq_mat, ineq_vec = ws.ineq_mat, ws.ineq_vec
+        if contact_list is not None:
+            ineq_mat[:, :dim_cone_constraint, self._n_q_dot:] = -uf_mat
+            ineq_vec[:, :dim_cone_constraint] = -uf_vec
 
-        else:
+        if self._trq_limit is not None:
             print("HELLO")
+            sa_ni_trc_bar_tr_snf = torch.bmm(sa_ni_trc_bar_tr, self._snf)
+            trq_mat = torch.bmm(sa_ni_trc_bar_tr_snf, self._mass_matrix)
+            trq_vec = torch.matmul(sa_ni_trc_bar_tr_snf, ni_tr_cori_grav).squeeze(2) + \
+                torch.matmul(sa_ni_trc_bar_tr_snf, jit_lmd_jidot_qdot.unsqueeze(2)).squeeze(2)
+            lower = slice(dim_cone_constraint, dim_cone_constraint + self._n_active)
+            upper = slice(dim_cone_constraint + self._n_active, None)
+
+            ineq_mat[:, lower, :self._n_q_dot] = -trq_mat
+            ineq_mat[:, upper, :self._n_q_dot] = trq_mat
             if contact_list is not None:
-                ineq_mat = torch.cat(
-                    (torch.cat(
-                        (torch.zeros((self.n_batch, dim_cone_constraint, self._n_q_dot)),
-                         -torch.bmm(sa_ni_trc_bar_tr,
-                                 torch.bmm(self._snf, self._mass_matrix)),
-                         torch.bmm(sa_ni_trc_bar_tr,
-                                torch.bmm(self._snf, self._mass_matrix))),
-                        dim=1),
-                     torch.cat(
-                         (-uf_mat,
-                          torch.bmm(torch.bmm(sa_ni_trc_bar_tr, self._snf),
-                                 torch.bmm(contact_jacobian, ni).transpose(1,2)),
-                          -torch.bmm(torch.bmm(sa_ni_trc_bar_tr, self._snf),
-                                  torch.bmm(contact_jacobian, ni).transpose(1,2))),
-                         dim=1)),
-                    dim=2)
-                ineq_vec = torch.cat(
-                    (-uf_vec,
-                     torch.matmul(
-                         torch.bmm(sa_ni_trc_bar_tr, self._snf),
-                         torch.matmul(ni.transpose(1,2),
-                                (self._coriolis + self._gravity).unsqueeze(2))).squeeze() +
-                     torch.matmul(torch.bmm(sa_ni_trc_bar_tr, self._snf),
-                            jit_lmd_jidot_qdot.unsqueeze(2)).squeeze() - self._trq_limit[:, :, 0],
-                     -torch.matmul(
-                         torch.bmm(sa_ni_trc_bar_tr, self._snf),
-                         torch.matmul(ni.transpose(1,2),
-                                (self._coriolis + self._gravity).unsqueeze(2))).squeeze() -
-                     torch.matmul(torch.bmm(sa_ni_trc_bar_tr, self._snf),
-                            jit_lmd_jidot_qdot.unsqueeze(2)).squeeze() + self._trq_limit[:, :, 1]),
-                    dim = 1)
-
-            else:
-                ineq_mat = torch.cat(
-                    (-torch.bmm(torch.bmm(sa_ni_trc_bar_tr, self._snf),
-                             self._mass_matrix),
-                     torch.bmm(torch.bmm(sa_ni_trc_bar_tr, self._snf),
-                            self._mass_matrix)),
-                    dim=1)
-                ineq_vec = torch.cat(
-                    (torch.matmul(
-                        torch.bmm(sa_ni_trc_bar_tr, self._snf),
-                        torch.matmul(ni.transpose(1,2),
-                               (self._coriolis + self._gravity).unsqueeze(2))).squeeze() +
-                     torch.matmul(torch.bmm(sa_ni_trc_bar_tr, self._snf),
-                            jit_lmd_jidot_qdot.unsqueeze(2)).squeeze() - self._trq_limit[:,:, 0],
-                     -torch.matmul(
-                         torch.bmm(sa_ni_trc_bar_tr, self._snf),
-                         torch.matmul(ni.transpose(1,2),
-                                (self._coriolis + self._gravity).unsqueeze(2))).squeeze() -
-                     torch.matmul(torch.bmm(sa_ni_trc_bar_tr, self._snf),
-                            jit_lmd_jidot_qdot.unsqueeze(2)).squeeze() + self._trq_limit[:,:, 1]))
+                trq_rf_mat = torch.bmm(sa_ni_trc_bar_tr_snf, jc_ni_tr)
+                ineq_mat[:, lower, self._n_q_dot:] = trq_rf_mat
+                ineq_mat[:, upper, self._n_q_dot:] = -trq_rf_mat
+            ineq_vec[:, lower] = trq_vec - self._trq_limit[:, :, 0]
+            ineq_vec[:, upper] = -trq_vec + self._trq_limit[:, :, 1]
 
         # if verbose:
         # print("eq_mat")
@@ -442,12 +412,14 @@ class IHWBC(object):
         #printvar("ineq_vec", ineq_vec[0,:])
         #printvar("eq_mat", eq_mat[0,:,:])
         #printvar("eq_vec", eq_vec[0,:])
-        self.cost_mat = cost_mat[0,:,:]
-        self.cost_vec = cost_vec[0,:]
-        self.ineq_mat = ineq_mat[0,:,:]
-        self.ineq_vec = ineq_vec[0,:]
-        self.eq_mat = eq_mat[0,:,:]
-        self.eq_vec = eq_vec[0,:]
+        # copies of the first environment QP, the workspace is refilled by
+        # the next solve
+        self.cost_mat = cost_mat[0,:,:].clone()
+        self.cost_vec = cost_vec[0,:].clone()
+        self.ineq_mat = ineq_mat[0,:,:].clone()
+        self.ineq_vec = ineq_vec[0,:].clone()
+        self.eq_mat = eq_mat[0,:,:].clone()
+        self.eq_vec = eq_vec[0,:].clone()
 
         #exit()
         eps = 1e-3
@@ -460,12 +432,6 @@ class IHWBC(object):
         #TODO: if nan's on solution check cost_mat and eq_mat
         #sol = QPFunction(verbose = -1)(cost_mat.float(), cost_vec.float(), ineq_mat, ineq_vec, eq_mat, eq_vec)
 
-        cost_mat = cost_mat.double()
-        cost_vec = cost_vec.double()
-        ineq_mat = ineq_mat.double()
-        ineq_vec = ineq_vec.double()
-        eq_mat = eq_mat.double()
-        eq_vec = eq_vec.double()
         """
         print("cost psd:", is_psd2(cost_mat[0]))
         print(cost_mat[0].numpy(), 
@@ -497,7 +463,13 @@ class IHWBC(object):
         print(torch.isnan(ineq_vec).any().item())  
         print(ineq_vec)
         """
-        sol = QPFunction(verbose = -1)(cost_mat, cost_vec, ineq_mat, ineq_vec, eq_mat, eq_vec)
+        qp = (cost_mat, cost_vec, ineq_mat, ineq_vec, eq_mat, eq_vec)
+        if torch.is_grad_enabled() and any(
+                m is not None and m.requires_grad for m in qp):
+            # QPFunction saves its inputs for backward, which must not see
+            # the workspace refilled by the next solve
+            qp = tuple(m if m is None else m.clone() for m in qp)
+        sol = QPFunction(verbose = -1, n_iters = self.qp_n_iters)(*qp)
 
 
         self.sol = sol
@@ -515,8 +487,8 @@ class IHWBC(object):
             joint_trq_cmd = torch.matmul(
                 torch.bmm(sa_ni_trc_bar_tr, self._snf),
                 torch.matmul(self._mass_matrix, sol_q_ddot.unsqueeze(2)) +
-                torch.matmul(ni.transpose(1,2), (self._coriolis + self._gravity).unsqueeze(2)) -
-                torch.matmul(torch.bmm(contact_jacobian, ni).transpose(1,2), sol_rf.unsqueeze(2))).squeeze(2)
+                ni_tr_cori_grav -
+                torch.matmul(jc_ni_tr, sol_rf.unsqueeze(2))).squeeze(2)
         else:
             joint_trq_cmd = torch.matmul(
                 torch.bmm(sa_ni_trc_bar_tr, self._snf),
@@ -17,7 +17,12 @@ class QPSolvers(Enum):
 
 def QPFunction(eps=1e-12, verbose=0, notImprovedLim=3,
                  maxIter=20, solver=QPSolvers.PDIPM_BATCHED,
-                 check_Q_spd=True):
+                 check_Q_spd=True, n_iters=None):
+    """
+    n_iters (torch.tensor([nBatch], dtype=torch.long)):
+        Optional output, filled by PDIPM_BATCHED with the interior point
+        iterations spent on every batch member
+    """
     class QPFunctionFn(Function):
         @staticmethod
         def forward(ctx, Q_, p_, G_, h_, A_, b_):
@@ -78,12 +83,9 @@ def QPFunction(eps=1e-12, verbose=0, notImprovedLim=3,
             A, _ = expandParam(A_, nBatch, 3)
             b, _ = expandParam(b_, nBatch, 2)
 
-            if check_Q_spd:
-                for i in range(nBatch):
-                    try:
-                        torch.linalg.cholesky(Q)
-                    except:
-                        raise RuntimeError('Q is not SPD.')
+            # One batched factorization both validates Q and is reused
+            # by pre_factor_kkt
+            Q_LU = pdipm_b.spd_factor(Q) if check_Q_spd else None
 
             _, nineq, nz = G.size()
             neq = A.size(1) if A.nelement() > 0 else 0
@@ -92,12 +94,13 @@ def QPFunction(eps=1e-12, verbose=0, notImprovedLim=3,
 
             if solver == QPSolvers.PDIPM_BATCHED:
                 #print("hOLA 1", Q, G, A)
-                ctx.Q_LU, ctx.S_LU, ctx.R = pdipm_b.pre_factor_kkt(Q, G, A)
+                ctx.Q_LU, ctx.S_LU, ctx.R = pdipm_b.pre_factor_kkt(Q, G, A, Q_LU)
                 zhats, ctx.nus, ctx.lams, ctx.slacks = pdipm_b.forward(
                     Q, p, G, h, A, b, ctx.Q_LU, ctx.S_LU, ctx.R,
-                    eps, verbose, notImprovedLim, maxIter)
+                    eps, verbose, notImprovedLim, maxIter, n_iters=n_iters)
                 #print("hola", ctx.S_LU)
             elif solver == QPSolvers.CVXPY:
+                from .solvers import cvxpy as solver_cvxpy
                 vals = torch.Tensor(nBatch).type_as(Q)
                 zhats = torch.Tensor(nBatch, ctx.nz).type_as(Q)
                 lams = torch.Tensor(nBatch, ctx.nineq).type_as(Q)
@@ -106,7 +109,7 @@ def QPFunction(eps=1e-12, verbose=0, notImprovedLim=3,
                 slacks = torch.Tensor(nBatch, ctx.nineq).type_as(Q)
                 for i in range(nBatch):
                     Ai, bi = (A[i], b[i]) if neq > 0 else (None, None)
-                    vals[i], zhati, nui, lami, si = solvers.cvxpy.forward_single_np(
+                    vals[i], zhati, nui, lami, si = solver_cvxpy.forward_single_np(
                         *[x.cpu().numpy() if x is not None else None
                         for x in (Q[i], p[i], G[i], h[i], Ai, bi)])
                     # if zhati[0] is None:
@@ -253,3 +256,70 @@ class SpQPFunction(Function):
         grads = (dQs, dps, dGs, dhs, dAs, dbs)
 
         return grads
+
+
+class PrefactoredQP(object):
+    """
+    Batched QP with constant Q, G and A
+    ------------------
+    Q is validated and factored, together with the Q-dependent blocks of the
+    KKT Schur complement, once at construction. Every call only takes the
+    right-hand sides p, h and b, and reuses the cached factorization (solve
+    only, no gradients). The interior point iterations still refactor the
+    small block that depends on the current slacks.
+
+    Parameters:
+    Q:  A (nz, nz) Tensor.
+    G:  A (nineq, nz) Tensor.
+    A:  A (neq, nz) Tensor, or an empty Tensor if there are no equalities.
+    solver: pdipm_b.KKTSolvers.CHOL_NORMAL for small problems without
+            equalities, nothing is prefactored beyond the SPD check then.
+    """
+    def __init__(self, Q, G, A, eps=1e-12, verbose=0, notImprovedLim=3,
+                 maxIter=20, solver=pdipm_b.KKTSolvers.LU_PARTIAL):
+        self.eps = eps
+        self.verbose = verbose
+        self.notImprovedLim = notImprovedLim
+        self.maxIter = maxIter
+        self.solver = solver
+
+        self._Q, self._G = Q.unsqueeze(0), G.unsqueeze(0)
+        self._A = A.unsqueeze(0) if A.nelement() > 0 else A
+        Q_LU = pdipm_b.spd_factor(self._Q)
+        if solver == pdipm_b.KKTSolvers.CHOL_NORMAL:
+            assert self._A.nelement() == 0
+            self._Q_LU, self._S_LU, self._R = None, None, None
+        else:
+            self._Q_LU, self._S_LU, self._R = pdipm_b.pre_factor_kkt(
+                self._Q, self._G, self._A, Q_LU)
+
+    def __call__(self, p, h, b, n_iters=None, mask=None):
+        """
+        p:  A (nBatch, nz) or (nz) Tensor.
+        h:  A (nBatch, nineq) or (nineq) Tensor.
+        b:  A (nBatch, neq) or (neq) Tensor.
+        mask: Optional (nBatch) bool Tensor, only these rows are solved.
+
+        Returns: \hat z: a (nBatch, nz) Tensor.
+        """
+        A = self._A[0] if self._A.nelement() > 0 else self._A
+        nBatch = extract_nBatch(self._Q[0], p, self._G[0], h, A, b)
+        p, _ = expandParam(p, nBatch, 2)
+        h, _ = expandParam(h, nBatch, 2)
+        b, _ = expandParam(b, nBatch, 2)
+
+        # Q_LU stays a single shared factor, see pdipm_b.q_solve
+        Q, G = [X.expand(nBatch, -1, -1) for X in (self._Q, self._G)]
+        A = self._A.expand(nBatch, -1, -1) if self._A.nelement() > 0 else self._A
+        R, S_LU = None, None
+        if self._S_LU is not None:
+            R = self._R.expand(nBatch, -1, -1)
+            # factor_kkt completes S_LU in place, so every call gets its own copy
+            S_LU = [self._S_LU[0].repeat(nBatch, 1, 1),
+                    self._S_LU[1].repeat(nBatch, 1)]
+
+        zhats, _, _, _ = pdipm_b.forward(
+            Q, p, G, h, A, b, self._Q_LU, S_LU, R, self.eps, self.verbose,
+            self.notImprovedLim, self.maxIter, self.solver,
+            n_iters=n_iters, mask=mask)
+        return zhats
@@ -1,3 +1,3 @@
 __all__ = ['cvxpy', 'pdipm']
 
-from . import cvxpy
+# cvxpy is imported by qp.py only when QPSolvers.CVXPY is used
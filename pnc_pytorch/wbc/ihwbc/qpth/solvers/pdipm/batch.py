@@ -51,12 +51,29 @@ class KKTSolvers(Enum):
     LU_FULL = 1
     LU_PARTIAL = 2
     IR_UNOPT = 3
+    CHOL_NORMAL = 4
 
 
 def forward(Q, p, G, h, A, b, Q_LU, S_LU, R, eps=1e-12, verbose=0, notImprovedLim=3,
-            maxIter=20, solver=KKTSolvers.LU_PARTIAL):
+            maxIter=20, solver=KKTSolvers.LU_PARTIAL, n_iters=None, mask=None):
     """
     Q_LU, S_LU, R = pre_factor_kkt(Q, G, A)
+
+    Every batch member stops iterating as soon as it converges (best
+    residual below eps). The solve returns once all of them have, or, as
+    before, once no batch member has improved for notImprovedLim iterations.
+
+    n_iters (torch.tensor([nBatch], dtype=torch.long)):
+        Optional output, filled with the interior point iterations spent on
+        every batch member
+    mask (torch.tensor([nBatch], dtype=torch.bool)):
+        Optional, only these batch members are iterated. The others are
+        dropped after the first iteration like converged ones and return
+        their initial point.
+
+    solver=KKTSolvers.CHOL_NORMAL factors Q + G^T D G instead of the Schur
+    complement, for problems without equalities and with few variables
+    (nz << nineq). Q_LU, S_LU and R are not used and can be None.
     """
     nineq, nz, neq, nBatch = get_sizes(G, A)
 
@@ -75,11 +92,16 @@ def forward(Q, p, G, h, A, b, Q_LU, S_LU, R, eps=1e-12, verbose=0, notImprovedLi
         #print("hey 2 ","S_LU" , S_LU)
         #print("hey 3", p, torch.zeros(nBatch, nineq).type_as(Q))
         #print("hey4", -h)
-        
+    
         x, s, z, y = solve_kkt(
             Q_LU, d, G, A, S_LU,
             p, torch.zeros(nBatch, nineq).type_as(Q),
             -h, -b if neq > 0 else None)
+    elif solver == KKTSolvers.CHOL_NORMAL:
+        d = torch.ones(nBatch, nineq).type_as(Q)
+        M_L = factor_kkt_normal(Q, G, d)
+        x, s, z, y = solve_kkt_normal(
+            M_L, d, G, p, torch.zeros(nBatch, nineq).type_as(Q), -h)
     elif solver == KKTSolvers.IR_UNOPT:
         D = torch.eye(nineq).repeat(nBatch, 1, 1).type_as(Q)
         x, s, z, y = solve_kkt_ir(
@@ -104,104 +126,142 @@ def forward(Q, p, G, h, A, b, Q_LU, S_LU, R, eps=1e-12, verbose=0, notImprovedLi
 
     best = {'resids': None, 'x': None, 'z': None, 's': None, 'y': None}
     nNotImproved = 0
+    iters = torch.zeros(nBatch, dtype=torch.long)
+
+    # Batch members still iterating. Converged ones are dropped from every
+    # factorization and solve below, and written back once they are done.
+    active = torch.arange(nBatch)
+    Q_a, p_a, G_a, h_a, A_a, b_a = Q, p, G, h, A, b
+    Q_LU_a, S_LU_a, R_a = Q_LU, S_LU, R
 
     for i in range(maxIter):
         # affine scaling direction
-        rx = (torch.bmm(y.unsqueeze(1), A).squeeze(1) if neq > 0 else 0.) + \
-            torch.bmm(z.unsqueeze(1), G).squeeze(1) + \
-            torch.bmm(x.unsqueeze(1), Q.transpose(1, 2)).squeeze(1) + \
-            p
+        rx = (torch.bmm(y.unsqueeze(1), A_a).squeeze(1) if neq > 0 else 0.) + \
+            torch.bmm(z.unsqueeze(1), G_a).squeeze(1) + \
+            torch.bmm(x.unsqueeze(1), Q_a.transpose(1, 2)).squeeze(1) + \
+            p_a
         rs = z
-        rz = torch.bmm(x.unsqueeze(1), G.transpose(1, 2)).squeeze(1) + s - h
-        ry = torch.bmm(x.unsqueeze(1), A.transpose(
-            1, 2)).squeeze(1) - b if neq > 0 else 0.0
-        mu = torch.abs((s * z).sum(1).squeeze() / nineq)
-        z_resid = torch.norm(rz, 2, 1).squeeze()
-        y_resid = torch.norm(ry, 2, 1).squeeze() if neq > 0 else 0
+        rz = torch.bmm(x.unsqueeze(1), G_a.transpose(1, 2)).squeeze(1) + s - h_a
+        ry = torch.bmm(x.unsqueeze(1), A_a.transpose(
+            1, 2)).squeeze(1) - b_a if neq > 0 else 0.0
+        mu = torch.abs((s * z).sum(1) / nineq)
+        z_resid = torch.norm(rz, 2, 1)
+        y_resid = torch.norm(ry, 2, 1) if neq > 0 else 0
         pri_resid = y_resid + z_resid
-        dual_resid = torch.norm(rx, 2, 1).squeeze()
+        dual_resid = torch.norm(rx, 2, 1)
         resids = pri_resid + dual_resid + nineq * mu
         #CARLOS print("rx", rx)
         
         #CARLOS print(y_resid, z_resid)
         d = z / s
         try:
-            factor_kkt(S_LU, R, d)
+            if solver == KKTSolvers.CHOL_NORMAL:
+                M_L = factor_kkt_normal(Q_a, G_a, d)
+            else:
+                factor_kkt(S_LU_a, R_a, d)
         except:
-            return best['x'], best['y'], best['z'], best['s']
+            break
+        iters[active] += 1
 
         if verbose == 1:
             #CARLOS
-            print('iter: {}, pri_resid: {:.5e}, dual_resid: {:.5e}, mu: {:.5e}'.format(
-                i, pri_resid.mean(), dual_resid.mean(), mu.mean()))
+            print('iter: {}, active: {}, pri_resid: {:.5e}, dual_resid: {:.5e}, mu: {:.5e}'.format(
+                i, active.numel(), pri_resid.mean(), dual_resid.mean(), mu.mean()))
         if best['resids'] is None:
             best['resids'] = resids
             best['x'] = x.clone()
             best['z'] = z.clone()
             best['s'] = s.clone()
             best['y'] = y.clone() if y is not None else None
-            nNotImproved = 0
         else:
-            I = resids < best['resids']
-            if I.sum() > 0:
+            I = resids < best['resids'][active]
+            if I.any():
                 nNotImproved = 0
             else:
                 nNotImproved += 1
-            I_nz = I.repeat(nz, 1).t()
-            I_nineq = I.repeat(nineq, 1).t()
-            best['resids'][I] = resids[I]
-            best['x'][I_nz] = x[I_nz]
-            best['z'][I_nineq] = z[I_nineq]
-            best['s'][I_nineq] = s[I_nineq]
+            I_idx = active[I]
+            best['resids'][I_idx] = resids[I]
+            best['x'][I_idx] = x[I]
+            best['z'][I_idx] = z[I]
+            best['s'][I_idx] = s[I]
+            if neq > 0:
+                best['y'][I_idx] = y[I]
+
+        if nNotImproved == notImprovedLim or mu.min() > 1e32:
+            break
+        done = best['resids'][active] < eps
+        if i == 0 and mask is not None:
+            done |= ~mask
+        if done.all():
+            break
+        if done.any():
+            keep = ~done
+            if S_LU_a is not S_LU:
+                S_LU[0][active], S_LU[1][active] = S_LU_a
+            active = active[keep]
+            Q_a, p_a, G_a, h_a = Q_a[keep], p_a[keep], G_a[keep], h_a[keep]
             if neq > 0:
-                I_neq = I.repeat(neq, 1).t()
-                best['y'][I_neq] = y[I_neq]
-        if nNotImproved == notImprovedLim or best['resids'].max() < eps or mu.min() > 1e32:
-            if best['resids'].max() > 1. and verbose >= 0:
-                print(INACC_ERR)
-            return best['x'], best['y'], best['z'], best['s']
+                A_a, b_a, y = A_a[keep], b_a[keep], y[keep]
+            Q_LU_a = select_lu(Q_LU_a, keep)
+            if solver == KKTSolvers.CHOL_NORMAL:
+                M_L = M_L[keep]
+            else:
+                S_LU_a = [S_LU_a[0][keep], S_LU_a[1][keep]]
+            R_a = R_a[keep] if R_a is not None else None
+            d = d[keep]
+            x, s, z = x[keep], s[keep], z[keep]
+            rx, rs, rz = rx[keep], rs[keep], rz[keep]
+            ry = ry[keep] if neq > 0 else 0.0
+            mu = mu[keep]
+        nActive = active.numel()
 
         if solver == KKTSolvers.LU_FULL:
             D = bdiag(d)
             dx_aff, ds_aff, dz_aff, dy_aff = factor_solve_kkt(
-                Q, D, G, A, rx, rs, rz, ry)
+                Q_a, D, G_a, A_a, rx, rs, rz, ry)
         elif solver == KKTSolvers.LU_PARTIAL:
             dx_aff, ds_aff, dz_aff, dy_aff = solve_kkt(
-                Q_LU, d, G, A, S_LU, rx, rs, rz, ry)
+                Q_LU_a, d, G_a, A_a, S_LU_a, rx, rs, rz, ry)
+        elif solver == KKTSolvers.CHOL_NORMAL:
+            dx_aff, ds_aff, dz_aff, dy_aff = solve_kkt_normal(
+                M_L, d, G_a, rx, rs, rz)
         elif solver == KKTSolvers.IR_UNOPT:
             D = bdiag(d)
             dx_aff, ds_aff, dz_aff, dy_aff = solve_kkt_ir(
-                Q, D, G, A, rx, rs, rz, ry)
+                Q_a, D, G_a, A_a, rx, rs, rz, ry)
         else:
             assert False
 
         # compute centering directions
         alpha = torch.min(torch.min(get_step(z, dz_aff),
                                     get_step(s, ds_aff)),
-                          torch.ones(nBatch).type_as(Q))
+                          torch.ones(nActive).type_as(Q))
         alpha_nineq = alpha.repeat(nineq, 1).t()
         t1 = s + alpha_nineq * ds_aff
         t2 = z + alpha_nineq * dz_aff
-        t3 = torch.sum(t1 * t2, 1).squeeze()
-        t4 = torch.sum(s * z, 1).squeeze()
+        t3 = torch.sum(t1 * t2, 1)
+        t4 = torch.sum(s * z, 1)
         sig = (t3 / t4)**3
 
-        rx = torch.zeros(nBatch, nz).type_as(Q)
+        rx = torch.zeros(nActive, nz).type_as(Q)
         rs = ((-mu * sig).repeat(nineq, 1).t() + ds_aff * dz_aff) / s
-        rz = torch.zeros(nBatch, nineq).type_as(Q)
-        ry = torch.zeros(nBatch, neq).type_as(Q) if neq > 0 else torch.Tensor()
+        rz = torch.zeros(nActive, nineq).type_as(Q)
+        ry = torch.zeros(nActive, neq).type_as(Q) if neq > 0 else torch.Tensor()
 
         if solver == KKTSolvers.LU_FULL:
             D = bdiag(d)
             dx_cor, ds_cor, dz_cor, dy_cor = factor_solve_kkt(
-                Q, D, G, A, rx, rs, rz, ry)
+                Q_a, D, G_a, A_a, rx, rs, rz, ry)
         elif solver == KKTSolvers.LU_PARTIAL:
             dx_cor, ds_cor, dz_cor, dy_cor = solve_kkt(
-                Q_LU, d, G, A, S_LU, rx, rs, rz, ry)
+                Q_LU_a, d, G_a, A_a, S_LU_a, rx, rs, rz, ry)
+        elif solver == KKTSolvers.CHOL_NORMAL:
+            dx_cor, ds_cor, dz_cor, dy_cor = solve_kkt_normal(
+                M_L, d, G_a, rx, rs, rz)
         elif solver == KKTSolvers.IR_UNOPT:
             D = bdiag(d)
             dx_cor, ds_cor, dz_cor, dy_cor = solve_kkt_ir(
-                Q, D, G, A, rx, rs, rz, ry)
+                Q_a, D, G_a, A_a, rx, rs, rz, ry)
         else:
             assert False
 
@@ -211,7 +271,7 @@ def forward(Q, p, G, h, A, b, Q_LU, S_LU, R, eps=1e-12, verbose=0, notImprovedLi
         dy = dy_aff + dy_cor if neq > 0 else None
         alpha = torch.min(0.999 * torch.min(get_step(z, dz),
                                             get_step(s, ds)),
-                          torch.ones(nBatch).type_as(Q))
+                          torch.ones(nActive).type_as(Q))
         alpha_nineq = alpha.repeat(nineq, 1).t()
         alpha_neq = alpha.repeat(neq, 1).t() if neq > 0 else None
         alpha_nz = alpha.repeat(nz, 1).t()
@@ -221,7 +281,14 @@ def forward(Q, p, G, h, A, b, Q_LU, S_LU, R, eps=1e-12, verbose=0, notImprovedLi
         z += alpha_nineq * dz
         y = y + alpha_neq * dy if neq > 0 else None
 
-    if best['resids'].max() > 1. and verbose >= 0:
+    if S_LU_a is not S_LU:
+        S_LU[0][active], S_LU[1][active] = S_LU_a
+    if n_iters is not None:
+        n_iters.copy_(iters)
+    if best['resids'] is None:
+        return best['x'], best['y'], best['z'], best['s']
+    resids = best['resids'] if mask is None else best['resids'][mask]
+    if resids.numel() > 0 and resids.max() > 1. and verbose >= 0:
         print(INACC_ERR)
     return best['x'], best['y'], best['z'], best['s']
 
@@ -382,12 +449,30 @@ def factor_solve_kkt(Q, D, G, A, rx, rs, rz, ry):
     return dx, ds, dz, dy
 
 
+def q_solve(Q_LU, r):
+    """
+    Solve Q x = r for a (nBatch, nz) right-hand side. A Q_LU with a single
+    batch member is shared, and the batch is solved as one multi-column
+    system instead of nBatch broadcast solves.
+    """
+    if Q_LU[0].size(0) == 1 and r.size(0) > 1:
+        return torch.linalg.lu_solve(*Q_LU, r.t().unsqueeze(0)).squeeze(0).t()
+    return torch.linalg.lu_solve(*Q_LU, r.unsqueeze(2)).squeeze(2)
+
+
+def select_lu(LU, mask):
+    """ Index a batched LU factor, leaving a shared (size 1) factor as is"""
+    if LU is None or LU[0].size(0) == 1:
+        return LU
+    return (LU[0][mask], LU[1][mask])
+
+
 def solve_kkt(Q_LU, d, G, A, S_LU, rx, rs, rz, ry):
     """ Solve KKT equations for the affine step"""
     nineq, nz, neq, nBatch = get_sizes(G, A)
 
     #invQ_rx = rx.unsqueeze(2).lu_solve(*Q_LU).squeeze(2)
-    invQ_rx = torch.linalg.lu_solve(*Q_LU, rx.unsqueeze(2)).squeeze(2)
+    invQ_rx = q_solve(Q_LU, rx)
     if neq > 0:
         h = torch.cat((invQ_rx.unsqueeze(1).bmm(A.transpose(1, 2)).squeeze(1) - ry,
                        invQ_rx.unsqueeze(1).bmm(G.transpose(1, 2)).squeeze(1) + rs / d - rz), 1)
@@ -403,7 +488,7 @@ def solve_kkt(Q_LU, d, G, A, S_LU, rx, rs, rz, ry):
     g2 = -rs - w[:, neq:]
 
     #dx = g1.unsqueeze(2).lu_solve(*Q_LU).squeeze(2)
-    dx = torch.linalg.lu_solve(*Q_LU, g1.unsqueeze(2)).squeeze(2)
+    dx = q_solve(Q_LU, g1)
     ds = g2 / d
     dz = w[:, neq:]
     dy = w[:, :neq] if neq > 0 else None
@@ -411,14 +496,59 @@ def solve_kkt(Q_LU, d, G, A, S_LU, rx, rs, rz, ry):
     return dx, ds, dz, dy
 
 
-def pre_factor_kkt(Q, G, A):
-    """ Perform all one-time factorizations and cache relevant matrix products"""
+def factor_kkt_normal(Q, G, d):
+    """ Cholesky factor of the normal equations matrix Q + G^T D G"""
+    M = Q + G.transpose(1, 2).bmm(d.unsqueeze(2) * G)
+    M_L, info = torch.linalg.cholesky_ex(M)
+    if info.any():
+        raise RuntimeError('normal equations are not SPD')
+    return M_L
+
+
+def solve_kkt_normal(M_L, d, G, rx, rs, rz):
+    """ Solve KKT equations without equalities from the normal equations"""
+    r = -rx + (rs - d * rz).unsqueeze(1).bmm(G).squeeze(1)
+    dx = torch.cholesky_solve(r.unsqueeze(2), M_L).squeeze(2)
+    ds = -rz - dx.unsqueeze(1).bmm(G.transpose(1, 2)).squeeze(1)
+    dz = -rs - d * ds
+
+    return dx, ds, dz, None
+
+
+def spd_factor(Q):
+    """
+    Batched SPD check of Q with a single Cholesky factorization
+
+    Returns the factor Q = L L^T repacked as an unpivoted LU factorization
+    (unit lower L D^{-1}, upper D L^T with D = diag(L)), so it can stand in
+    for lu_hack(Q) in pre_factor_kkt and torch.linalg.lu_solve.
+    """
+    L, info = torch.linalg.cholesky_ex(Q)
+    if (info != 0).any():
+        raise RuntimeError('Q is not SPD for batch members {}.'.format(
+            torch.nonzero(info).flatten().tolist()))
+    diag = torch.diagonal(L, dim1=-2, dim2=-1)
+    data = torch.tril(L / diag.unsqueeze(-2), -1) + \
+        diag.unsqueeze(-1) * L.transpose(-2, -1)
+    pivots = torch.arange(1, 1 + Q.size(-1), dtype=torch.int32).expand(
+        *Q.shape[:-1]).contiguous()
+    return data, pivots
+
+
+def pre_factor_kkt(Q, G, A, Q_LU=None):
+    """ Perform all one-time factorizations and cache relevant matrix products
+
+    Q_LU (tuple):
+        Optional factorization of Q in torch.linalg.lu_factor format, e.g.
+        from spd_factor, used instead of factorizing Q again
+    """
     nineq, nz, neq, nBatch = get_sizes(G, A)
 
-    try:
-        Q_LU = lu_hack(Q)
-    except:
-        raise RuntimeError("""
+    if Q_LU is None:
+        try:
+            Q_LU = lu_hack(Q)
+        except:
+            raise RuntimeError("""
 qpth Error: Cannot perform LU factorization on Q.
 Please make sure that your Q matrix is PSD and has
 a non-zero diagonal.
@@ -117,7 +117,7 @@ class ALIPtrajectoryManager(object):
                                                                                             self._robot.get_link_iso(self._rfoot_task.target_id)[ids])
         swfoot_rot = torch.where(self._stance_leg[ids].unsqueeze(1).unsqueeze(1) == 1, self._robot.get_link_iso(self._lfoot_task.target_id)[ids, 0:3, 0:3],
                                                                                        self._robot.get_link_iso(self._rfoot_task.target_id)[ids, 0:3, 0:3])
-        curr_swfoot_pos = curr_swfoot_iso[ids, 0:3, 3]
+        curr_swfoot_pos = curr_swfoot_iso[:, 0:3, 3]
 
         self.AlipSwing2_curve.setParams(ids, curr_swfoot_pos, swfoot_end, self.swing_height[ids], tr_)
         
@@ -179,12 +179,12 @@ class ALIPtrajectoryManager(object):
 
         rfoot_quat = orbit_util.convert_quat(orbit_util.quat_from_matrix(self._robot.get_link_iso(self.rfoot_id)[ids, 0:3, 0:3]))
         lfoot_quat = orbit_util.convert_quat(orbit_util.quat_from_matrix(self._robot.get_link_iso(self.lfoot_id)[ids, 0:3, 0:3]))
-        des_rfoot_quat = torch.where(self._stance_leg[ids].unsqueeze(1) == 1, rfoot_quat, des_swfoot_quat[ids])
-        des_rfoot_ang_vel = torch.where(self._stance_leg[ids].unsqueeze(1) == 1, torch.zeros(self._n_batch, 3, dtype = torch.double), des_swfoot_quat_v[ids])
-        des_rfoot_ang_acc = torch.where(self._stance_leg[ids].unsqueeze(1) == 1, torch.zeros(self._n_batch, 3, dtype = torch.double), des_swfoot_quat_a[ids])
-        des_lfoot_quat = torch.where(self._stance_leg[ids].unsqueeze(1) == 1, des_swfoot_quat[ids], lfoot_quat)
-        des_lfoot_ang_vel = torch.where(self._stance_leg[ids].unsqueeze(1) == 1, des_swfoot_quat_v[ids], torch.zeros(self._n_batch, 3, dtype = torch.double))
-        des_lfoot_ang_acc = torch.where(self._stance_leg[ids].unsqueeze(1) == 1, des_swfoot_quat_a[ids], torch.zeros(self._n_batch, 3, dtype = torch.double))
+        des_rfoot_quat = torch.where(self._stance_leg[ids].unsqueeze(1) == 1, rfoot_quat, des_swfoot_quat)
+        des_rfoot_ang_vel = torch.where(self._stance_leg[ids].unsqueeze(1) == 1, torch.zeros(len(ids), 3, dtype = torch.double), des_swfoot_quat_v)
+        des_rfoot_ang_acc = torch.where(self._stance_leg[ids].unsqueeze(1) == 1, torch.zeros(len(ids), 3, dtype = torch.double), des_swfoot_quat_a)
+        des_lfoot_quat = torch.where(self._stance_leg[ids].unsqueeze(1) == 1, des_swfoot_quat, lfoot_quat)
+        des_lfoot_ang_vel = torch.where(self._stance_leg[ids].unsqueeze(1) == 1, des_swfoot_quat_v, torch.zeros(len(ids), 3, dtype = torch.double))
+        des_lfoot_ang_acc = torch.where(self._stance_leg[ids].unsqueeze(1) == 1, des_swfoot_quat_a, torch.zeros(len(ids), 3, dtype = torch.double))
 
         self._rfoot_ori_task.update_desired(des_rfoot_quat, des_rfoot_ang_vel, des_rfoot_ang_acc, ids)
         self._lfoot_ori_task.update_desired(des_lfoot_quat, des_lfoot_ang_vel, des_lfoot_ang_acc, ids)
@@ -193,16 +193,16 @@ class ALIPtrajectoryManager(object):
         # UPDATE THE POSITION TASKS #
         #############################
         rfootpos = self._robot.get_link_iso(self.rfoot_id)[ids, 0:3, 3]
-        rfootpos[ids,2] = torch.zeros(len(ids), dtype = torch.double)
+        rfootpos[:,2] = torch.zeros(len(ids), dtype = torch.double)
         lfootpos = self._robot.get_link_iso(self.lfoot_id)[ids, 0:3, 3]
         lfootpos[:,2] = torch.zeros(len(ids), dtype = torch.double)
 
-        des_rfoot_pos = torch.where(self._stance_leg[ids].unsqueeze(1) == 1, rfootpos, self.des_sw_foot_pos[ids])
-        des_rfoot_vel = torch.where(self._stance_leg[ids].unsqueeze(1) == 1, torch.zeros(self._n_batch, 3, dtype = torch.double), self.des_sw_foot_vel[ids])
-        des_rfoot_acc = torch.where(self._stance_leg[ids].unsqueeze(1) == 1, torch.zeros(self._n_batch, 3, dtype = torch.double), self.des_sw_foot_acc[ids])
-        des_lfoot_pos = torch.where(self._stance_leg[ids].unsqueeze(1) == 1, self.des_sw_foot_pos[ids], lfootpos)
-        des_lfoot_vel = torch.where(self._stance_leg[ids].unsqueeze(1) == 1, self.des_sw_foot_vel[ids], torch.zeros(self._n_batch, 3, dtype = torch.double))
-        des_lfoot_acc = torch.where(self._stance_leg[ids].unsqueeze(1) == 1, self.des_sw_foot_acc[ids], torch.zeros(self._n_batch, 3, dtype = torch.double))
+        des_rfoot_pos = torch.where(self._stance_leg[ids].unsqueeze(1) == 1, rfootpos, self.des_sw_foot_pos)
+        des_rfoot_vel = torch.where(self._stance_leg[ids].unsqueeze(1) == 1, torch.zeros(len(ids), 3, dtype = torch.double), self.des_sw_foot_vel)
+        des_rfoot_acc = torch.where(self._stance_leg[ids].unsqueeze(1) == 1, torch.zeros(len(ids), 3, dtype = torch.double), self.des_sw_foot_acc)
+        des_lfoot_pos = torch.where(self._stance_leg[ids].unsqueeze(1) == 1, self.des_sw_foot_pos, lfootpos)
+        des_lfoot_vel = torch.where(self._stance_leg[ids].unsqueeze(1) == 1, self.des_sw_foot_vel, torch.zeros(len(ids), 3, dtype = torch.double))
+        des_lfoot_acc = torch.where(self._stance_leg[ids].unsqueeze(1) == 1, self.des_sw_foot_acc, torch.zeros(len(ids), 3, dtype = torch.double))
 
         self._rfoot_task.update_desired(des_rfoot_pos, des_rfoot_vel, des_rfoot_acc, ids)
         self._lfoot_task.update_desired(des_lfoot_pos, des_lfoot_vel, des_lfoot_acc, ids)
@@ -17,8 +17,11 @@ class UpperBodyTrajectoryManager(object):
         nominal_joint_pos (OrderedDict):
             Nominal joint positions
         """
-        joint_pos_des = torch.tensor(
-            [nominal_joint_pos[k] for k in self._upper_body_task.target_id])
+        # floats, or arrays of size n_batch when every environment has its own;
+        # the dtype is fixed so that both give the same targets
+        joint_pos_des = torch.stack([
+            torch.as_tensor(nominal_joint_pos[k], dtype=torch.get_default_dtype())
+            for k in self._upper_body_task.target_id]).t()
         """
         Apaño change when new
         """
@@ -17,6 +17,7 @@ np.set_printoptions(precision=2)
 from config.atlas_config import SimConfig
 from pnc.atlas_pnc.atlas_interface import AtlasInterface
 from util import pybullet_util
+from simulator.pybullet.sim_runner import SimRunner
 from util import util
 from util import liegroup
 from vision.height_map import HeightMap
@@ -50,8 +51,9 @@ def set_initial_config(robot, joint_id):
 
 
 def signal_handler(signal, frame):
-    if SimConfig.VIDEO_RECORD:
+    if b_video_record:
         pybullet_util.make_video(video_dir)
+    runner.report()
     p.disconnect()
     sys.exit(0)
 
@@ -61,7 +63,9 @@ signal.signal(signal.SIGINT, signal_handler)
 if __name__ == "__main__":
 
     # Environment Setup
-    p.connect(p.GUI)
+    runner = SimRunner(SimConfig.CONTROLLER_DT, b_sleep=False)
+    b_video_record = runner.b_video_record(SimConfig.VIDEO_RECORD)
+    runner.connect()
     p.resetDebugVisualizerCamera(cameraDistance=1.5,
                                  cameraYaw=120,
                                  cameraPitch=-30,
@@ -69,7 +73,7 @@ if __name__ == "__main__":
     p.setGravity(0, 0, -9.8)
     p.setPhysicsEngineParameter(fixedTimeStep=SimConfig.CONTROLLER_DT,
                                 numSubSteps=SimConfig.N_SUBSTEP)
-    if SimConfig.VIDEO_RECORD:
+    if b_video_record:
         video_dir = 'video/atlas_pnc'
 
         if os.path.exists(video_dir):
@@ -169,7 +173,7 @@ if __name__ == "__main__":
             __import__('ipdb').set_trace()
 
         # Get Keyboard Event
-        keys = p.getKeyboardEvents()
+        keys = runner.get_keyboard_events()
         if pybullet_util.is_key_triggered(keys, '8'):
             interface.interrupt_logic.b_interrupt_button_eight = True
         elif pybullet_util.is_key_triggered(keys, '5'):
@@ -198,7 +202,7 @@ if __name__ == "__main__":
         pybullet_util.set_motor_trq(robot, joint_id, command['joint_trq'])
 
         # Save Image
-        if (SimConfig.VIDEO_RECORD) and (count % SimConfig.RECORD_FREQ == 0):
+        if (b_video_record) and (count % SimConfig.RECORD_FREQ == 0):
             frame = pybullet_util.get_camera_image([1.2, 0.5, 1.], 2.0, 120,
                                                    -15, 0, 60., 1920, 1080,
                                                    0.1, 100.)
@@ -208,6 +212,10 @@ if __name__ == "__main__":
 
         p.stepSimulation()
 
-        # time.sleep(dt)
         t += dt
         count += 1
+        if not runner.step():
+            break
+
+    runner.report()
+    p.disconnect()
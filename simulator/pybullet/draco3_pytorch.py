@@ -5,7 +5,6 @@ cwd = os.getcwd()
 sys.path.append(cwd)
 import time, math
 from collections import OrderedDict
-import copy
 import signal
 import shutil
 
@@ -19,6 +18,7 @@ np.set_printoptions(precision=2)
 from config.draco3_alip_config import SimConfig
 from pnc_pytorch.draco3_pnc.draco3_interface import Draco3Interface
 from util import pybullet_util
+from simulator.pybullet.sim_runner import SimRunner
 from util import util
 from util import liegroup
 from config.draco3_alip_config import AlipParams
@@ -142,8 +142,9 @@ def compute_policy_input(sensor_data, wbc_obs):
 
 
 def signal_handler(signal, frame):
-    if SimConfig.VIDEO_RECORD:
+    if b_video_record:
         pybullet_util.make_video(video_dir, False)
+    runner.report()
     p.disconnect()
     sys.exit(0)
 
@@ -152,7 +153,9 @@ signal.signal(signal.SIGINT, signal_handler)
 
 if __name__ == "__main__":
     # Environment Setup
-    p.connect(p.GUI)
+    runner = SimRunner(SimConfig.CONTROLLER_DT)
+    b_video_record = runner.b_video_record(SimConfig.VIDEO_RECORD)
+    runner.connect()
     p.resetDebugVisualizerCamera(
         cameraDistance=1.0,
         cameraYaw=120,
@@ -161,7 +164,7 @@ if __name__ == "__main__":
     p.setGravity(0, 0, -9.8)
     p.setPhysicsEngineParameter(
         fixedTimeStep=SimConfig.CONTROLLER_DT, numSubSteps=SimConfig.N_SUBSTEP)
-    if SimConfig.VIDEO_RECORD:
+    if b_video_record:
         video_dir = 'video/draco3_pnc'
         if os.path.exists(video_dir):
             shutil.rmtree(video_dir)
@@ -218,6 +221,7 @@ if __name__ == "__main__":
 
     # Construct Interface
     interface = Draco3Interface()
+    trq_commander = None
 
     # Run Sim
     t = 0
@@ -259,7 +263,7 @@ if __name__ == "__main__":
         sensor_data['b_lf_contact'] = True if lf_height <= 0.01 else False
 
         # Get Keyboard Event
-        keys = p.getKeyboardEvents()
+        keys = runner.get_keyboard_events()
         if pybullet_util.is_key_triggered(keys, '8'):
             interface.interrupt_logic.b_interrupt_button_eight = True
         elif pybullet_util.is_key_triggered(keys, '5'):
@@ -299,7 +303,7 @@ if __name__ == "__main__":
 
         input_command = (sensor_data, rl_action)
 
-        alip_command = interface.get_command(copy.deepcopy(input_command))
+        alip_command = interface.get_command(input_command)
 
         command = alip_command[0]
 
@@ -329,15 +333,17 @@ if __name__ == "__main__":
         del command['joint_vel']['l_knee_fe_jd']
         del command['joint_vel']['r_knee_fe_jd']
         """
-        del command['joint_trq']['l_knee_fe_jd']
-        del command['joint_trq']['r_knee_fe_jd']
+        if trq_commander is None:
+            trq_commander = pybullet_util.MotorCommander(
+                robot, joint_id, command.joint_names,
+                ['l_knee_fe_jd', 'r_knee_fe_jd'])
 
         # Apply Command
-        pybullet_util.set_motor_trq(robot, joint_id, command['joint_trq'])
+        trq_commander.set_trq(command.joint_trq)
         pybullet_util.set_motor_pos(robot, joint_id, gripper_command)
         #TODO change 
         # Save Image
-        if (SimConfig.VIDEO_RECORD) and (count % SimConfig.RECORD_FREQ == 0):
+        if (b_video_record) and (count % SimConfig.RECORD_FREQ == 0):
             frame = pybullet_util.get_camera_image(
                 [1., 0.5, 1.], 1.0, 120, -15, 0, 60., 1920, 1080, 0.1, 100.)
             frame = frame[:, :, [2, 1, 0]]  # << RGB to BGR
@@ -347,6 +353,10 @@ if __name__ == "__main__":
 
         p.stepSimulation()
 
-        time.sleep(dt)
         t += dt
         count += 1
+        if not runner.step():
+            break
+
+    runner.report()
+    p.disconnect()
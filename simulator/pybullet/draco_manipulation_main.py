@@ -18,6 +18,7 @@ np.set_printoptions(precision=2)
 from config.draco_manipulation_config import SimConfig
 from pnc.draco_manipulation_pnc.draco_manipulation_interface import DracoManipulationInterface
 from util import pybullet_util
+from simulator.pybullet.sim_runner import SimRunner
 from util import util
 from util import liegroup
 from pinocchio.visualize import MeshcatVisualizer
@@ -193,8 +194,9 @@ def set_initial_config(robot, joint_id):
 
 
 def signal_handler(signal, frame):
-    if SimConfig.VIDEO_RECORD:
+    if b_video_record:
         pybullet_util.make_video(video_dir, False)
+    runner.report()
     p.disconnect()
     sys.exit(0)
 
@@ -203,8 +205,11 @@ signal.signal(signal.SIGINT, signal_handler)
 
 if __name__ == "__main__":
 
+    runner = SimRunner(SimConfig.CONTROLLER_DT, b_sleep=False)
+    b_video_record = runner.b_video_record(SimConfig.VIDEO_RECORD)
+
     # Environment Setup
-    if SimConfig.B_USE_MESHCAT:
+    if SimConfig.B_USE_MESHCAT or runner.b_headless:
         p.connect(p.DIRECT)
     else:
         p.connect(p.GUI)
@@ -216,7 +221,7 @@ if __name__ == "__main__":
     p.setGravity(0, 0, -9.8)
     p.setPhysicsEngineParameter(fixedTimeStep=SimConfig.CONTROLLER_DT,
                                 numSubSteps=SimConfig.N_SUBSTEP)
-    if SimConfig.VIDEO_RECORD:
+    if b_video_record:
         video_dir = 'video/draco3_pnc'
         if os.path.exists(video_dir):
             shutil.rmtree(video_dir)
@@ -376,7 +381,7 @@ if __name__ == "__main__":
         sensor_data['b_lf_contact'] = True if lf_height <= 0.01 else False
 
         # Get Keyboard Event
-        keys = p.getKeyboardEvents()
+        keys = runner.get_keyboard_events()
         if pybullet_util.is_key_triggered(keys, '8'):
             interface.interrupt_logic.b_interrupt_button_eight = True
         elif pybullet_util.is_key_triggered(keys, '5'):
@@ -512,7 +517,7 @@ if __name__ == "__main__":
         b_walk_ready = interface.interrupt_logic.b_walk_ready
 
         # Save Image
-        if (SimConfig.VIDEO_RECORD) and (count % SimConfig.RECORD_FREQ == 0):
+        if (b_video_record) and (count % SimConfig.RECORD_FREQ == 0):
             frame = pybullet_util.get_camera_image([1., 0.5, 1.], 1.0, 120,
                                                    -15, 0, 60., 1920, 1080,
                                                    0.1, 100.)
@@ -530,6 +535,10 @@ if __name__ == "__main__":
             viz.display(vis_q)
 
         p.stepSimulation()
-        # time.sleep(dt)
         t += dt
         count += 1
+        if not runner.step():
+            break
+
+    runner.report()
+    p.disconnect()
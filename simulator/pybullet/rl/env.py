@@ -13,11 +13,9 @@ cwd = os.getcwd()
 sys.path.append(cwd)
 import time, math
 from collections import OrderedDict
-import copy
 import signal
 import shutil
 
-import cv2
 
 from config.draco3_alip_config import SimConfig
 from config.draco3_alip_config import AlipParams
@@ -32,6 +30,20 @@ GRIPPER_JOINTS = [
     "right_ezgripper_knuckle_palm_L1_2", "right_ezgripper_knuckle_L1_L2_2"
 ]
 
+#knee distal joints follow the proximal ones through the gear constraint
+PASSIVE_JOINTS = ["l_knee_fe_jd", "r_knee_fe_jd"]
+
+#policy observation layout: base quantities, joint pos, joint vel (no gripper
+#joints), foot contacts, then the 12 wbc terms
+OBS_BASE_KEYS = OrderedDict([
+    ('base_com_pos', 3), ('base_com_quat', 4), ('base_com_lin_vel', 3), ('base_com_ang_vel', 3),
+    ('base_joint_pos', 3), ('base_joint_quat', 4), ('base_joint_lin_vel', 3), ('base_joint_ang_vel', 3)])
+N_OBS_WBC = 12
+
+#pybullet robot config of each (urdf, initial pose), shared by the envs of a
+#process so that only the first one queries the joint and link infos
+ROBOT_CONFIG_CACHE = dict()
+
 def set_initial_config(robot, joint_id, client):
     # Upperbody
     client.resetJointState(robot, joint_id["l_shoulder_aa"], np.pi / 6, 0.)
@@ -58,24 +70,99 @@ def set_initial_config(robot, joint_id, client):
     client.resetJointState(robot, joint_id["r_ankle_fe"], -np.pi / 4, 0.)
     client.resetJointState(robot, joint_id["r_ankle_ie"], np.radians(hip_yaw_angle),
                       0.)
+
+
+class DracoReward():
+    """
+    Reward and termination terms computed from the batched wbc observation,
+    shared by DracoEnv and DracoVecEnv
+    """
+    def _init_reward(self, n_batch):
+        self._w_roll_pitch = 0.05
+        self._w_com_height = 0.05
+
+        self._w_desired_Lxy = 0.05
+        self._w_desired_yaw = 0.05
+        self._w_excessive_fp = 0.05
+        self._w_excessive_angle = 0.05
+        self._w_termination = -4
+        self._w_alive_bonus = 0.5
+
+        self._Lx_main = 0.5*AlipParams.WIDTH*AlipParams.MASS*math.sqrt(AlipParams.G/AlipParams.ZH) \
+                        *AlipParams.ZH*math.tanh(math.sqrt(AlipParams.G/AlipParams.ZH)*AlipParams.TS/2)
+        
+        #initialise old_wbc_obs for reward
+        self._old_wbc_obs = torch.zeros(n_batch, 18)
+        self._new_wbc_obs = torch.zeros(n_batch, 18)
+
+    def _termination_mask(self, _wbc_obs):
+        #TODO: add more termination
+        condition = (_wbc_obs[:, 8] < 0.5) | (_wbc_obs[:, 8] > 0.8)  #0.69
+        return condition
+        #return False
+
+    def _compute_batch_reward(self, wbc_obs, action, done):
+        self._old_wbc_obs = self._new_wbc_obs
+        self._new_wbc_obs = wbc_obs
+        self._rl_action = action
+
+        reward = self._w_alive_bonus
+        reward += self.reward_tracking_com_L()
+        reward += self.reward_tracking_yaw()
+        reward += self.reward_com_height()
+        reward += self.reward_roll_pitch()
+        reward += self.penalise_excessive_fp()
+        reward += self.penalise_excessive_yaw()
+        reward -= self._w_termination*done
+
+        return reward
+
+    def reward_tracking_com_L(self):
+        Lx = torch.zeros(self._new_wbc_obs.shape[0], 2)
+        Lx[:, 0] = self._new_wbc_obs[:, 0]*self._Lx_main 
+        #in the code 1 corresponds to current stance foot right
+        # -1 to current stance foot left 
+        # new obs -1 --> ended policy for left foot --> we are at the desired state for end of right stance
+        error = Lx + self._old_wbc_obs[:, 1:3] - self._new_wbc_obs[:, 9:11]  #desired Lx,y - observedLx,y at the end of the step
+        error = torch.sum(torch.square(error), dim = 1)
+        error *= self._w_desired_Lxy
+        return torch.exp(-error)
     
-def dict_to_numpy(obs_dict):
-    obs = []
-    for k,v in obs_dict.items():
-        if isinstance(v,dict):
-            for k2,v2 in v.items():
-                obs.append(v2)
-        elif isinstance(v,np.ndarray) or isinstance(v,list) or isinstance(v,tuple):
-            for i in range(len(v)):
-                obs.append(v[i])
-        else:
-            obs.append(v)
-    return np.array(obs)
+    def reward_tracking_yaw(self):
+        error = self._new_wbc_obs[:, 16] - self._old_wbc_obs[:, 16] - self._old_wbc_obs[:, 3]
+        error = torch.square(error)
+        error *= self._w_desired_yaw
+
+        return torch.exp(-error)
+
+    def reward_com_height(self):
+        error = self._new_wbc_obs[:, 8] - AlipParams.ZH
+        error = torch.square(error)
+        error *= self._w_com_height
+        return torch.exp(-error)
+
+    def reward_roll_pitch(self):
+        error = torch.sum(torch.square(self._new_wbc_obs[:, 14:16]), dim = 1)
+        error *= self._w_roll_pitch 
+        return torch.exp(-error)
+    
+    def penalise_excessive_fp(self):
+        error = torch.sum(torch.square(self._rl_action[:, 0:2]), dim = 1)
+        error *= self._w_excessive_fp
+        return torch.exp(-error)
     
-class DracoEnv(gym.Env):
+    def penalise_excessive_yaw(self): 
+        error = torch.square(self._rl_action[:, 2])
+        error *= self._w_excessive_angle
+        return torch.exp(-error)
+
+
+class DracoEnv(gym.Env, DracoReward):
     metadata = {"render.modes": ["human", "rgb_array"], "video.frames_per_second": 50}
-    def __init__(self, render: bool = False) -> None:
+    def __init__(self, render: bool = False, real_time: bool = True) -> None:
         self.render = render
+        # rendered episodes sleep one control step per tick unless real_time is off
+        self.real_time = real_time
         if self.render:
             self.client = bc.BulletClient(connection_mode=p.GUI)
             self.client.configureDebugVisualizer(p.COV_ENABLE_GUI,0)
@@ -179,25 +266,53 @@ class DracoEnv(gym.Env):
             dtype = np.float64
         )
 
-        #reward terms
-        self._w_roll_pitch = 0.05
-        self._w_com_height = 0.05
+        self._init_reward(AlipParams.N_BATCH)
 
-        self._w_desired_Lxy = 0.05
-        self._w_desired_yaw = 0.05
-        self._w_excessive_fp = 0.05
-        self._w_excessive_angle = 0.05
-        self._w_termination = -4
-        self._w_alive_bonus = 0.5
+        #world snapshot taken after the first build, later resets restore it
+        self._init_state_id = None
+        self.interface = None
 
-        self._Lx_main = 0.5*AlipParams.WIDTH*AlipParams.MASS*math.sqrt(AlipParams.G/AlipParams.ZH) \
-                        *AlipParams.ZH*math.tanh(math.sqrt(AlipParams.G/AlipParams.ZH)*AlipParams.TS/2)
+    def reset(self, seed: int = 0):  #creates env
+        if SimConfig.VIDEO_RECORD:
+            video_dir = 'video/draco3_pnc'
+            if os.path.exists(video_dir):
+                shutil.rmtree(video_dir)
+            os.makedirs(video_dir)
+
+        obs_numpy = self._reset_world()
+
+        if self.interface is None:
+            self.interface = Draco3Interface()
+        else:
+            self.interface.reset()
+
+        info = {
+            "gripper_command" : self.gripper_command,
+            "interface" : self.interface,
+            }
         
-        #initialise old_wbc_obs for reward
-        self._old_wbc_obs = torch.zeros(AlipParams.N_BATCH, 18)
-        self._new_wbc_obs = torch.zeros(AlipParams.N_BATCH, 18)
+        return obs_numpy, info
 
-    def reset(self, seed: int = 0):  #creates env
+    def _reset_world(self):
+        if self._init_state_id is None:
+            self._build_world()
+            self._init_state_id = self.client.saveState()
+        else:
+            self.client.restoreState(stateId=self._init_state_id)
+
+        self.gripper_command = dict()
+        for gripper_joint in GRIPPER_JOINTS:
+            self.gripper_command[gripper_joint] = self.client.getJointState(
+                self.robot, self.joint_id[gripper_joint])[0]
+        self._gripper_pos = np.fromiter(self.gripper_command.values(), dtype=np.float64)
+
+        self.obs = self._get_observation()
+
+        self._policy_obs[0:self._n_obs_sensor] = self._obs_sensor
+        self._policy_obs[self._n_obs_sensor:] = 0.
+        return self._policy_obs
+
+    def _build_world(self):
         # Environment Setup
         self.client.resetSimulation()
         if (self.render):
@@ -209,23 +324,23 @@ class DracoEnv(gym.Env):
         self.client.setGravity(0, 0, -9.8)
         self.client.setPhysicsEngineParameter(
             fixedTimeStep=SimConfig.CONTROLLER_DT, numSubSteps=SimConfig.N_SUBSTEP)
-        if SimConfig.VIDEO_RECORD:
-            video_dir = 'video/draco3_pnc'
-            if os.path.exists(video_dir):
-                shutil.rmtree(video_dir)
-            os.makedirs(video_dir)
 
         # Create Robot, Ground
         self.client.configureDebugVisualizer(p.COV_ENABLE_RENDERING, 0)
-        self.robot = self.client.loadURDF(cwd + "/robot_model/draco3/draco3_gripper_mesh_updated.urdf",
+        urdf_file = cwd + "/robot_model/draco3/draco3_gripper_mesh_updated.urdf"
+        self.robot = self.client.loadURDF(urdf_file,
                         SimConfig.INITIAL_POS_WORLD_TO_BASEJOINT,
                         SimConfig.INITIAL_QUAT_WORLD_TO_BASEJOINT)
 
         self.client.loadURDF(cwd + "/robot_model/ground/plane.urdf", [0, 0, 0])
         self.client.configureDebugVisualizer(p.COV_ENABLE_RENDERING, 1)
-        nq, nv, na,self.joint_id,self.link_id, self.pos_basejoint_to_basecom, self.rot_basejoint_to_basecom = pybullet_util_rl.get_robot_config(
-            self.robot, SimConfig.INITIAL_POS_WORLD_TO_BASEJOINT,
-            SimConfig.INITIAL_QUAT_WORLD_TO_BASEJOINT, SimConfig.PRINT_ROBOT_INFO,  client = self.client)
+        config_key = (urdf_file, tuple(SimConfig.INITIAL_POS_WORLD_TO_BASEJOINT),
+                      tuple(SimConfig.INITIAL_QUAT_WORLD_TO_BASEJOINT))
+        if config_key not in ROBOT_CONFIG_CACHE:
+            ROBOT_CONFIG_CACHE[config_key] = pybullet_util_rl.get_robot_config(
+                self.robot, SimConfig.INITIAL_POS_WORLD_TO_BASEJOINT,
+                SimConfig.INITIAL_QUAT_WORLD_TO_BASEJOINT, SimConfig.PRINT_ROBOT_INFO,  client = self.client)
+        nq, nv, na,self.joint_id,self.link_id, self.pos_basejoint_to_basecom, self.rot_basejoint_to_basecom = ROBOT_CONFIG_CACHE[config_key]
 
         # Add Gear constraint
         c = self.client.createConstraint(
@@ -263,38 +378,29 @@ class DracoEnv(gym.Env):
         gripper_attached_joint_id["r_wrist_pitch"] = self.joint_id["r_wrist_pitch"]
         pybullet_util_rl.set_joint_friction(self.robot, gripper_attached_joint_id, 0.1, client=self.client)
 
-        nominal_sensor_data = pybullet_util_rl.get_sensor_data(
-        self.robot,self.joint_id,self.link_id, self.pos_basejoint_to_basecom,
-        self.rot_basejoint_to_basecom, client=self.client)
-
-        self.gripper_command = dict()
-        for gripper_joint in GRIPPER_JOINTS:
-            self.gripper_command[gripper_joint] = nominal_sensor_data['joint_pos'][
-                gripper_joint]
-            
-        self.obs = copy.deepcopy(nominal_sensor_data)
-
-        for gripper_joint in GRIPPER_JOINTS:
-            del self.obs['joint_pos'][gripper_joint]
-            del self.obs['joint_vel'][gripper_joint]
-
-        rf_height = pybullet_util_rl.get_link_iso(self.robot,
-                                              self.link_id['r_foot_contact'], client=self.client)[2, 3]
-        lf_height = pybullet_util_rl.get_link_iso(self.robot,
-                                              self.link_id['l_foot_contact'], client=self.client)[2, 3]
-        self.obs['b_rf_contact'] = True if rf_height <= 0.01 else False
-        self.obs['b_lf_contact'] = True if lf_height <= 0.01 else False
-
-        self.interface = Draco3Interface()
-
-        info = {
-            "gripper_command" : self.gripper_command,
-            "interface" : self.interface,
-            }
-        obs_numpy  = dict_to_numpy(self.obs)
-        obs_numpy = np.concatenate((obs_numpy, np.zeros(12)))
-        
-        return obs_numpy, info
+        # Observation buffers, the controller only gets the non gripper joints
+        self._obs_joint_id = OrderedDict(
+            (k, v) for k, v in self.joint_id.items() if k not in GRIPPER_JOINTS)
+        self._foot_link_id = [self.link_id['r_foot_contact'], self.link_id['l_foot_contact']]
+        n_joint = len(self._obs_joint_id)
+        n_base = sum(OBS_BASE_KEYS.values())
+        self._obs_joint_pos = slice(n_base, n_base + n_joint)
+        self._obs_joint_vel = slice(n_base + n_joint, n_base + 2*n_joint)
+        self._obs_contact = slice(n_base + 2*n_joint, n_base + 2*n_joint + 2)
+        self._n_obs_sensor = n_base + 2*n_joint + 2
+        self._obs_sensor = np.zeros(self._n_obs_sensor)
+        self._policy_obs = np.zeros(self._n_obs_sensor + N_OBS_WBC)
+        # Command application, the torque joints are resolved on the first command
+        self._trq_commander = None
+        self._gripper_commander = pybullet_util_rl.MotorCommander(
+            self.robot, self.joint_id, GRIPPER_JOINTS, client=self.client)
+
+        # the sensor reader writes straight into the observation buffer
+        self._sensor_reader = pybullet_util_rl.SensorReader(
+            self.robot, self._obs_joint_id, self.pos_basejoint_to_basecom,
+            self.rot_basejoint_to_basecom, base = self._obs_sensor[0:n_base],
+            joint_pos = self._obs_sensor[self._obs_joint_pos],
+            joint_vel = self._obs_sensor[self._obs_joint_vel], client = self.client)
     
     def step(self, action):
         #residual, self.gripper_command = action[0], action[1]
@@ -306,21 +412,19 @@ class DracoEnv(gym.Env):
         step_flag = [False]
         wbc_obs = None
         while not step_flag[0]:
-            self.obs, self.policy_obs = self._get_observation(wbc_obs)
+            self.obs = self._get_observation()
 
             command, step_flag, wbc_obs = self.interface.get_command((self.obs, action)) # TODO pass in residual
             self._set_motor_command(command)
             self.client.stepSimulation()
-            if self.render: time.sleep(SimConfig.CONTROLLER_DT)
+            if self.render and self.real_time: time.sleep(SimConfig.CONTROLLER_DT)
             done = self._compute_termination(wbc_obs)
             if done: break
 
-
-        self.obs, self.policy_obs = self._get_observation(wbc_obs)
+        # the next step starts by reading the sensors again
+        self.policy_obs = self._policy_observation(wbc_obs)
 
 
-            
-
         reward = self._compute_reward(wbc_obs, action, done)
         info = {
             "gripper_command" : self.gripper_command,
@@ -333,103 +437,53 @@ class DracoEnv(gym.Env):
         self.client.disconnect()
         self.client = None
 
-    def _set_motor_command(self, command) -> None:
-        # Exclude Knee Distal Joints Command
-        del command['joint_trq']['l_knee_fe_jd']
-        del command['joint_trq']['r_knee_fe_jd']
-
-        # Apply Command
-        pybullet_util_rl.set_motor_trq(self.robot,self.joint_id, command['joint_trq'], client=self.client)
-        pybullet_util_rl.set_motor_pos(self.robot,self.joint_id, self.gripper_command, client=self.client)
-
-    def _get_observation(self, wbc_obs = None) -> dict:
-
-         # Get SensorData
-        obs = pybullet_util_rl.get_sensor_data(self.robot,self.joint_id,self.link_id,
-                                                    self.pos_basejoint_to_basecom,
-                                                    self.rot_basejoint_to_basecom, client=self.client)
-        
-        for gripper_joint in GRIPPER_JOINTS:
-            del obs['joint_pos'][gripper_joint]
-            del obs['joint_vel'][gripper_joint]
-
-        rf_height = pybullet_util_rl.get_link_iso(self.robot,
-                                              self.link_id['r_foot_contact'], client=self.client)[2, 3]
-        lf_height = pybullet_util_rl.get_link_iso(self.robot,
-                                              self.link_id['l_foot_contact'], client=self.client)[2, 3]
-        obs['b_rf_contact'] = True if rf_height <= 0.01 else False
-        obs['b_lf_contact'] = True if lf_height <= 0.01 else False
-
-        if wbc_obs is not None:
-            obs_numpy  = dict_to_numpy(self.obs)
-            wbc_np = wbc_obs[0].numpy()
-            obs_numpy  = dict_to_numpy(self.obs)
-            obs_numpy[0:3] -= wbc_np[12:15]
-            policy_obs = np.concatenate((obs_numpy, wbc_np[0:12]))
-        else:
-            policy_obs = None
-        return obs, policy_obs
-    
     def _compute_termination(self, _wbc_obs):
-        #TODO: add more termination
-        condition = torch.any((_wbc_obs[:, 8] < 0.5) | (_wbc_obs[:, 8] > 0.8))  #0.69
-        return condition
-        #return False
+        return torch.any(self._termination_mask(_wbc_obs))
 
     def _compute_reward(self, wbc_obs, action, done):
-        self._old_wbc_obs = self._new_wbc_obs
-        self._new_wbc_obs = wbc_obs
-        self._rl_action = action
-
-        reward = self._w_alive_bonus
-        reward += self.reward_tracking_com_L()
-        reward += self.reward_tracking_yaw()
-        reward += self.reward_com_height()
-        reward += self.reward_roll_pitch()
-        reward += self.penalise_excessive_fp()
-        reward += self.penalise_excessive_yaw()
-        if done: reward -= self._w_termination
+        return self._compute_batch_reward(wbc_obs, action, done).squeeze().item()
 
-        return reward.squeeze().item()
-
-    def reward_tracking_com_L(self):
-        Lx = torch.zeros(AlipParams.N_BATCH, 2)
-        Lx[:, 0] = self._new_wbc_obs[:, 0]*self._Lx_main 
-        #in the code 1 corresponds to current stance foot right
-        # -1 to current stance foot left 
-        # new obs -1 --> ended policy for left foot --> we are at the desired state for end of right stance
-        error = Lx + self._old_wbc_obs[:, 1:3] - self._new_wbc_obs[:, 9:11]  #desired Lx,y - observedLx,y at the end of the step
-        error = torch.sum(torch.square(error), dim = 1)
-        error *= self._w_desired_Lxy
-        return torch.exp(-error)
-    
-    def reward_tracking_yaw(self):
-        error = self._new_wbc_obs[:, 16] - self._old_wbc_obs[:, 16] - self._old_wbc_obs[:, 3]
-        error = torch.square(error)
-        error *= self._w_desired_yaw
-
-        return torch.exp(-error)
+    def _set_motor_command(self, command) -> None:
+        self._apply_motor_command(command.joint_names, command.joint_trq)
 
-    def reward_com_height(self):
-        error = self._new_wbc_obs[:, 8] - AlipParams.ZH
-        error = torch.square(error)
-        error *= self._w_com_height
-        return torch.exp(-error)
+    def _apply_motor_command(self, joint_names, joint_trq) -> None:
+        """
+        joint_trq: [n_joint] torques in the controller joint order joint_names
+        """
+        # the controller joint order is only known from its first command
+        if self._trq_commander is None:
+            self._trq_commander = pybullet_util_rl.MotorCommander(
+                self.robot, self.joint_id, list(joint_names), PASSIVE_JOINTS, client=self.client)
 
-    def reward_roll_pitch(self):
-        error = torch.sum(torch.square(self._new_wbc_obs[:, 14:16]), dim = 1)
-        error *= self._w_roll_pitch 
-        return torch.exp(-error)
-    
-    def penalise_excessive_fp(self):
-        error = torch.sum(torch.square(self._rl_action[:, 0:2]), dim = 1)
-        error *= self._w_excessive_fp
-        return torch.exp(-error)
-    
-    def penalise_excessive_yaw(self): 
-        error = torch.square(self._rl_action[:, 2])
-        error *= self._w_excessive_angle
-        return torch.exp(-error)
+        # Apply Command
+        self._trq_commander.set_trq(joint_trq)
+        self._gripper_commander.set_pos(self._gripper_pos)
+
+    def _get_observation(self) -> dict:
+        """
+        Reads the sensors into the controller sensor dict and into the
+        preallocated observation array
+        """
+        # Get SensorData
+        obs = self._sensor_reader.read()
+
+        foot_states = self.client.getLinkStates(self.robot, self._foot_link_id,
+                                                computeForwardKinematics=1)
+        obs['b_rf_contact'] = foot_states[0][0][2] <= 0.01
+        obs['b_lf_contact'] = foot_states[1][0][2] <= 0.01
+        self._obs_sensor[self._obs_contact] = (obs['b_rf_contact'], obs['b_lf_contact'])
+        return obs
+
+    def _policy_observation(self, wbc_obs):
+        """
+        Policy observation from the last sensor read and the wbc observation,
+        returned as a view on a buffer that the next step overwrites
+        """
+        wbc_np = wbc_obs[0].numpy()
+        self._policy_obs[0:self._n_obs_sensor] = self._obs_sensor
+        self._policy_obs[0:3] -= wbc_np[12:15]
+        self._policy_obs[self._n_obs_sensor:] = wbc_np[0:N_OBS_WBC]
+        return self._policy_obs
 
 
 if __name__ == "__main__":
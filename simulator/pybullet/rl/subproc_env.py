@@ -0,0 +1,225 @@
+import numpy as np
+import torch
+
+import os
+import sys
+
+cwd = os.getcwd()
+sys.path.append(cwd)
+import time
+import multiprocessing as mp
+from multiprocessing import shared_memory
+
+from stable_baselines3.common.vec_env import VecEnv
+
+
+class SharedRolloutBuffer():
+    """
+    Observations, rewards and done flags of n_env workers in one shared
+    memory block, laid out as a ring of n_slots steps:
+        obs [n_slots, n_env, obs_dim], reward [n_slots, n_env],
+        done [n_slots, n_env], truncated [n_slots, n_env]
+    plus the actions [n_env, act_dim] written by the learner and the last
+    observation of terminated episodes [n_env, obs_dim].
+    Every field is a numpy view on the block, nothing is copied.
+    """
+    def __init__(self, n_env, obs_dim, act_dim, n_slots = 2, name = None):
+        self.n_env = n_env
+        self.obs_dim = obs_dim
+        self.act_dim = act_dim
+        self.n_slots = n_slots
+
+        layout = [('obs', np.float64, (n_slots, n_env, obs_dim)),
+                  ('reward', np.float64, (n_slots, n_env)),
+                  ('done', np.bool_, (n_slots, n_env)),
+                  ('truncated', np.bool_, (n_slots, n_env)),
+                  ('action', np.float64, (n_env, act_dim)),
+                  ('terminal_obs', np.float64, (n_env, obs_dim))]
+        size = sum(np.dtype(dtype).itemsize*int(np.prod(shape)) for _, dtype, shape in layout)
+
+        self._b_owner = name is None
+        if self._b_owner:
+            self._shm = shared_memory.SharedMemory(create = True, size = size)
+        else:
+            self._shm = shared_memory.SharedMemory(name = name)
+
+        offset = 0
+        for key, dtype, shape in layout:
+            view = np.ndarray(shape, dtype = dtype, buffer = self._shm.buf, offset = offset)
+            setattr(self, key, view)
+            offset += view.nbytes
+
+    @property
+    def name(self):
+        return self._shm.name
+
+    def args(self):
+        """ Arguments to attach to the same block from another process"""
+        return (self.n_env, self.obs_dim, self.act_dim, self.n_slots, self.name)
+
+    def close(self):
+        # drop the views before releasing the mapping
+        for key in ('obs', 'reward', 'done', 'truncated', 'action', 'terminal_obs'):
+            setattr(self, key, None)
+        self._shm.close()
+        if self._b_owner:
+            self._shm.unlink()
+
+
+def _worker(remote, parent_remote, buffer_args, i, env_fn):
+    parent_remote.close()
+    # one core per worker, intra-op threads would oversubscribe the machine
+    torch.set_num_threads(1)
+    buf = SharedRolloutBuffer(*buffer_args)
+    env = env_fn()
+    try:
+        while True:
+            cmd, data = remote.recv()
+            if cmd == 'step':
+                slot = data
+                obs, reward, terminated, truncated, _ = env.step(buf.action[i].copy())
+                done = bool(terminated) or bool(truncated)
+                if done:
+                    buf.terminal_obs[i] = obs
+                    obs, _ = env.reset()
+                buf.obs[slot, i] = obs
+                buf.reward[slot, i] = reward
+                buf.done[slot, i] = done
+                buf.truncated[slot, i] = bool(truncated) and not bool(terminated)
+                remote.send(True)
+            elif cmd == 'reset':
+                buf.obs[data, i], _ = env.reset()
+                remote.send(True)
+            elif cmd == 'get_attr':
+                remote.send(getattr(env, data))
+            elif cmd == 'set_attr':
+                remote.send(setattr(env, data[0], data[1]))
+            elif cmd == 'env_method':
+                method_name, method_args, method_kwargs = data
+                remote.send(getattr(env, method_name)(*method_args, **method_kwargs))
+            elif cmd == 'close':
+                break
+            else:
+                raise NotImplementedError(cmd)
+    finally:
+        env.close()
+        buf.close()
+        remote.close()
+
+
+def make_draco_env():
+    from simulator.pybullet.rl.env import DracoEnv
+    return DracoEnv(render = False)
+
+
+class DracoSubprocVecEnv(VecEnv):
+    """
+    Worker pool rollout engine, each process steps one DracoEnv and writes
+    the results into a SharedRolloutBuffer. Only the command and the ring
+    slot index go through the pipes on step / reset, get_attr, set_attr and
+    env_method send their arguments and results through them. There is one process per environment
+    since Draco3StateProvider is a per process singleton, so n_env should
+    match the available cores.
+
+    The observations returned by step / reset are views on the ring slot,
+    they stay valid for n_slots - 1 further steps.
+    """
+    def __init__(self, n_env = os.cpu_count(), env_fn = make_draco_env,
+                 n_slots = 2, start_method = 'forkserver'):
+        probe = env_fn()
+        observation_space, action_space = probe.observation_space, probe.action_space
+        probe.close()
+
+        self._buf = SharedRolloutBuffer(n_env, observation_space.shape[0],
+                                        action_space.shape[0], n_slots)
+        self._slot = 0
+
+        ctx = mp.get_context(start_method)
+        self._remotes, self._processes = [], []
+        for i in range(n_env):
+            remote, work_remote = ctx.Pipe()
+            process = ctx.Process(target = _worker, daemon = True,
+                args = (work_remote, remote, self._buf.args(), i, env_fn))
+            process.start()
+            work_remote.close()
+            self._remotes.append(remote)
+            self._processes.append(process)
+        self._b_closed = False
+        # VecEnv.__init__ already queries the workers (render_mode)
+        super(DracoSubprocVecEnv, self).__init__(n_env, observation_space, action_space)
+
+    def _send(self, cmd):
+        for remote in self._remotes:
+            remote.send((cmd, self._slot))
+
+    def _wait(self):
+        for remote in self._remotes:
+            remote.recv()
+
+    def _get_target_remotes(self, indices):
+        return [self._remotes[i] for i in self._get_indices(indices)]
+
+    def reset(self):
+        self._slot = (self._slot + 1) % self._buf.n_slots
+        self._send('reset')
+        self._wait()
+        return self._buf.obs[self._slot]
+
+    def step_async(self, actions):
+        self._buf.action[:] = np.reshape(actions, (self.num_envs, -1))
+        self._slot = (self._slot + 1) % self._buf.n_slots
+        self._send('step')
+
+    def step_wait(self):
+        self._wait()
+        slot = self._slot
+        infos = [{} for _ in range(self.num_envs)]
+        for i in np.flatnonzero(self._buf.done[slot]):
+            infos[i]["terminal_observation"] = self._buf.terminal_obs[i].copy()
+            infos[i]["TimeLimit.truncated"] = bool(self._buf.truncated[slot, i])
+        return self._buf.obs[slot], self._buf.reward[slot], self._buf.done[slot], infos
+
+    def close(self):
+        if self._b_closed:
+            return
+        for remote in self._remotes:
+            remote.send(('close', None))
+        for process in self._processes:
+            process.join()
+        self._buf.close()
+        self._b_closed = True
+
+    def get_attr(self, attr_name, indices = None):
+        target_remotes = self._get_target_remotes(indices)
+        for remote in target_remotes:
+            remote.send(('get_attr', attr_name))
+        return [remote.recv() for remote in target_remotes]
+
+    def set_attr(self, attr_name, value, indices = None):
+        target_remotes = self._get_target_remotes(indices)
+        for remote in target_remotes:
+            remote.send(('set_attr', (attr_name, value)))
+        for remote in target_remotes:
+            remote.recv()
+
+    def env_method(self, method_name, *method_args, indices = None, **method_kwargs):
+        target_remotes = self._get_target_remotes(indices)
+        for remote in target_remotes:
+            remote.send(('env_method', (method_name, method_args, method_kwargs)))
+        return [remote.recv() for remote in target_remotes]
+
+    def env_is_wrapped(self, wrapper_class, indices = None):
+        return [False for _ in self._get_indices(indices)]
+
+
+if __name__ == "__main__":
+    env = DracoSubprocVecEnv(4)
+    obs = env.reset()
+
+    t = time.time()
+    for i in range(10):
+        action = np.zeros((env.num_envs, 3))
+        obs, reward, done, info = env.step(action)
+        print(i, reward, done)
+    print("time", time.time() - t)
+    env.close()
@@ -13,13 +13,27 @@ from stable_baselines3.common.vec_env import DummyVecEnv, SubprocVecEnv
 from env import DracoEnv
 cwd = os.getcwd()
 sys.path.append(cwd)
+from config.draco3_alip_config import AlipParams
+from simulator.pybullet.rl.vec_env import DracoVecEnv
+from simulator.pybullet.rl.subproc_env import DracoSubprocVecEnv
 
 model_dir = cwd + "/rl_model/PPO"
 
 
 
 if __name__ == "__main__":
-    env = DracoEnv(render=False)
+    n_workers = 1 #rollout processes with one DracoEnv each, at most one per core
+    if n_workers > 1:
+        env = DracoSubprocVecEnv(n_workers)
+    elif AlipParams.N_BATCH > 1:
+        #one batched controller for all the environments. It has a single
+        #state machine, so all the worlds are reset when one terminates. The
+        #others are flagged truncated and PPO bootstraps their return from
+        #terminal_observation, so only the state distribution leans towards
+        #early episodes. DracoSubprocVecEnv resets every environment on its own
+        env = DracoVecEnv(AlipParams.N_BATCH)
+    else:
+        env = DracoEnv(render=False)
     new_model = False #TODO: make funciton
     
     ## train model
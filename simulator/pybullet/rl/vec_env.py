@@ -0,0 +1,138 @@
+import numpy as np
+import torch
+
+import os
+import sys
+
+cwd = os.getcwd()
+sys.path.append(cwd)
+import time
+from collections import OrderedDict
+
+from stable_baselines3.common.vec_env import VecEnv
+
+from config.draco3_alip_config import AlipParams
+
+from pnc_pytorch.draco3_pnc.draco3_interface import Draco3Interface
+from simulator.pybullet.rl.env import DracoEnv, DracoReward
+
+
+def stack_sensor_data(obs_list):
+    """
+    Stacks the sensor dicts of every world into one batched sensor dict:
+    base quantities become [n_env, dim] arrays, joint dicts hold [n_env]
+    arrays and contact flags become lists
+    """
+    stacked = OrderedDict()
+    for k, v in obs_list[0].items():
+        if isinstance(v, dict):
+            stacked[k] = OrderedDict()
+            for k2 in v.keys():
+                stacked[k][k2] = np.array([obs[k][k2] for obs in obs_list])
+        elif isinstance(v, bool):
+            stacked[k] = [obs[k] for obs in obs_list]
+        else:
+            stacked[k] = np.stack([obs[k] for obs in obs_list])
+    return stacked
+
+
+class DracoVecEnv(VecEnv, DracoReward):
+    """
+    n_env pybullet DIRECT worlds driven by one batched Draco3Interface
+
+    Every tick reads the sensors of all worlds, runs a single batched
+    WBC / MPC solve and applies row i of the command to world i.
+
+    A step lasts until every environment has asked for a new footstep (or
+    one of them terminates). Environments that finish their step early keep
+    walking with their last action until the slowest one is done.
+    The controller runs all environments in lockstep, so episodes are
+    synchronized: when one environment terminates every world is reset and
+    the others are reported as truncated.
+    """
+    def __init__(self, n_env: int = AlipParams.N_BATCH) -> None:
+        self.envs = [DracoEnv(render = False) for _ in range(n_env)]
+        super(DracoVecEnv, self).__init__(n_env, self.envs[0].observation_space,
+                                          self.envs[0].action_space)
+        self._init_reward(n_env)
+        self.interface = None
+        self._actions = None
+
+    def reset(self):
+        obs_numpy = np.stack([env._reset_world() for env in self.envs])
+
+        if self.interface is None:
+            self.interface = Draco3Interface(self.num_envs)
+        else:
+            self.interface.reset()
+
+        return obs_numpy
+
+    def step_async(self, actions):
+        self._actions = torch.as_tensor(actions).reshape(self.num_envs, -1)
+
+    def step_wait(self):
+        stepped = np.zeros(self.num_envs, dtype = bool)
+        while True:
+            for env in self.envs:
+                env.obs = env._get_observation()
+            sensor_data = stack_sensor_data([env.obs for env in self.envs])
+
+            command, step_flag, wbc_obs = self.interface.get_command((sensor_data, self._actions))
+            self._set_motor_command(command)
+            for env in self.envs:
+                env.client.stepSimulation()
+            done = self._termination_mask(wbc_obs)
+            stepped |= np.array(step_flag)
+            if stepped.all() or torch.any(done): break
+
+        policy_obs = np.stack([env._policy_observation(wbc_obs[i:i+1])
+                               for i, env in enumerate(self.envs)])
+
+        rewards = self._compute_batch_reward(wbc_obs, self._actions, done).numpy()
+        dones = np.full(self.num_envs, torch.any(done).item())
+        infos = [{"gripper_command" : env.gripper_command} for env in self.envs]
+
+        if dones.any():
+            for i in range(self.num_envs):
+                infos[i]["terminal_observation"] = policy_obs[i]
+                infos[i]["TimeLimit.truncated"] = not done[i].item()
+            policy_obs = self.reset()
+
+        return policy_obs, rewards, dones, infos
+
+    def _set_motor_command(self, command) -> None:
+        # with a single environment the controller returns unbatched torques
+        trq = np.atleast_2d(command.joint_trq)
+        for i, env in enumerate(self.envs):
+            env._apply_motor_command(command.joint_names, trq[i])
+
+    def close(self):
+        for env in self.envs:
+            env.close()
+
+    def get_attr(self, attr_name, indices = None):
+        return [getattr(self.envs[i], attr_name) for i in self._get_indices(indices)]
+
+    def set_attr(self, attr_name, value, indices = None):
+        for i in self._get_indices(indices):
+            setattr(self.envs[i], attr_name, value)
+
+    def env_method(self, method_name, *method_args, indices = None, **method_kwargs):
+        return [getattr(self.envs[i], method_name)(*method_args, **method_kwargs)
+                for i in self._get_indices(indices)]
+
+    def env_is_wrapped(self, wrapper_class, indices = None):
+        return [False for _ in self._get_indices(indices)]
+
+
+if __name__ == "__main__":
+    env = DracoVecEnv(4)
+    obs = env.reset()
+
+    t = time.time()
+    for i in range(10):
+        action = np.zeros((env.num_envs, 3))
+        obs, reward, done, info = env.step(action)
+        print(i, reward, done)
+    print("time", time.time() - t)
@@ -0,0 +1,105 @@
+"""
+Main loop plumbing shared by the pybullet simulations
+
+    python simulator/pybullet/draco3_dynamics_main.py --headless --max-speed \
+        --interrupts 2:8,4:5 --duration 10
+
+--headless connects with DIRECT instead of the GUI, --max-speed drops the
+sleep after every step (and the video frames), --interrupts replaces the
+keyboard with a scripted sequence of "sim_time:key" presses and --duration
+stops the simulation after that many simulated seconds. The achieved sim
+time / wall time ratio is reported when the simulation ends.
+"""
+import time
+import argparse
+
+import pybullet as p
+
+
+def parse_interrupts(interrupts):
+    """
+    "2:8,4.5:5" -> [(2.0, '8'), (4.5, '5')] sorted by time
+    """
+    if not interrupts:
+        return []
+    events = []
+    for event in interrupts.split(','):
+        t, key = event.split(':')
+        events.append((float(t), key.strip()))
+    return sorted(events, key = lambda e: e[0])
+
+
+def add_runner_args(parser):
+    parser.add_argument("--headless", action = "store_true",
+                        help = "DIRECT connection, no GUI")
+    parser.add_argument("--max-speed", action = "store_true",
+                        help = "no real time sleep and no video frames")
+    parser.add_argument("--interrupts", type = str, default = None,
+                        help = "scripted key presses, e.g. 2:8,4.5:5")
+    parser.add_argument("--duration", type = float, default = None,
+                        help = "simulated seconds to run")
+    return parser
+
+
+class SimRunner():
+    def __init__(self, dt, b_sleep = True, args = None):
+        """
+        dt (float): controller time step
+        b_sleep (bool): whether GUI runs sleep dt after every step
+        args (argparse.Namespace): runner arguments, parsed from the command
+            line when None
+        """
+        if args is None:
+            args = add_runner_args(argparse.ArgumentParser()).parse_known_args()[0]
+        self._dt = dt
+        self._b_sleep = b_sleep
+        self.b_headless = args.headless
+        self.b_max_speed = args.max_speed
+        self._b_scripted = args.interrupts is not None or args.headless
+        self._interrupts = parse_interrupts(args.interrupts)
+        self._duration = args.duration
+
+        self.t = 0.
+        self.count = 0
+        self._wall_start = None
+
+    def connect(self):
+        return p.connect(p.DIRECT if self.b_headless else p.GUI)
+
+    def b_video_record(self, b_video_record):
+        # camera frames are not rendered at max speed
+        return b_video_record and not self.b_max_speed
+
+    def get_keyboard_events(self):
+        """
+        Keyboard events of the GUI, or the next scripted key press due at the
+        current sim time. Both come in the getKeyboardEvents format, so
+        pybullet_util.is_key_triggered works on either. Scripted presses due
+        at the same time are delivered on consecutive ticks.
+        """
+        if not self._b_scripted:
+            return p.getKeyboardEvents()
+        if self._interrupts and self._interrupts[0][0] <= self.t:
+            _, key = self._interrupts.pop(0)
+            return {ord(key): p.KEY_WAS_TRIGGERED}
+        return {}
+
+    def step(self):
+        """
+        Advances the sim clock, call it after stepSimulation. Returns False
+        once the requested duration has been simulated.
+        """
+        if self._wall_start is None:
+            self._wall_start = time.time()
+        if self._b_sleep and not self.b_max_speed:
+            time.sleep(self._dt)
+        self.t += self._dt
+        self.count += 1
+        return self._duration is None or self.t < self._duration
+
+    def report(self):
+        wall_time = 0. if self._wall_start is None else time.time() - self._wall_start
+        ratio = self.t / wall_time if wall_time > 0. else float('nan')
+        print("sim time {:.3f} s, wall time {:.3f} s, sim/wall {:.2f}".format(
+            self.t, wall_time, ratio))
+        return ratio
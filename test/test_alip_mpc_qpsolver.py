@@ -0,0 +1,97 @@
+import pytest
+import torch
+
+from config.draco3_alip_config import AlipParams
+from pnc_pytorch.planner.locomotion.alip_mpc_qpsolver import ALIPtorch_mpc
+
+N_BATCH = 16
+
+
+def mpc_inputs(seed):
+    """ ALIP states about a walking gait, spread enough to hit the bounds"""
+    g = torch.Generator().manual_seed(seed)
+    randn = lambda *size: torch.randn(*size, generator=g, dtype=torch.double)
+    stance_leg = torch.where(torch.rand(N_BATCH, generator=g) > 0.5, 1., -1.)
+    x = torch.tensor([0., -0.14, 0.1, -0.15], dtype=torch.double) + \
+        0.1 * randn(N_BATCH, 4)
+    x[:, 1] *= -stance_leg
+    Lx_offset = 0.1 * randn(N_BATCH)
+    Ly_des = -3. + 0.2 * randn(N_BATCH)
+    Tr = 0.05 + 0.15 * torch.rand(N_BATCH, generator=g, dtype=torch.double)
+    return stance_leg, x, Lx_offset, Ly_des, Tr
+
+
+def walking_inputs(seed):
+    """ solve_inertia_coor arguments of robots standing on one foot"""
+    g = torch.Generator().manual_seed(seed)
+    randn = lambda *size: torch.randn(*size, generator=g, dtype=torch.double)
+    stance_leg = torch.where(torch.rand(N_BATCH, generator=g) > 0.5, 1., -1.)
+    lfoot_pos = torch.tensor([0., 0.1, 0.], dtype=torch.double) + 0.02 * randn(N_BATCH, 3)
+    rfoot_pos = torch.tensor([0., -0.1, 0.], dtype=torch.double) + 0.02 * randn(N_BATCH, 3)
+    pos = torch.where(stance_leg.unsqueeze(1) == 1, rfoot_pos, lfoot_pos)
+    pos[:, 0:2] += 0.03 * randn(N_BATCH, 2)
+    pos[:, 2] = AlipParams.ZH
+    vel = 0.2 * randn(N_BATCH, 3)
+    yaw = 0.3 * randn(N_BATCH)
+    torso_ori = torch.zeros(N_BATCH, 3, 3, dtype=torch.double)
+    torso_ori[:, 0, 0], torso_ori[:, 0, 1] = yaw.cos(), -yaw.sin()
+    torso_ori[:, 1, 0], torso_ori[:, 1, 1] = yaw.sin(), yaw.cos()
+    torso_ori[:, 2, 2] = 1.
+    Lx_offset = 0.1 * randn(N_BATCH)
+    Ly_des = -3. + 0.2 * randn(N_BATCH)
+    Tr = 0.05 + 0.15 * torch.rand(N_BATCH, generator=g, dtype=torch.double)
+    return (stance_leg, Lx_offset, Ly_des, Tr, torso_ori, pos, vel,
+            lfoot_pos, rfoot_pos)
+
+
+def solve(monkeypatch, condensed, inputs):
+    monkeypatch.setattr(AlipParams, "B_CONDENSED", condensed)
+    monkeypatch.setattr(AlipParams, "B_EXPLICIT_MPC", False)
+    mpc = ALIPtorch_mpc(n_batch=N_BATCH)
+    state_sol, u_sol = mpc.solve_mpc_coor(*inputs)
+    return state_sol, u_sol, mpc.solve_failed.clone(), mpc
+
+
+# a row or two may have no feasible plan, they are left out
+@pytest.mark.filterwarnings("ignore:ALIP MPC:RuntimeWarning")
+@pytest.mark.parametrize("seed", range(3))
+def test_condensed_matches_full(monkeypatch, seed):
+    inputs = mpc_inputs(seed)
+    state_full, u_full, failed_full, _ = solve(monkeypatch, False, inputs)
+    state_cond, u_cond, failed_cond, mpc = solve(monkeypatch, True, inputs)
+
+    ok = ~failed_full & ~failed_cond
+    assert ok.sum() >= N_BATCH - 2
+    torch.testing.assert_close(u_cond[:, ok], u_full[:, ok], rtol=0., atol=1e-6)
+    torch.testing.assert_close(state_cond[:, ok], state_full[:, ok],
+                               rtol=0., atol=1e-5)
+    # the footstep bounds are active on some rows
+    slack = torch.minimum(mpc.u_upper - u_cond, u_cond - mpc.u_lower)
+    assert (slack[:, ok] < 1e-6).any()
+
+
+def test_exp_A_matches_matrix_exp():
+    mpc = ALIPtorch_mpc(n_batch=N_BATCH)
+    t = torch.linspace(0., 2. * AlipParams.TS, 9, dtype=torch.double)
+    expected = torch.linalg.matrix_exp(mpc._A * t.view(-1, 1, 1))
+    torch.testing.assert_close(mpc.exp_A(t), expected, rtol=1e-12, atol=1e-12)
+
+
+def test_masked_replan_matches_subset_solves():
+    mpc = ALIPtorch_mpc(n_batch=N_BATCH)
+    first = torch.arange(N_BATCH) % 3 == 0
+    second = torch.arange(N_BATCH) % 3 == 1
+    inputs = walking_inputs(0)
+    mpc.solve_inertia_coor_masked(first, *inputs)
+    u_first = mpc._u_sol.clone()
+    next_action = mpc.solve_inertia_coor_masked(second, *walking_inputs(1))
+    assert not mpc.solve_failed.any()
+
+    for mask, seed in ((first, 0), (second, 1)):
+        ref = ALIPtorch_mpc(n_batch=int(mask.sum()))
+        sub = [v[mask] for v in walking_inputs(seed)]
+        ref_action = ref.solve_inertia_coor(*sub, None)
+        torch.testing.assert_close(next_action[mask], ref_action, rtol=0., atol=1e-10)
+    # the rows of the first replan are kept, the others were never planned
+    torch.testing.assert_close(mpc._u_sol[:, first], u_first[:, first], rtol=0., atol=0.)
+    assert (next_action[~(first | second)] == 0.).all()
@@ -0,0 +1,60 @@
+import pickle
+
+import numpy as np
+import pytest
+import torch
+
+from util.columnar_history import ColumnarHistory, HistoryReader
+
+
+def history(tick):
+    """ Topics of every kind, some of them change layout or skip ticks"""
+    ticks = {
+        'torch': torch.full((2, 3), float(tick), dtype=torch.double),
+        'numpy': np.arange(4) * tick,
+        'numpy_scalar': np.float64(tick),
+        'float': 0.5 * tick,
+        'bool': tick % 2 == 0,
+        'list': [tick, tick + 1],
+        'object': {'tick': tick},
+        # the shape changes halfway through the first chunk
+        'reshaped': np.zeros(2 if tick < 2 else 3),
+    }
+    if tick % 3 == 0:
+        ticks['sparse'] = torch.tensor([tick])
+    return ticks
+
+
+def assert_same(value, expected):
+    assert type(value) is type(expected)
+    if isinstance(expected, torch.Tensor):
+        assert value.dtype == expected.dtype
+        torch.testing.assert_close(value, expected, rtol=0., atol=0.)
+    elif isinstance(expected, np.ndarray):
+        assert value.dtype == expected.dtype
+        np.testing.assert_array_equal(value, expected)
+    else:
+        assert value == expected
+
+
+@pytest.mark.parametrize("chunk_size", [1, 3, 100])
+def test_round_trip(tmp_path, chunk_size):
+    filename = tmp_path / "history.pkl"
+    n_ticks = 8
+    with open(filename, 'wb') as file:
+        columns = ColumnarHistory(file, chunk_size=chunk_size)
+        for tick in range(n_ticks):
+            columns.append(history(tick))
+        columns.close()
+        # ticks written by the old per tick DataSaver are read as well
+        pickle.dump(history(n_ticks), file)
+
+    with HistoryReader(filename) as reader:
+        for tick in range(n_ticks + 1):
+            ticks = reader.load()
+            expected = history(tick)
+            assert ticks.keys() == expected.keys()
+            for key, value in expected.items():
+                assert_same(ticks[key], value)
+        with pytest.raises(EOFError):
+            reader.load()
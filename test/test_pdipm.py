@@ -0,0 +1,79 @@
+import pytest
+import torch
+
+from pnc_pytorch.wbc.ihwbc.qpth.solvers.pdipm import batch as pdipm
+
+
+def random_qps(n_batch, nz=10, nineq=20, neq=3, seed=0):
+    """ Strictly feasible, strongly convex QPs"""
+    g = torch.Generator().manual_seed(seed)
+    randn = lambda *size: torch.randn(*size, generator=g, dtype=torch.double)
+    M = randn(n_batch, nz, nz)
+    Q = M @ M.transpose(1, 2) + torch.eye(nz, dtype=torch.double)
+    p = randn(n_batch, nz)
+    G = randn(n_batch, nineq, nz)
+    x0 = randn(n_batch, nz)
+    h = (G @ x0.unsqueeze(2)).squeeze(2) + \
+        torch.rand(n_batch, nineq, generator=g, dtype=torch.double)
+    A = randn(n_batch, neq, nz)
+    b = (A @ x0.unsqueeze(2)).squeeze(2)
+    return Q, p, G, h, A, b
+
+
+def solve(Q, p, G, h, A, b, **kwargs):
+    Q_LU, S_LU, R = pdipm.pre_factor_kkt(Q, G, A)
+    n_iters = torch.zeros(Q.size(0), dtype=torch.long)
+    x = pdipm.forward(Q, p, G, h, A, b, Q_LU, S_LU, R, 1e-12, -1, 3, 20,
+                      n_iters=n_iters, **kwargs)[0]
+    return x, n_iters
+
+
+def test_converged_rows_leave_the_batch():
+    qps = random_qps(8, seed=1)
+    x, n_iters = solve(*qps)
+    for i in range(8):
+        x_i, n_iters_i = solve(*[v[i:i + 1] for v in qps])
+        # a row stops at its own convergence, as if it was solved alone
+        assert n_iters[i] == n_iters_i[0]
+        torch.testing.assert_close(x[i:i + 1], x_i, rtol=0., atol=1e-12)
+    assert n_iters.min() < n_iters.max()
+
+
+def test_solution_satisfies_kkt():
+    Q, p, G, h, A, b = qps = random_qps(8, seed=2)
+    x, _ = solve(*qps)
+    torch.testing.assert_close(A @ x.unsqueeze(2), b.unsqueeze(2))
+    assert ((G @ x.unsqueeze(2)).squeeze(2) - h).max() < 1e-9
+
+
+def test_spd_factor_matches_cholesky():
+    Q = random_qps(4, seed=3)[0]
+    data, pivots = pdipm.spd_factor(Q)
+    L = torch.linalg.cholesky(Q)
+    diag = torch.diagonal(L, dim1=-2, dim2=-1)
+    # unpivoted LU of Q: unit lower L D^{-1}, upper D L^T
+    P, L_lu, U = torch.lu_unpack(data, pivots)
+    torch.testing.assert_close(P, torch.eye(10, dtype=torch.double).expand_as(Q))
+    torch.testing.assert_close(L_lu, L / diag.unsqueeze(-2))
+    torch.testing.assert_close(U, diag.unsqueeze(-1) * L.transpose(1, 2))
+    rhs = torch.randn(4, 10, 2, dtype=torch.double)
+    torch.testing.assert_close(torch.linalg.lu_solve(data, pivots, rhs),
+                               torch.linalg.solve(Q, rhs))
+
+
+def test_spd_factor_rejects_indefinite_q():
+    Q = random_qps(3, seed=4)[0]
+    Q[1] -= 100. * torch.eye(10, dtype=torch.double)
+    with pytest.raises(RuntimeError, match=r"batch members \[1\]"):
+        pdipm.spd_factor(Q)
+
+
+def test_masked_rows_match_subset_solves():
+    qps = random_qps(8, seed=5)
+    mask = torch.tensor([1, 0, 1, 1, 0, 0, 1, 0], dtype=torch.bool)
+    x, n_iters = solve(*qps, mask=mask)
+    x_sub, n_iters_sub = solve(*[v[mask] for v in qps])
+    torch.testing.assert_close(x[mask], x_sub, rtol=0., atol=1e-12)
+    assert torch.equal(n_iters[mask], n_iters_sub)
+    # the other rows are dropped after the first iteration
+    assert (n_iters[~mask] == 1).all()
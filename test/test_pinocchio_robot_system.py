@@ -0,0 +1,61 @@
+import os
+import time
+
+import numpy as np
+import pytest
+
+from pnc_pytorch.robot_system.pinocchio_robot_system import PinocchioRobotSystem
+
+cwd = os.getcwd()
+URDF_FILE = cwd + "/robot_model/draco3/draco3.urdf"
+PACKAGE_DIR = cwd + "/robot_model/draco3"
+
+
+def build(cache_dir):
+    return PinocchioRobotSystem(2, URDF_FILE, PACKAGE_DIR, False,
+                                model_cache_dir=cache_dir)
+
+
+def construction_time(cache_dir, n=10):
+    times = []
+    for _ in range(n):
+        t = time.perf_counter()
+        build(cache_dir)
+        times.append(time.perf_counter() - t)
+    return np.median(times)
+
+
+def test_cache_hit_matches_fresh_parse(tmp_path):
+    fresh = build(None)
+    build(str(tmp_path))
+    assert len(os.listdir(tmp_path)) == 2
+    cached = build(str(tmp_path))
+
+    assert cached._joint_id == fresh._joint_id
+    assert cached._link_id == fresh._link_id
+    assert cached._model.nq == fresh._model.nq
+    for attr in ('_joint_q_idx', '_joint_q_dot_idx', '_q_idx_of_joint_idx',
+                 '_joint_pos_limit', '_joint_vel_limit', '_joint_trq_limit'):
+        np.testing.assert_array_equal(getattr(cached, attr), getattr(fresh, attr))
+
+
+def test_cache_hit_is_faster_than_fresh_parse(tmp_path):
+    build(str(tmp_path))
+    t_hit = construction_time(str(tmp_path))
+    t_fresh = construction_time(None)
+    print("cache hit {:.2f} ms, fresh parse {:.2f} ms".format(
+        1e3 * t_hit, 1e3 * t_fresh))
+    assert t_hit < t_fresh
+
+
+@pytest.mark.parametrize('ext', ['.pkl', '.bin'])
+def test_corrupt_cache_is_rebuilt(tmp_path, ext):
+    build(str(tmp_path))
+    cache_file, = [os.path.join(tmp_path, f) for f in os.listdir(tmp_path)
+                   if f.endswith(ext)]
+    with open(cache_file, 'wb') as cache:
+        cache.write(b'garbage')
+    with pytest.warns(UserWarning, match='Unreadable robot model cache'):
+        robot = build(str(tmp_path))
+    assert robot._n_a == build(None)._n_a
+    assert os.path.getsize(cache_file) > len(b'garbage')
@@ -0,0 +1,27 @@
+import torch
+
+from util.util import block_diag_pytorch
+
+
+def test_block_diag_matches_torch():
+    g = torch.Generator().manual_seed(0)
+    n_batch = 4
+    blocks = [torch.randn(n_batch, 2, 3, generator=g, dtype=torch.double),
+              torch.randn(3, 1, generator=g, dtype=torch.double),
+              torch.randn(n_batch, 4, 4, generator=g, dtype=torch.double)]
+    ret = block_diag_pytorch(blocks)
+    for i in range(n_batch):
+        # non batched blocks are shared by every environment
+        expected = torch.block_diag(
+            *[b[i] if b.dim() == 3 else b for b in blocks])
+        torch.testing.assert_close(ret[i], expected, rtol=0., atol=0.)
+
+
+def test_block_diag_out_is_overwritten():
+    g = torch.Generator().manual_seed(1)
+    blocks = [torch.randn(2, 2, 2, generator=g, dtype=torch.double),
+              torch.randn(2, 1, 3, generator=g, dtype=torch.double)]
+    out = torch.full((2, 3, 5), float('nan'), dtype=torch.double)
+    ret = block_diag_pytorch(blocks, out=out)
+    assert ret.data_ptr() == out.data_ptr()
+    torch.testing.assert_close(ret, block_diag_pytorch(blocks), rtol=0., atol=0.)
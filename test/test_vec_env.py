@@ -0,0 +1,64 @@
+import copy
+import multiprocessing
+
+import numpy as np
+import pytest
+import torch
+
+pytest.importorskip("pybullet")
+pytest.importorskip("stable_baselines3")
+
+N_ENV = 3
+N_TICKS = 100
+
+
+def single_env_rollout(n_ticks):
+    """ Sensor data and joint torques of the first ticks of one DracoEnv"""
+    from simulator.pybullet.rl.env import DracoEnv
+
+    env = DracoEnv(render=False)
+    env.reset()
+    action = torch.zeros(1, 3, dtype=torch.double)
+    sensor_data, joint_trq = [], []
+    for _ in range(n_ticks):
+        obs = env._get_observation()
+        command, _, _ = env.interface.get_command((obs, action))
+        sensor_data.append(copy.deepcopy(obs))
+        joint_trq.append(np.array(command.joint_trq))
+        env._set_motor_command(command)
+        env.client.stepSimulation()
+    env.close()
+    return sensor_data, np.array(joint_trq)
+
+
+def batched_replay(sensor_data, n_env):
+    """ Joint torques of one batched controller fed n_env copies of the data"""
+    from pnc_pytorch.draco3_pnc.draco3_interface import Draco3Interface
+    from simulator.pybullet.rl.vec_env import stack_sensor_data
+
+    interface = Draco3Interface(n_env)
+    action = torch.zeros(n_env, 3, dtype=torch.double)
+    joint_trq = []
+    for obs in sensor_data:
+        command, _, _ = interface.get_command(
+            (stack_sensor_data([obs] * n_env), action))
+        joint_trq.append(np.array(command.joint_trq))
+    return np.array(joint_trq)
+
+
+def run_in_process(fn, *args):
+    # Draco3StateProvider is a per process singleton, every controller gets
+    # its own interpreter
+    with multiprocessing.get_context("spawn").Pool(1) as pool:
+        return pool.apply(fn, args)
+
+
+def test_identical_worlds_follow_the_single_env():
+    sensor_data, single_trq = run_in_process(single_env_rollout, N_TICKS)
+    batched_trq = run_in_process(batched_replay, sensor_data, N_ENV)
+
+    assert batched_trq.shape == (N_TICKS, N_ENV, single_trq.shape[1])
+    for i in range(N_ENV):
+        # only the rounding of the batched matmuls may differ
+        np.testing.assert_allclose(batched_trq[:, i], single_trq,
+                                   rtol=0., atol=1e-9)
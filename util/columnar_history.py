@@ -0,0 +1,195 @@
+"""
+Columnar storage of the DataSaver topics
+
+Every topic is appended into a typed, growable buffer, one row per tick,
+so the control thread only copies the value into the buffer. Every
+chunk_size ticks the buffers are handed to a background thread that
+pickles them as one record
+    {CHUNK_KEY: (first_tick, n_ticks), topic: (kind, ticks, values), ...}
+HistoryReader expands the records back into the per tick dicts of the
+old DataSaver files (which it also reads).
+"""
+import copy
+import pickle
+import queue
+import threading
+from collections import deque
+
+import numpy as np
+
+CHUNK_KEY = '__columnar_chunk__'
+
+
+def _to_array(value):
+    """
+    kind, array of a topic value. kind restores the original type when
+    reading: 'torch', 'numpy', 'scalar' (python number or bool), 'list' or
+    'object' for anything without a fixed numeric layout
+    """
+    if hasattr(value, 'detach'):
+        return 'torch', value.detach().cpu().numpy()
+    if isinstance(value, np.ndarray):
+        kind = 'numpy'
+    elif isinstance(value, (bool, int, float, np.generic)):
+        kind = 'scalar' if not isinstance(value, np.generic) else 'numpy'
+    elif isinstance(value, (list, tuple)):
+        kind = 'list'
+    else:
+        return 'object', None
+    try:
+        arr = np.asarray(value)
+    except ValueError:
+        return 'object', None
+    if arr.dtype == object:
+        return 'object', None
+    return kind, arr
+
+
+def _from_array(kind, row):
+    if kind == 'torch':
+        import torch
+        return torch.as_tensor(row)
+    if kind == 'scalar':
+        return row.item()
+    if kind == 'list':
+        return row.tolist()
+    return row
+
+
+class _Column():
+    """
+    Typed buffer of one topic, the capacity doubles when it is full.
+    A value whose type, dtype or shape differs from the first one turns
+    the column into a list of copies.
+    """
+    def __init__(self, kind, arr, capacity = 64):
+        self.kind = kind
+        self.n = 0
+        self.ticks = np.empty(capacity, dtype = np.int64)
+        if kind == 'object':
+            self.values = []
+        else:
+            self.values = np.empty((capacity,) + arr.shape, dtype = arr.dtype)
+
+    def append(self, tick, value, kind, arr):
+        if self.n == self.ticks.shape[0]:
+            self._grow()
+        if self.kind != 'object' and (kind != self.kind or arr.dtype != self.values.dtype
+                                      or arr.shape != self.values.shape[1:]):
+            self.values = [_from_array(self.kind, row) for row in self.values[:self.n]]
+            self.kind = 'object'
+        if self.kind == 'object':
+            self.values.append(copy.deepcopy(value))
+        else:
+            self.values[self.n] = arr
+        self.ticks[self.n] = tick
+        self.n += 1
+
+    def _grow(self):
+        capacity = 2 * self.ticks.shape[0]
+        ticks = np.empty(capacity, dtype = np.int64)
+        ticks[:self.n] = self.ticks[:self.n]
+        self.ticks = ticks
+        if self.kind != 'object':
+            values = np.empty((capacity,) + self.values.shape[1:], dtype = self.values.dtype)
+            values[:self.n] = self.values[:self.n]
+            self.values = values
+
+    def record(self):
+        return self.kind, self.ticks[:self.n], self.values[:self.n]
+
+
+class ColumnarHistory():
+    """
+    Columnar buffers of the current chunk and the thread writing the full
+    chunks to file
+    """
+    def __init__(self, file, chunk_size = 1000):
+        self._file = file
+        self._chunk_size = chunk_size
+        self._columns = dict()
+        self._tick = 0
+        self._chunk_start = 0
+
+        self._queue = queue.Queue()
+        self._writer = threading.Thread(target = self._write, daemon = True)
+        self._writer.start()
+
+    def append(self, history):
+        """
+        Stores the values of history as the next tick
+        """
+        for key, value in history.items():
+            kind, arr = _to_array(value)
+            column = self._columns.get(key)
+            if column is None:
+                column = self._columns[key] = _Column(kind, arr)
+            column.append(self._tick, value, kind, arr)
+        self._tick += 1
+        if self._tick - self._chunk_start == self._chunk_size:
+            self.flush()
+
+    def flush(self):
+        """
+        Hands the current chunk over to the writer thread
+        """
+        if self._tick == self._chunk_start:
+            return
+        self._queue.put((self._chunk_start, self._tick - self._chunk_start, self._columns))
+        self._columns = dict()
+        self._chunk_start = self._tick
+
+    def close(self):
+        self.flush()
+        self._queue.put(None)
+        self._writer.join()
+
+    def _write(self):
+        while True:
+            chunk = self._queue.get()
+            if chunk is None:
+                break
+            first_tick, n_ticks, columns = chunk
+            record = {CHUNK_KEY: (first_tick, n_ticks)}
+            for key, column in columns.items():
+                record[key] = column.record()
+            pickle.dump(record, self._file, protocol = pickle.HIGHEST_PROTOCOL)
+            self._file.flush()
+
+
+class HistoryReader():
+    """
+    Reads a DataSaver file one tick at a time, load() returns the dict of
+    topics saved at that tick and raises EOFError at the end of the file,
+    like pickle.load on the per tick files
+    """
+    def __init__(self, filename):
+        self._file = open(filename, 'rb')
+        self._ticks = deque()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self._file.close()
+
+    def load(self):
+        while not self._ticks:
+            record = pickle.load(self._file)
+            if isinstance(record, dict) and CHUNK_KEY in record:
+                self._ticks = self._expand(record)
+            else:
+                return record
+        return self._ticks.popleft()
+
+    @staticmethod
+    def _expand(record):
+        first_tick, n_ticks = record.pop(CHUNK_KEY)
+        ticks = [dict() for _ in range(n_ticks)]
+        for key, (kind, tick_ids, values) in record.items():
+            for tick, row in zip(tick_ids.tolist(), values):
+                ticks[tick - first_tick][key] = _from_array(kind, row)
+        return deque(ticks)
@@ -5,8 +5,6 @@ from collections import OrderedDict
 import pybullet as p
 import numpy as np
 #from tqdm import tqdm
-import cv2
-import imageio
 
 from util import util
 from util import liegroup
@@ -243,8 +241,51 @@ def set_motor_pos_vel(robot, joint_id, pos_cmd, vel_cmd):
                                 targetVelocities=list(vel_applied.values()))
 
 
+class MotorCommander():
+    """
+    Array based command application. The pybullet indices of joint_names
+    (the order of the command arrays) are resolved once, and the entries
+    of excluded_joints (e.g. passive joints driven by a gear constraint)
+    are masked out of every command. Each set_* call is a single
+    setJointMotorControlArray on client (the pybullet module or a
+    BulletClient).
+    """
+    def __init__(self, robot, joint_id, joint_names, excluded_joints = (),
+                 client = p):
+        self._robot = robot
+        self._client = client
+        self._mask = np.array([k not in excluded_joints for k in joint_names],
+                              dtype = bool)
+        self._joint_idx = [joint_id[k] for k, b_cmd in zip(joint_names, self._mask)
+                           if b_cmd]
+
+    def set_trq(self, trq_cmd):
+        self._client.setJointMotorControlArray(self._robot,
+                                               self._joint_idx,
+                                               controlMode=self._client.TORQUE_CONTROL,
+                                               forces=np.asarray(trq_cmd)[self._mask].tolist())
+
+    def set_pos(self, pos_cmd):
+        self._client.setJointMotorControlArray(self._robot,
+                                               self._joint_idx,
+                                               controlMode=self._client.POSITION_CONTROL,
+                                               targetPositions=np.asarray(pos_cmd)[self._mask].tolist())
+
+    def set_pos_vel(self, pos_cmd, vel_cmd):
+        self._client.setJointMotorControlArray(self._robot,
+                                               self._joint_idx,
+                                               controlMode=self._client.POSITION_CONTROL,
+                                               targetPositions=np.asarray(pos_cmd)[self._mask].tolist(),
+                                               targetVelocities=np.asarray(vel_cmd)[self._mask].tolist())
+
+
+# SensorReader of every (client, robot, joints, base offset) get_sensor_data
+# has been called with
+_SENSOR_READERS = dict()
+
+
 def get_sensor_data(robot, joint_id, link_id, pos_basejoint_to_basecom,
-                    rot_basejoint_to_basecom):
+                    rot_basejoint_to_basecom, client = p):
     """
     Parameters
     ----------
@@ -258,6 +299,8 @@ def get_sensor_data(robot, joint_id, link_id, pos_basejoint_to_basecom,
         SO(3) from base joint frame to base com frame
     b_fixed_Base (bool);
         Whether the robot is floating or fixed
+    client (module or BulletClient):
+        pybullet connection of the robot
     Returns
     -------
     sensor_data (dict):
@@ -286,52 +329,100 @@ def get_sensor_data(robot, joint_id, link_id, pos_basejoint_to_basecom,
         b_lf_contact (bool):
             Left Foot Contact Switch
     """
-    sensor_data = OrderedDict()
-
-    # Handle Base Frame Quantities
-    base_com_pos, base_com_quat = p.getBasePositionAndOrientation(robot)
-    sensor_data['base_com_pos'] = np.asarray(base_com_pos)
-    sensor_data['base_com_quat'] = np.asarray(base_com_quat)
-
-    base_com_lin_vel, base_com_ang_vel = p.getBaseVelocity(robot)
-    sensor_data['base_com_lin_vel'] = np.asarray(base_com_lin_vel)
-    sensor_data['base_com_ang_vel'] = np.asarray(base_com_ang_vel)
-
-    rot_world_com = util.quat_to_rot(np.copy(sensor_data['base_com_quat']))
-    rot_world_joint = np.dot(rot_world_com,
-                             rot_basejoint_to_basecom.transpose())
-    sensor_data['base_joint_pos'] = sensor_data['base_com_pos'] - np.dot(
-        rot_world_joint, pos_basejoint_to_basecom)
-    sensor_data['base_joint_quat'] = util.rot_to_quat(rot_world_joint)
-    trans_joint_com = liegroup.RpToTrans(rot_basejoint_to_basecom,
-                                         pos_basejoint_to_basecom)
-    adT_joint_com = liegroup.Adjoint(trans_joint_com)
-    twist_com_in_world = np.zeros(6)
-    twist_com_in_world[0:3] = np.copy(sensor_data['base_com_ang_vel'])
-    twist_com_in_world[3:6] = np.copy(sensor_data['base_com_lin_vel'])
-    augrot_com_world = np.zeros((6, 6))
-    augrot_com_world[0:3, 0:3] = rot_world_com.transpose()
-    augrot_com_world[3:6, 3:6] = rot_world_com.transpose()
-    twist_com_in_com = np.dot(augrot_com_world, twist_com_in_world)
-    twist_joint_in_joint = np.dot(adT_joint_com, twist_com_in_com)
-    rot_world_joint = np.dot(rot_world_com,
-                             rot_basejoint_to_basecom.transpose())
-    augrot_world_joint = np.zeros((6, 6))
-    augrot_world_joint[0:3, 0:3] = rot_world_joint
-    augrot_world_joint[3:6, 3:6] = rot_world_joint
-    twist_joint_in_world = np.dot(augrot_world_joint, twist_joint_in_joint)
-    sensor_data['base_joint_lin_vel'] = np.copy(twist_joint_in_world[3:6])
-    sensor_data['base_joint_ang_vel'] = np.copy(twist_joint_in_world[0:3])
-
-    # Joint Quantities
-    sensor_data['joint_pos'] = OrderedDict()
-    sensor_data['joint_vel'] = OrderedDict()
-    for k, v in joint_id.items():
-        js = p.getJointState(robot, v)
-        sensor_data['joint_pos'][k] = js[0]
-        sensor_data['joint_vel'][k] = js[1]
-
-    return sensor_data
+    key = (id(client), robot, tuple(joint_id.items()),
+           np.asarray(pos_basejoint_to_basecom, dtype = np.float64).tobytes(),
+           np.asarray(rot_basejoint_to_basecom, dtype = np.float64).tobytes())
+    reader = _SENSOR_READERS.get(key)
+    if reader is None:
+        # the reader keeps client alive, so its id is not reused
+        reader = _SENSOR_READERS[key] = SensorReader(
+            robot, joint_id, pos_basejoint_to_basecom,
+            rot_basejoint_to_basecom, client = client)
+    return reader.read()
+
+
+class SensorReader():
+    """
+    Batched get_sensor_data. The joint index array and the base joint to
+    base com offset are resolved once, every read makes one getJointStates
+    call and fills the preallocated arrays
+        base (np.array): [26] base_com pos, quat, lin vel, ang vel followed by
+            base_joint pos, quat, lin vel, ang vel, all in world
+        joint_pos, joint_vel (np.array): [n_joint] in joint_id order
+    The arrays can be passed in to read straight into views of a larger
+    buffer.
+    """
+    BASE_KEYS = OrderedDict([
+        ('base_com_pos', slice(0, 3)), ('base_com_quat', slice(3, 7)),
+        ('base_com_lin_vel', slice(7, 10)), ('base_com_ang_vel', slice(10, 13)),
+        ('base_joint_pos', slice(13, 16)), ('base_joint_quat', slice(16, 20)),
+        ('base_joint_lin_vel', slice(20, 23)), ('base_joint_ang_vel', slice(23, 26))])
+
+    def __init__(self, robot, joint_id, pos_basejoint_to_basecom,
+                 rot_basejoint_to_basecom, base = None, joint_pos = None,
+                 joint_vel = None, client = p):
+        self._robot = robot
+        self._client = client
+        self._joint_names = list(joint_id.keys())
+        self._joint_idx = list(joint_id.values())
+        self._pos_basejoint_to_basecom = np.asarray(pos_basejoint_to_basecom, dtype = np.float64)
+        self._rot_basecom_to_basejoint = np.ascontiguousarray(
+            np.asarray(rot_basejoint_to_basecom, dtype = np.float64).transpose())
+        # base joint orientation is base com orientation times this quaternion
+        self._quat_basecom_to_basejoint = util.rot_to_quat(self._rot_basecom_to_basejoint)
+
+        n_joint = len(self._joint_idx)
+        self.base = np.zeros(26) if base is None else base
+        self.joint_pos = np.zeros(n_joint) if joint_pos is None else joint_pos
+        self.joint_vel = np.zeros(n_joint) if joint_vel is None else joint_vel
+
+    def read(self, b_dict = True):
+        """
+        Fills base, joint_pos and joint_vel and returns the sensor dict of
+        get_sensor_data (without contact flags) when b_dict is set
+        """
+        base = self.base
+        base_com_pos, base_com_quat = self._client.getBasePositionAndOrientation(self._robot)
+        base_com_lin_vel, base_com_ang_vel = self._client.getBaseVelocity(self._robot)
+        base[0:3] = base_com_pos
+        base[3:7] = base_com_quat
+        base[7:10] = base_com_lin_vel
+        base[10:13] = base_com_ang_vel
+
+        # base joint pose and twist, the frames are rigidly attached so
+        #   w_joint = w_com, v_joint = v_com + (R_world_joint p) x w_com
+        rot_world_com = np.reshape(self._client.getMatrixFromQuaternion(base_com_quat), (3, 3))
+        rot_world_joint = rot_world_com @ self._rot_basecom_to_basejoint
+        pos_joint_to_com = rot_world_joint @ self._pos_basejoint_to_basecom
+        base[13:16] = base[0:3] - pos_joint_to_com
+        base[16:20] = quat_mul(base[3:7], self._quat_basecom_to_basejoint)
+        base[20:23] = base[7:10] + np.cross(pos_joint_to_com, base[10:13])
+        base[23:26] = base[10:13]
+
+        joint_states = self._client.getJointStates(self._robot, self._joint_idx)
+        self.joint_pos[:] = [js[0] for js in joint_states]
+        self.joint_vel[:] = [js[1] for js in joint_states]
+
+        if not b_dict:
+            return None
+        sensor_data = OrderedDict()
+        for k, sl in self.BASE_KEYS.items():
+            sensor_data[k] = base[sl].copy()
+        sensor_data['joint_pos'] = OrderedDict(zip(self._joint_names, self.joint_pos.tolist()))
+        sensor_data['joint_vel'] = OrderedDict(zip(self._joint_names, self.joint_vel.tolist()))
+        return sensor_data
+
+
+def quat_mul(q1, q2):
+    """
+    Hamilton product of scalar last quaternions
+    """
+    x1, y1, z1, w1 = q1
+    x2, y2, z2, w2 = q2
+    return (w1*x2 + x1*w2 + y1*z2 - z1*y2,
+            w1*y2 - x1*z2 + y1*w2 + z1*x2,
+            w1*z2 + x1*y2 - y1*x2 + z1*w2,
+            w1*w2 - x1*x2 - y1*y2 - z1*z2)
 
 
 def get_camera_image_from_link(robot, link, pic_width, pic_height, fov,
@@ -362,6 +453,8 @@ def get_camera_image_from_link(robot, link, pic_width, pic_height, fov,
 
 
 def make_video(video_dir, delete_jpgs=True):
+    import cv2
+    import imageio
     images = []
     for file in tqdm(sorted(os.listdir(video_dir)),
                      desc='converting jpgs to gif'):
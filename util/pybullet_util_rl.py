@@ -5,11 +5,13 @@ from collections import OrderedDict
 import pybullet as p
 import numpy as np
 #from tqdm import tqdm
-import cv2
-import imageio
 
 from util import util
 from util import liegroup
+from util import pybullet_util
+# one implementation of the array based readers / commanders, the rl
+# callers pass their BulletClient
+from util.pybullet_util import MotorCommander, SensorReader, quat_mul
 
 
 def get_robot_config(robot,
@@ -287,52 +289,9 @@ def get_sensor_data(robot, joint_id, link_id, pos_basejoint_to_basecom,
         b_lf_contact (bool):
             Left Foot Contact Switch
     """
-    sensor_data = OrderedDict()
-
-    # Handle Base Frame Quantities
-    base_com_pos, base_com_quat = client.getBasePositionAndOrientation(robot)
-    sensor_data['base_com_pos'] = np.asarray(base_com_pos)
-    sensor_data['base_com_quat'] = np.asarray(base_com_quat)
-
-    base_com_lin_vel, base_com_ang_vel = client.getBaseVelocity(robot)
-    sensor_data['base_com_lin_vel'] = np.asarray(base_com_lin_vel)
-    sensor_data['base_com_ang_vel'] = np.asarray(base_com_ang_vel)
-
-    rot_world_com = util.quat_to_rot(np.copy(sensor_data['base_com_quat']))
-    rot_world_joint = np.dot(rot_world_com,
-                             rot_basejoint_to_basecom.transpose())
-    sensor_data['base_joint_pos'] = sensor_data['base_com_pos'] - np.dot(
-        rot_world_joint, pos_basejoint_to_basecom)
-    sensor_data['base_joint_quat'] = util.rot_to_quat(rot_world_joint)
-    trans_joint_com = liegroup.RpToTrans(rot_basejoint_to_basecom,
-                                         pos_basejoint_to_basecom)
-    adT_joint_com = liegroup.Adjoint(trans_joint_com)
-    twist_com_in_world = np.zeros(6)
-    twist_com_in_world[0:3] = np.copy(sensor_data['base_com_ang_vel'])
-    twist_com_in_world[3:6] = np.copy(sensor_data['base_com_lin_vel'])
-    augrot_com_world = np.zeros((6, 6))
-    augrot_com_world[0:3, 0:3] = rot_world_com.transpose()
-    augrot_com_world[3:6, 3:6] = rot_world_com.transpose()
-    twist_com_in_com = np.dot(augrot_com_world, twist_com_in_world)
-    twist_joint_in_joint = np.dot(adT_joint_com, twist_com_in_com)
-    rot_world_joint = np.dot(rot_world_com,
-                             rot_basejoint_to_basecom.transpose())
-    augrot_world_joint = np.zeros((6, 6))
-    augrot_world_joint[0:3, 0:3] = rot_world_joint
-    augrot_world_joint[3:6, 3:6] = rot_world_joint
-    twist_joint_in_world = np.dot(augrot_world_joint, twist_joint_in_joint)
-    sensor_data['base_joint_lin_vel'] = np.copy(twist_joint_in_world[3:6])
-    sensor_data['base_joint_ang_vel'] = np.copy(twist_joint_in_world[0:3])
-
-    # Joint Quantities
-    sensor_data['joint_pos'] = OrderedDict()
-    sensor_data['joint_vel'] = OrderedDict()
-    for k, v in joint_id.items():
-        js = client.getJointState(robot, v)
-        sensor_data['joint_pos'][k] = js[0]
-        sensor_data['joint_vel'][k] = js[1]
-
-    return sensor_data
+    return pybullet_util.get_sensor_data(robot, joint_id, link_id,
+                                         pos_basejoint_to_basecom,
+                                         rot_basejoint_to_basecom, client = client)
 
 
 def get_camera_image_from_link(robot, link, pic_width, pic_height, fov,
@@ -363,6 +322,8 @@ def get_camera_image_from_link(robot, link, pic_width, pic_height, fov,
 
 
 def make_video(video_dir, delete_jpgs=True):
+    import cv2
+    import imageio
     images = []
     for file in tqdm(sorted(os.listdir(video_dir)),
                      desc='converting jpgs to gif'):
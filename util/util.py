@@ -138,6 +138,37 @@ def weighted_pinv_pytorch(A, W, rtol=1e-15):
         torch.bmm(A.transpose(1,2),
                torch.linalg.pinv(torch.bmm(torch.bmm(A, W), A.transpose(1,2)), rtol=rtol)))
 
+def block_diag_pytorch(mat_list, out=None):
+    """
+    Batched torch.block_diag
+
+    Parameters
+    ----------
+    mat_list (list of torch.tensor([n_batch, row_i, col_i])):
+        Blocks. Non batched torch.tensor([row_i, col_i]) blocks are shared
+        by every environment
+    out (torch.tensor([n_batch, sum(row_i), sum(col_i)])):
+        Optional preallocated output, overwritten in place
+
+    Returns
+    -------
+    ret (torch.tensor([n_batch, sum(row_i), sum(col_i)]))
+    """
+    n_row = sum(mat.shape[-2] for mat in mat_list)
+    n_col = sum(mat.shape[-1] for mat in mat_list)
+    if out is None:
+        n_batch = next(mat.shape[0] for mat in mat_list if mat.dim() == 3)
+        out = torch.zeros(n_batch, n_row, n_col, dtype=mat_list[0].dtype)
+    else:
+        assert out.shape[1] == n_row and out.shape[2] == n_col
+        out.zero_()
+    row, col = 0, 0
+    for mat in mat_list:
+        out[:, row:row + mat.shape[-2], col:col + mat.shape[-1]] = mat
+        row += mat.shape[-2]
+        col += mat.shape[-1]
+    return out
+
 def get_sinusoid_trajectory(start_time, mid_point, amp, freq, eval_time):
     dim = amp.shape[0]
     p, v, a = np.zeros(dim), np.zeros(dim), np.zeros(dim)